@@ -0,0 +1,329 @@
+"""批量导出引擎
+
+每张源图先在渲染进程中 解码 → 绘制水印，再交给编码进程按 EncoderSettings 编码写盘，
+像素经共享内存传递。主进程只负责调度、汇报进度和处理取消。Qt 的绘制调用不释放 GIL，
+因此这里用进程池而不是线程池，才能用满所有 CPU 核心；PNG 等编码慢的格式也不会拖住渲染。
+
+输出先写到同目录的临时文件再改名，中断时不会留下写了一半的图片；
+给出 ExportManifest 时，已导出且未变化的任务直接跳过。
+"""
+import os
+import signal
+import threading
+
+import stats
+from encoder import EncoderSettings
+from manifest import atomic_tmp_path, spec_digest
+
+
+SUPPORTED_FORMATS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def output_path_for(src, out_dir, output_format, prefix="", suffix=""):
+    name, _ = os.path.splitext(os.path.basename(src))
+    return os.path.join(out_dir, f"{prefix}{name}{suffix}.{output_format.lower()}")
+
+
+class OutputNames:
+    """为源文件分配输出路径
+
+    不同文件夹中同名或只有扩展名不同的源文件（a/1.jpg、b/1.jpg、1.png）按分配顺序依次加 _2、_3… 区分；
+    同一个源文件总是得到同一个路径。按相同顺序分配时结果不变，重复导出时清单能照常跳过。
+    """
+
+    def __init__(self, out_dir, output_format, prefix="", suffix=""):
+        self.out_dir = out_dir
+        self.output_format = output_format
+        self.prefix = prefix
+        self.suffix = suffix
+        self._assigned = {}  # 源文件 -> 输出路径
+        self._taken = set()  # 已分配的输出路径（normcase）
+
+    def get(self, src):
+        dst = self._assigned.get(src)
+        if dst is None:
+            dst = output_path_for(src, self.out_dir, self.output_format, self.prefix, self.suffix)
+            base, ext = os.path.splitext(dst)
+            n = 1
+            while os.path.normcase(dst) in self._taken:
+                n += 1
+                dst = f"{base}_{n}{ext}"
+            self._taken.add(os.path.normcase(dst))
+            self._assigned[src] = dst
+        return dst
+
+    def forget(self, src):
+        """释放 src 的输出路径（源文件已删除），之后可以分配给其它源文件"""
+        dst = self._assigned.pop(src, None)
+        if dst is not None:
+            self._taken.discard(os.path.normcase(dst))
+
+
+def output_jobs(sources, out_dir, output_format, prefix="", suffix=""):
+    """[(src, dst), ...]，输出路径互不相同"""
+    names = OutputNames(out_dir, output_format, prefix, suffix)
+    return [(src, names.get(src)) for src in sources]
+
+
+def _init_worker(collect_stats=False, backend="qpainter"):
+    # 工作进程没有显示器，字体渲染只需要一个离屏的 QGuiApplication
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    from PySide6.QtGui import QGuiApplication
+    from renderer import set_backend
+    global _app
+    if QGuiApplication.instance() is None:
+        _app = QGuiApplication([])
+    # 统计开关和合成后端与主进程一致
+    stats.set_enabled(collect_stats)
+    set_backend(backend)
+
+
+def _init_warm_worker(collect_stats, backend, specs):
+    """常驻进程池（watch、serve）的初始化：Ctrl+C 交给主进程处理，预先导入模块并按 specs 各画一次水印"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(collect_stats, backend)
+    _warm(specs)
+
+
+def _warm(specs):
+    # 导入解码、编码模块并加载字体，第一个任务不必承担这些开销
+    from PySide6.QtGui import QImage
+    from PIL import Image, JpegImagePlugin, PngImagePlugin  # noqa: F401
+    import image_cache  # noqa: F401
+    import encoder  # noqa: F401
+    from renderer import composite
+
+    for spec in specs:
+        canvas = QImage(256, 256, QImage.Format_RGB32)
+        canvas.fill(0)
+        composite(canvas, spec)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _atomic_write(dst, write):
+    """write(tmp) 写到同目录的临时文件，返回真值时改名为 dst；返回 False 表示不适用"""
+    tmp = atomic_tmp_path(dst)
+    try:
+        if write(tmp) is False:
+            _remove(tmp)
+            return False
+        os.replace(tmp, dst)
+    except BaseException:
+        _remove(tmp)
+        raise
+    if stats.enabled:
+        stats.count("bytes_written", os.path.getsize(dst))
+    return True
+
+
+def _render(src, dst, output_format, spec, settings):
+    """走得通局部处理时直接写出 dst 并返回 None，否则返回 (加好水印的整图, 原图元数据)
+
+    源文件只读一次：元数据从读入内存的文件头解析，解码也使用同一份数据。
+    """
+    from image_cache import decode_data
+    from metadata import metadata_from_bytes, read_metadata
+    from renderer import composite
+
+    if (
+        output_format.upper() == "TIFF" and src.lower().endswith((".tif", ".tiff"))
+        and settings.keep_metadata and read_metadata(src).orientation == 1
+    ):
+        # 未压缩的 TIFF 只处理与水印相交的分块，内存占用与整图大小无关；原文件的标签原样保留
+        from tiled import export_tiled
+        if _atomic_write(dst, lambda tmp: export_tiled(src, tmp, spec)):
+            return None
+
+    with open(src, "rb") as f:
+        data = f.read()
+    stats.count("bytes_read", len(data))
+    metadata = metadata_from_bytes(data)
+    if (
+        output_format.upper() == "JPEG" and src.lower().endswith((".jpg", ".jpeg"))
+        and settings.allows_jpeg_passthrough() and metadata.orientation == 1
+    ):
+        # 带重启标记的 JPEG 只重编码水印所在的条带（需要转正的照片走常规路径）
+        from jpeg_passthrough import export_jpeg_passthrough
+        if _atomic_write(dst, lambda tmp: export_jpeg_passthrough(src, tmp, spec, data)):
+            return None
+
+    # 批量导出每张图只读一次，不放进缓存，免得每个工作进程各占一份内存预算
+    image, _ = decode_data(data, metadata=metadata)
+    if image.isNull():
+        raise IOError(f"无法读取图片：{src}")
+    return composite(image, spec), metadata
+
+
+def export_one(src, dst, output_format, spec, settings=None):
+    """在当前进程中完成一张图片的 解码 → 绘制水印 → 编码，原子地写到 dst"""
+    from encoder import encode_image
+
+    settings = settings or EncoderSettings()
+    rendered = _render(src, dst, output_format, spec, settings)
+    if rendered is not None:
+        image, metadata = rendered
+        _atomic_write(dst, lambda tmp: encode_image(image, tmp, output_format, settings, metadata))
+    return dst
+
+
+def _collect(func, *args):
+    """在工作进程中执行 func，统计打开时把本任务的统计增量一并带回主进程"""
+    return func(*args), stats.drain()
+
+
+def render_one(src, dst, output_format, spec, settings):
+    """渲染阶段（在渲染进程中执行）：返回共享内存中的像素，已直接写出时返回 None"""
+    from encoder import to_shared
+
+    rendered = _render(src, dst, output_format, spec, settings)
+    if rendered is None:
+        return None
+    image, metadata = rendered
+    return to_shared(image, output_format, settings, metadata)
+
+
+def encode_one(buffer, dst, output_format, settings):
+    """编码阶段（在编码进程中执行）：编码共享内存中的像素并原子地写到 dst"""
+    from encoder import encode_shared
+
+    _atomic_write(dst, lambda tmp: encode_shared(buffer, tmp, output_format, settings))
+    return dst
+
+
+class BatchExporter:
+    """按 (src, dst) 任务列表并行导出，spec 为 renderer.WatermarkSpec
+
+    progress 回调签名为 progress(done, total, src, error)，error 为 None 表示成功。
+    cancel() 可在任意线程调用：停止派发新任务，已在执行的任务完成后 run() 返回。
+    给出 manifest（manifest.ExportManifest）时跳过已是最新的任务，跳过的输出路径记在 skipped 中，
+    计入 done 但不逐个回调 progress。输出路径与前面的任务重复时该任务直接失败（用 output_jobs 生成任务可避免）。
+    max_workers 和 encode_workers 分别是渲染和编码进程数，默认都等于 CPU 核心数；
+    两个阶段的在途任务总数有上限，共享内存的占用不会随任务数增长。
+    """
+
+    def __init__(self, spec, jobs, output_format="JPEG", max_workers=None, manifest=None,
+                 settings=None, encode_workers=None):
+        self.spec = spec
+        self.jobs = list(jobs)
+        self.output_format = output_format
+        self.settings = settings or EncoderSettings()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.encode_workers = encode_workers or os.cpu_count() or 1
+        self.manifest = manifest
+        self.skipped = []
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self, progress=None):
+        """执行导出，返回 (成功的输出路径列表, [(src, 错误信息), ...])"""
+        total = len(self.jobs)
+        written, failed = [], []
+        self.skipped = []
+        digest = spec_digest(self.spec, self.output_format, self.settings)
+        todo = []
+        owners = {}  # 输出路径（normcase） -> 源文件
+        for src, dst in self.jobs:
+            owner = owners.setdefault(os.path.normcase(dst), src)
+            if owner != src:
+                failed.append((src, f"输出文件与 {owner} 的重名：{dst}"))
+                continue
+            stamp = self.manifest.source_stamp(src) if self.manifest else None
+            if self.manifest and self.manifest.is_up_to_date(src, dst, digest, stamp):
+                self.skipped.append(dst)
+            else:
+                todo.append((src, dst, stamp))
+        if progress:
+            for i, (src, error) in enumerate(failed, len(self.skipped) + 1):
+                progress(i, total, src, ValueError(error))
+        if not todo:
+            if total and progress and not failed:
+                progress(total, total, None, None)
+            return written, failed
+
+        try:
+            self._run(todo, total, digest, written, failed, progress)
+        finally:
+            if self.manifest:
+                self.manifest.close()
+        return written, failed
+
+    def _run(self, todo, total, digest, written, failed, progress):
+        # 进程池相关模块只在真正导出时导入，不拖慢界面启动
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+        from encoder import release_shared
+        from renderer import get_backend
+
+        skipped = len(self.skipped)
+        workers = min(self.max_workers, len(todo))
+        encoders = min(self.encode_workers, len(todo))
+        # 在途任务数有上限：既让每个核心都有活干，又能及时响应取消
+        window = workers * 2
+        ctx = multiprocessing.get_context("spawn")
+        collect = stats.enabled
+        with ProcessPoolExecutor(
+                workers, mp_context=ctx, initializer=_init_worker,
+                initargs=(collect, get_backend())) as render_pool, \
+                ProcessPoolExecutor(
+                    encoders, mp_context=ctx, initializer=stats.set_enabled, initargs=(collect,)) as encode_pool:
+            pending = {}  # future -> (阶段, 任务)
+            queue = iter(todo)
+            exhausted = False
+            while True:
+                while not exhausted and not self.cancelled and len(pending) < window:
+                    job = next(queue, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    future = render_pool.submit(
+                        _collect, render_one, job[0], job[1], self.output_format, self.spec, self.settings
+                    )
+                    pending[future] = ("render", job)
+                if not pending:
+                    break
+                if collect:
+                    in_render = sum(1 for stage, _ in pending.values() if stage == "render")
+                    stats.gauge("queue.render", in_render)
+                    stats.gauge("queue.encode", len(pending) - in_render)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, job = pending.pop(future)
+                    src, dst, stamp = job
+                    error = future.exception()
+                    result = None
+                    if error is None:
+                        result, worker_stats = future.result()
+                        stats.merge(worker_stats)
+                    if error is None and stage == "render":
+                        buffer = result
+                        if buffer is not None:
+                            # 已在途的任务即使取消也要编码完，共享内存由编码进程释放
+                            try:
+                                encoded = encode_pool.submit(
+                                    _collect, encode_one, buffer, dst, self.output_format, self.settings
+                                )
+                            except BaseException:
+                                release_shared(buffer)
+                                raise
+                            pending[encoded] = ("encode", job)
+                            continue
+                    if error is None:
+                        written.append(dst)
+                        if self.manifest:
+                            self.manifest.record(src, dst, digest, stamp, self.output_format)
+                    else:
+                        failed.append((src, str(error)))
+                    if progress:
+                        progress(skipped + len(written) + len(failed), total, src, error)
@@ -0,0 +1,272 @@
+"""基准测试：分阶段测量 解码、预览缩放、水印绘制、编码和端到端导出的耗时
+
+测试图片在本地按固定种子生成并缓存在工作目录中，多次运行使用完全相同的输入。
+结果以 JSON 输出，可以用 compare() 与之前保存的结果比较，发现性能回退。
+
+    python src/main.py bench --sizes 1mp,12mp --out bench.json
+    python src/main.py bench --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+BENCH_VERSION = 1
+
+# 名称 -> (宽, 高)
+SIZES = {
+    "1mp": (1224, 816),
+    "12mp": (4240, 2832),
+    "45mp": (8256, 5504),
+    "tiff": (12000, 9000),  # 未压缩的大 TIFF，用于测分块导出
+}
+DEFAULT_SIZES = ("tiff", "1mp", "12mp", "45mp")  # 大 TIFF 放在最前，峰值内存不被其它阶段掩盖
+STAGES = ("decode", "preview", "render", "encode", "export")
+PREVIEW_SIZE = (1280, 800)
+
+
+def _ensure_app():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtGui import QGuiApplication
+    return QGuiApplication.instance() or QGuiApplication([])
+
+
+def peak_rss_mb():
+    """进程至今的峰值常驻内存（MB）"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _noise_tile(seed=2024, size=256):
+    from PIL import Image
+    rng = random.Random(seed)
+    return Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+
+
+def synthetic_image(width, height, seed=2024):
+    """渐变底色叠加固定种子的噪声纹理，压缩率接近真实照片"""
+    from PIL import Image
+    gradient = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    base = Image.merge("RGB", (gradient, radial, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    noise = Image.new("RGB", (width, height))
+    tile = _noise_tile(seed)
+    for y in range(0, height, tile.height):
+        for x in range(0, width, tile.width):
+            noise.paste(tile, (x, y))
+    return Image.blend(base, noise, 0.25)
+
+
+def prepare_inputs(work_dir, names):
+    """生成（或复用已缓存的）测试图片，返回 {尺寸名: {格式: 路径}}"""
+    os.makedirs(work_dir, exist_ok=True)
+    inputs = {}
+    for name in names:
+        width, height = SIZES[name]
+        files = {}
+        formats = ("tiff",) if name == "tiff" else ("jpeg", "png")
+        image = None
+        for fmt in formats:
+            path = os.path.join(work_dir, f"bench-v{BENCH_VERSION}-{name}.{fmt}")
+            if not os.path.exists(path):
+                if image is None:
+                    image = synthetic_image(width, height)
+                tmp = path + ".tmp"
+                options = {"quality": 90} if fmt == "jpeg" else {}
+                image.save(tmp, fmt.upper(), **options)
+                os.replace(tmp, path)
+            files[fmt] = path
+        inputs[name] = files
+    return inputs
+
+
+def measure(func, repeat, setup=None):
+    """调用 func repeat 次，返回每次的耗时（秒）；给出 setup 时在计时外调用，结果作为 func 的参数"""
+    samples = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def render_cases():
+    from renderer import WatermarkSpec
+    base = WatermarkSpec(text="© Watermark Studio", font_size=36, font_scale=0.036)
+    return {
+        "plain": base,
+        "shadow": replace(base, shadow_enabled=True),
+        "outline": replace(base, outline_enabled=True),
+        "shadow+outline+rot30": replace(base, shadow_enabled=True, outline_enabled=True, watermark_angle=30),
+        "tile+rot30": replace(base, watermark_pos_mode="tile", watermark_angle=30),
+    }
+
+
+def run(sizes=DEFAULT_SIZES, stages=STAGES, repeat=3, work_dir=None, log=None):
+    """执行基准测试，返回可 JSON 序列化的结果字典"""
+    _ensure_app()
+    from PySide6.QtCore import QSize
+    from image_cache import decode_image
+    from renderer import BACKENDS, composite, get_backend, set_backend, watermark_rect
+    from encoder import EncoderSettings, encode_image
+    from batch import export_one
+
+    work_dir = work_dir or os.path.join(tempfile.gettempdir(), "watermark-bench")
+    out_dir = os.path.join(work_dir, "out")
+    os.makedirs(out_dir, exist_ok=True)
+    # 在子进程中生成测试图片，生成时的内存占用不计入本进程的峰值
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        inputs = pool.submit(prepare_inputs, work_dir, tuple(sizes)).result()
+    results = []
+
+    def record(stage, case, name, samples):
+        width, height = SIZES[name]
+        median = statistics.median(samples)
+        entry = {
+            "stage": stage,
+            "case": case,
+            "size": name,
+            "megapixels": round(width * height / 1e6, 2),
+            "seconds": [round(s, 5) for s in samples],
+            "median": round(median, 5),
+            "images_per_sec": round(1 / median, 3) if median > 0 else None,
+            "mp_per_sec": round(width * height / 1e6 / median, 2) if median > 0 else None,
+        }
+        results.append(entry)
+        if log:
+            log(f"{stage:8} {case:28} {name:5} {median * 1000:9.1f} ms  {entry['images_per_sec'] or 0:8.2f} 张/秒")
+
+    # 可用的合成后端都测一遍，numpy 后端的输出同时与 QPainter 比较
+    original_backend = get_backend()
+    backends = []
+    for backend in BACKENDS:
+        try:
+            set_backend(backend)
+            backends.append(backend)
+        except ValueError:
+            pass
+    set_backend(original_backend)
+    if "numpy" in backends:
+        import numpy_backend
+
+    spec = render_cases()["plain"]
+    for name in sizes:
+        files = inputs[name]
+        if name == "tiff":
+            # 大 TIFF 只测端到端导出：走分块路径，内存与整图大小无关
+            if "export" in stages:
+                dst = os.path.join(out_dir, f"{name}.tiff")
+                record("export", "tiff->tiff", name, measure(
+                    lambda: export_one(files["tiff"], dst, "TIFF", spec), repeat))
+            continue
+
+        if "decode" in stages:
+            for fmt, path in files.items():
+                record("decode", fmt, name, measure(lambda: decode_image(path), repeat))
+
+        if "preview" in stages:
+            target = QSize(*PREVIEW_SIZE)
+
+            def preview():
+                image, full = decode_image(files["jpeg"], target)
+                composite(image, spec, image.width() / full.width())
+            record("preview", "decode+render", name, measure(preview, repeat))
+
+        image, _ = decode_image(files["jpeg"])
+        if "render" in stages:
+            for case, case_spec in render_cases().items():
+                outputs = {}
+                for backend in backends:
+                    set_backend(backend)
+                    composite(image.copy(), case_spec)  # 预热图块缓存，测的是批量导出中每张图的开销
+                    label = case if backend == "qpainter" else f"{case}@{backend}"
+                    record("render", label, name, measure(
+                        lambda canvas: composite(canvas, case_spec), repeat, setup=image.copy))
+                    outputs[backend] = composite(image.copy(), case_spec)
+                if "numpy" in outputs:
+                    # 在水印覆盖的区域内与 QPainter 的输出比较
+                    rect = watermark_rect(
+                        case_spec, image.width(), image.height(), image.dotsPerMeterX(), image.dotsPerMeterY()
+                    )
+                    mean, p99, _ = numpy_backend.difference(
+                        outputs["qpainter"].copy(rect), outputs["numpy"].copy(rect)
+                    )
+                    results[-1].update(
+                        diff_mean=round(mean, 3), diff_p99=p99,
+                        within_tolerance=mean <= numpy_backend.MAX_MEAN_DIFF and p99 <= numpy_backend.MAX_P99_DIFF,
+                    )
+                    if log and not results[-1]["within_tolerance"]:
+                        log(f"  与 QPainter 的差异超出容差：平均 {mean:.2f}，99 分位 {p99:.0f}")
+            set_backend(original_backend)
+
+        if "encode" in stages:
+            rendered = composite(image.copy(), spec)
+            for case, fmt, settings in (
+                ("jpeg", "JPEG", EncoderSettings()),
+                ("png-6", "PNG", EncoderSettings(png_compress_level=6)),
+                ("png-1", "PNG", EncoderSettings(png_compress_level=1)),
+                ("webp", "WEBP", EncoderSettings()),
+                ("tiff", "TIFF", EncoderSettings()),
+            ):
+                dst = os.path.join(out_dir, f"{name}-{case}.{fmt.lower()}")
+                record("encode", case, name, measure(
+                    lambda: encode_image(rendered, dst, fmt, settings), repeat))
+            del rendered
+        del image
+
+        if "export" in stages:
+            dst = os.path.join(out_dir, f"{name}-export.jpeg")
+            record("export", "jpeg->jpeg", name, measure(
+                lambda: export_one(files["jpeg"], dst, "JPEG", spec), repeat))
+
+    return {
+        "version": BENCH_VERSION,
+        "meta": environment(),
+        "repeat": repeat,
+        "results": results,
+        # ru_maxrss 只增不减，是整次运行的峰值，不能归到某个阶段
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def environment():
+    import PySide6
+    import PIL
+    return {
+        "python": platform.python_version(),
+        "pyside6": PySide6.__version__,
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(baseline, current, threshold=0.1, min_delta=0.002):
+    """比较两次结果的中位耗时，返回 [(阶段, 用例, 尺寸, 旧, 新, 比值, 是否回退)]
+
+    变慢不足 min_delta 秒的项不算回退，亚毫秒级的项只有计时噪声。
+    """
+    old = {(r["stage"], r["case"], r["size"]): r["median"] for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        key = (r["stage"], r["case"], r["size"])
+        if key not in old or not old[key]:
+            continue
+        ratio = r["median"] / old[key]
+        slower = ratio > 1 + threshold and r["median"] - old[key] > min_delta
+        rows.append((*key, old[key], r["median"], ratio, slower))
+    return rows
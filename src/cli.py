@@ -0,0 +1,382 @@
+"""命令行入口（无界面，可在没有显示器的服务器上运行）
+
+    python src/main.py batch --template templates/1.json --in DIR --out DIR --jobs N
+    python src/main.py watch --template 1 --in DIR --out DIR
+    python src/main.py serve --port 8765
+    python src/main.py loadtest --image photo.jpg --template 1 --concurrency 8
+    python src/main.py bench --sizes 1mp,12mp --out bench.json
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+import stats
+from batch import BatchExporter, output_jobs
+from encoder import EncoderSettings, OUTPUT_FORMATS, SUBSAMPLING_MODES
+from manifest import ExportManifest
+from renderer import BACKENDS, WatermarkSpec, logo_size, set_backend
+from scanner import iter_images
+from templates import read_template
+
+
+def collect_images(root):
+    return sorted(iter_images([root]))
+
+
+def _prepare(args):
+    """检查模板和文件夹、应用合成后端，返回 (spec, 编码参数)；出错时输出原因并返回 None"""
+    try:
+        spec = WatermarkSpec.from_template(read_template(args.template))
+    except (OSError, ValueError, TypeError) as e:
+        print(f"错误：{e}", file=sys.stderr)
+        return None
+    if not spec.has_watermark:
+        print("错误：模板中没有水印文本或水印图片", file=sys.stderr)
+        return None
+    if spec.watermark_type == "image" and logo_size(spec, 1, 1) is None:
+        print(f"错误：无法读取水印图片：{spec.logo_path}", file=sys.stderr)
+        return None
+    if not os.path.isdir(args.input):
+        print(f"错误：输入文件夹不存在：{args.input}", file=sys.stderr)
+        return None
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        print("错误：不能导出到原文件夹！", file=sys.stderr)
+        return None
+    if args.backend:
+        try:
+            set_backend(args.backend)
+        except ValueError as e:
+            print(f"错误：{e}", file=sys.stderr)
+            return None
+    os.makedirs(args.output, exist_ok=True)
+
+    settings = EncoderSettings(
+        jpeg_quality=args.quality,
+        jpeg_progressive=args.progressive,
+        jpeg_subsampling=args.subsampling,
+        png_compress_level=args.png_level,
+        webp_quality=args.quality if args.quality is not None else EncoderSettings.webp_quality,
+        webp_lossless=args.lossless,
+        keep_metadata=not args.strip_metadata,
+    )
+    return spec, settings
+
+
+def run_batch(args):
+    prepared = _prepare(args)
+    if prepared is None:
+        return 2
+    spec, settings = prepared
+    output_format = args.format.upper()
+    jobs = output_jobs(collect_images(args.input), args.output, output_format, args.prefix, args.suffix)
+    # 清单记录已导出的文件，重复运行或中断后续跑时跳过未变化的文件
+    manifest = None if args.force else ExportManifest(args.output)
+    exporter = BatchExporter(
+        spec, jobs, output_format, max_workers=args.jobs, manifest=manifest,
+        settings=settings, encode_workers=args.encode_jobs,
+    )
+
+    if args.trace or args.stats:
+        stats.enable()
+    started = time.perf_counter()
+
+    def progress(done, total, src, error):
+        if error is not None:
+            print(f"失败：{src}：{error}", file=sys.stderr)
+        elif not args.quiet and (done == total or done % 100 == 0):
+            print(f"[{done}/{total}]", file=sys.stderr)
+
+    try:
+        written, failed = exporter.run(progress)
+    except KeyboardInterrupt:
+        exporter.cancel()
+        print("已取消", file=sys.stderr)
+        return 130
+    elapsed = time.perf_counter() - started
+    if not args.quiet:
+        rate = len(written) / elapsed * 60 if elapsed > 0 else 0
+        print(
+            f"完成：成功 {len(written)} 张，跳过未变化的 {len(exporter.skipped)} 张，失败 {len(failed)} 张，"
+            f"用时 {elapsed:.1f} 秒（{rate:.0f} 张/分钟）",
+            file=sys.stderr,
+        )
+    if args.stats:
+        print("\n".join(stats.summary_lines()), file=sys.stderr)
+    if args.trace:
+        try:
+            stats.dump_trace(args.trace)
+        except OSError as e:
+            print(f"错误：无法写入跟踪文件：{e}", file=sys.stderr)
+            return 2
+    return 1 if failed else 0
+
+
+def run_watch(args):
+    from watch import FolderWatcher
+
+    prepared = _prepare(args)
+    if prepared is None:
+        return 2
+    spec, settings = prepared
+    manifest = None if args.force else ExportManifest(args.output)
+    watcher = FolderWatcher(
+        spec, args.input, args.output, args.format.upper(), settings, max_workers=args.jobs,
+        manifest=manifest, prefix=args.prefix, suffix=args.suffix, settle=args.settle,
+        poll=args.poll, poll_interval=args.poll_interval,
+    )
+    if args.stats:
+        stats.enable()
+
+    def report(src, dst, error, latency):
+        if error is not None:
+            print(f"失败：{src}：{error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"{src} -> {dst}（{latency * 1000:.0f} ms）", file=sys.stderr)
+
+    if not args.quiet:
+        print(f"正在监视 {args.input}，按 Ctrl+C 停止", file=sys.stderr)
+    processed, failed = watcher.run(report)
+    if not args.quiet:
+        mode = "inotify" if watcher.source is not None and watcher.source.fileno() is not None else "轮询"
+        print(
+            f"已停止（{mode}）：处理 {processed} 张，跳过未变化的 {watcher.skipped} 张，失败 {failed} 张",
+            file=sys.stderr,
+        )
+    if args.stats:
+        print("\n".join(stats.summary_lines()), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_serve(args):
+    from server import WatermarkServer, WatermarkService
+
+    if args.backend:
+        try:
+            set_backend(args.backend)
+        except ValueError as e:
+            print(f"错误：{e}", file=sys.stderr)
+            return 2
+    if args.stats:
+        stats.enable()
+    service = WatermarkService(max_workers=args.jobs, max_queue=args.max_queue)
+    try:
+        server = WatermarkServer(args.host, args.port, service, verbose=args.verbose)
+    except OSError as e:
+        print(f"错误：无法监听 {args.host}:{args.port}：{e}", file=sys.stderr)
+        return 2
+    service.start()
+    print(
+        f"水印服务已启动：{server.url}（{service.max_workers} 个工作进程，最多 {service.capacity} 个在途请求），"
+        "按 Ctrl+C 停止",
+        file=sys.stderr,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+def run_loadtest(args):
+    from urllib.parse import quote
+    from server import DEFAULT_PORT, load_test
+
+    try:
+        with open(args.image, "rb") as f:
+            payload = f.read()
+    except OSError as e:
+        print(f"错误：{e}", file=sys.stderr)
+        return 2
+    url = args.url or f"http://127.0.0.1:{DEFAULT_PORT}/watermark?template={quote(args.template)}"
+    result = load_test(url, payload, args.concurrency, args.requests)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result["status"].get("200") == args.requests else 1
+
+
+def _names(value, allowed):
+    names = tuple(n.strip() for n in value.split(",") if n.strip())
+    unknown = [n for n in names if n not in allowed]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"可选值：{','.join(allowed)}")
+    return names
+
+
+def _quality(value):
+    # 与服务端 quality 参数的检查一致
+    try:
+        quality = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("必须是整数")
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError("应在 1-100 之间")
+    return quality
+
+
+def run_bench(args):
+    import bench
+
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"错误：无法读取基准结果：{e}", file=sys.stderr)
+            return 2
+
+    log = None if args.quiet else (lambda line: print(line, file=sys.stderr))
+    result = bench.run(args.sizes, args.stages, args.repeat, args.work_dir, log)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    elif baseline is None:
+        print(text)
+
+    if baseline is None:
+        return 0
+    regressed = 0
+    for stage, case, size, old, new, ratio, slower in bench.compare(baseline, result, args.threshold):
+        mark = "  回退" if slower else ""
+        print(f"{stage:8} {case:28} {size:5} {old * 1000:9.1f} -> {new * 1000:9.1f} ms  x{ratio:.2f}{mark}")
+        regressed += slower
+    if regressed:
+        print(f"{regressed} 项比基准慢 {args.threshold:.0%} 以上", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _add_export_arguments(parser):
+    """batch 和 watch 共用的导出参数"""
+    parser.add_argument("--jobs", type=int, default=None, help="工作进程数，默认等于 CPU 核心数")
+    parser.add_argument(
+        "--format", default="JPEG", type=str.upper, choices=OUTPUT_FORMATS, help="输出格式"
+    )
+    parser.add_argument("--quality", type=_quality, default=None, help="JPEG/WebP 质量（1-100），JPEG 默认沿用原图")
+    parser.add_argument("--progressive", action="store_true", help="输出渐进式 JPEG")
+    parser.add_argument("--subsampling", default="auto", choices=SUBSAMPLING_MODES, help="JPEG 色度抽样")
+    parser.add_argument("--png-level", type=int, default=6, choices=range(10), metavar="0-9", help="PNG 压缩级别")
+    parser.add_argument("--lossless", action="store_true", help="输出无损 WebP")
+    parser.add_argument("--strip-metadata", action="store_true", help="不把原图的 EXIF 和 ICC 配置文件写入输出")
+    parser.add_argument("--prefix", default="", help="输出文件名前缀")
+    parser.add_argument("--suffix", default="_watermarked", help="输出文件名后缀")
+    parser.add_argument(
+        "--backend", default=None, choices=BACKENDS,
+        help="合成后端，默认 qpainter（或环境变量 WATERMARK_BACKEND）；numpy 需要安装 NumPy",
+    )
+
+
+def _batch_arguments(parser):
+    parser.add_argument("--template", required=True, help="模板文件路径或 templates 目录中的模板名")
+    parser.add_argument("--in", dest="input", required=True, help="输入文件夹（递归扫描）")
+    parser.add_argument("--out", dest="output", required=True, help="输出文件夹")
+    _add_export_arguments(parser)
+    parser.add_argument("--encode-jobs", type=int, default=None, help="编码进程数，默认等于 CPU 核心数")
+    parser.add_argument("--force", action="store_true", help="忽略导出清单，重新导出所有图片")
+    parser.add_argument("--stats", action="store_true", help="结束时输出各阶段耗时、缓存命中率等统计")
+    parser.add_argument("--trace", default=None, help="把统计和跟踪事件写到该 JSON 文件（Chrome 跟踪格式）")
+    parser.add_argument("--quiet", action="store_true", help="只输出错误信息")
+    parser.set_defaults(func=run_batch)
+
+
+def _watch_arguments(parser):
+    from watch import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE
+
+    parser.add_argument("--template", required=True, help="模板文件路径或 templates 目录中的模板名")
+    parser.add_argument("--in", dest="input", required=True, help="监视的输入文件夹（含子文件夹）")
+    parser.add_argument("--out", dest="output", required=True, help="输出文件夹")
+    _add_export_arguments(parser)
+    parser.add_argument("--force", action="store_true", help="忽略导出清单，启动时重新处理已有的图片")
+    parser.add_argument(
+        "--settle", type=float, default=DEFAULT_SETTLE,
+        help="未收到写完事件的文件，大小和修改时间保持不变多少秒后才处理",
+    )
+    parser.add_argument("--poll", action="store_true", help="不用 inotify，定时扫描（网络盘上 inotify 收不到事件）")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="定时扫描的间隔秒数")
+    parser.add_argument("--stats", action="store_true", help="停止时输出各阶段耗时等统计")
+    parser.add_argument("--quiet", action="store_true", help="只输出错误信息")
+    parser.set_defaults(func=run_watch)
+
+
+def _serve_arguments(parser):
+    from server import DEFAULT_PORT
+
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认只接受本机连接")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--jobs", type=int, default=None, help="工作进程数，默认等于 CPU 核心数")
+    parser.add_argument(
+        "--max-queue", type=int, default=None,
+        help="工作进程都在忙时最多排队的请求数，超出返回 503；默认等于进程数",
+    )
+    parser.add_argument(
+        "--backend", default=None, choices=BACKENDS,
+        help="合成后端，默认 qpainter（或环境变量 WATERMARK_BACKEND）；numpy 需要安装 NumPy",
+    )
+    parser.add_argument("--stats", action="store_true", help="在 /metrics 中附带各阶段耗时统计")
+    parser.add_argument("--verbose", action="store_true", help="逐个输出请求日志")
+    parser.set_defaults(func=run_serve)
+
+
+def _loadtest_arguments(parser):
+    parser.add_argument("--image", required=True, help="作为请求体发送的图片")
+    parser.add_argument("--template", default="1", help="模板名")
+    parser.add_argument("--url", default=None, help="完整的请求地址，默认为本机默认端口的 /watermark")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发连接数")
+    parser.add_argument("--requests", type=int, default=200, help="请求总数")
+    parser.set_defaults(func=run_loadtest)
+
+
+def _bench_arguments(parser):
+    import bench
+
+    parser.add_argument(
+        "--sizes", default=bench.DEFAULT_SIZES, type=lambda v: _names(v, tuple(bench.SIZES)),
+        help=f"逗号分隔的图片尺寸，可选 {','.join(bench.SIZES)}",
+    )
+    parser.add_argument(
+        "--stages", default=bench.STAGES, type=lambda v: _names(v, bench.STAGES),
+        help=f"逗号分隔的阶段，可选 {','.join(bench.STAGES)}",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取中位数")
+    parser.add_argument("--work-dir", default=None, help="测试图片和输出的目录，默认在系统临时目录")
+    parser.add_argument("--out", default=None, help="结果 JSON 的保存路径，默认打印到标准输出")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果 JSON 比较")
+    parser.add_argument("--threshold", type=float, default=0.1, help="中位耗时变慢超过该比例视为回退")
+    parser.add_argument("--quiet", action="store_true", help="不输出逐项耗时")
+    parser.set_defaults(func=run_bench)
+
+
+# 子命令名 -> (帮助, 添加参数的函数)
+COMMANDS = {
+    "batch": ("按模板批量加水印", _batch_arguments),
+    "watch": ("监视文件夹，持续给新放入的图片加水印", _watch_arguments),
+    "serve": ("本地 HTTP 水印服务", _serve_arguments),
+    "loadtest": ("对水印服务做本地压测，输出延迟分位数和吞吐量", _loadtest_arguments),
+    "bench": ("分阶段基准测试", _bench_arguments),
+}
+
+
+def build_parser(command=None):
+    """command 给出时只为该子命令添加参数，其它子命令的模块（bench、server、watch）不必导入"""
+    parser = argparse.ArgumentParser(prog="watermark-studio", description="Watermark Studio 命令行工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, (help_text, add_arguments) in COMMANDS.items():
+        sub_parser = sub.add_parser(name, help=help_text)
+        if command is None or command == name:
+            add_arguments(sub_parser)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser(argv[0] if argv else None).parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""导出编码设置与编码阶段
+
+加好水印的像素交给 Pillow 编码，可以控制 JPEG 质量、渐进式和色度抽样、PNG 压缩级别，
+并支持 WebP。批量导出时渲染和编码在两个进程池中进行，像素经 multiprocessing.shared_memory
+传递，不经过 pickle 复制；PNG 这类编码慢的格式不会占住渲染进程。
+
+Pillow 和 shared_memory 在首次编码时才导入，界面启动时只需要这里的设置和常量。
+"""
+from dataclasses import dataclass, asdict, replace
+
+from PySide6.QtGui import QImage
+
+import stats
+
+
+OUTPUT_FORMATS = ("JPEG", "PNG", "TIFF", "WEBP")
+SUBSAMPLING_MODES = ("auto", "4:4:4", "4:2:2", "4:2:0")
+# JPEG 的一个 APP1 段最多容纳的 EXIF 字节数
+MAX_JPEG_EXIF = 65533
+
+
+@dataclass(frozen=True)
+class EncoderSettings:
+    """每次导出的编码参数，各格式只读取与自己相关的字段"""
+    jpeg_quality: int = None  # None：局部重编码时沿用原图量化表，否则为编码器默认值 75
+    jpeg_progressive: bool = False
+    jpeg_subsampling: str = "auto"  # auto 表示与原图一致（局部重编码）或编码器默认值
+    png_compress_level: int = 6  # 0-9，越大文件越小、编码越慢
+    webp_quality: int = 80
+    webp_lossless: bool = False
+    keep_metadata: bool = True  # 把原图的 EXIF（方向改为 1）和 ICC 配置文件写入输出
+
+    def allows_jpeg_passthrough(self):
+        """只有不要求改变质量、扫描方式和抽样、且保留元数据时，才能沿用原图的编码数据和文件头"""
+        return (
+            self.jpeg_quality is None and not self.jpeg_progressive and self.jpeg_subsampling == "auto"
+            and self.keep_metadata
+        )
+
+    def save_options(self, output_format):
+        """Pillow 的 save 参数"""
+        fmt = output_format.upper()
+        if fmt == "JPEG":
+            options = {"progressive": self.jpeg_progressive}
+            if self.jpeg_quality is not None:
+                options["quality"] = self.jpeg_quality
+            if self.jpeg_subsampling != "auto":
+                options["subsampling"] = self.jpeg_subsampling
+            return options
+        if fmt == "PNG":
+            return {"compress_level": self.png_compress_level}
+        if fmt == "WEBP":
+            return {"quality": self.webp_quality, "lossless": self.webp_lossless}
+        return {}
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass(frozen=True)
+class PixelBuffer:
+    """放在共享内存中的一张待编码图像"""
+    name: str
+    mode: str  # Pillow 模式：RGB / RGBA / L
+    width: int
+    height: int
+    stride: int
+    dpi: tuple
+    exif: bytes = None
+    icc: bytes = None
+
+
+def _pixel_layout(image, output_format):
+    """转换为 Pillow 能直接读取的像素格式，返回 (QImage, Pillow 模式)"""
+    if image.format() == QImage.Format_Grayscale8:
+        return image, "L"
+    if image.hasAlphaChannel() and output_format.upper() != "JPEG":
+        return image.convertToFormat(QImage.Format_RGBA8888), "RGBA"
+    return image.convertToFormat(QImage.Format_RGB888), "RGB"
+
+
+def _dpi(image):
+    return image.dotsPerMeterX() * 0.0254, image.dotsPerMeterY() * 0.0254
+
+
+def _export_metadata(metadata, output_format, settings):
+    """(exif, icc)：不保留元数据或原图没有时为 None"""
+    if metadata is None or not settings.keep_metadata:
+        return None, None
+    exif = metadata.exif_for_export()
+    if exif is not None and output_format.upper() == "JPEG" and len(exif) > MAX_JPEG_EXIF:
+        exif = None  # 放不进一个 APP1 段
+    return exif, metadata.icc
+
+
+def save_with_pillow(im, dst, output_format, settings, dpi, exif=None, icc=None):
+    options = settings.save_options(output_format)
+    if output_format.upper() != "WEBP":
+        options["dpi"] = dpi
+    if exif:
+        options["exif"] = exif
+    if icc:
+        options["icc_profile"] = icc
+    with stats.span("encode", format=output_format.upper()):
+        im.save(dst, output_format.upper(), **options)
+
+
+def encode_image(image, dst, output_format, settings, metadata=None):
+    """在当前进程中把 QImage 编码写到 dst；metadata 为原图的 metadata.Metadata"""
+    from PIL import Image
+    pixels, mode = _pixel_layout(image, output_format)
+    # 直接读 QImage 的像素内存，不先复制成 bytes
+    im = Image.frombuffer(
+        mode, (pixels.width(), pixels.height()), pixels.constBits(),
+        "raw", mode, pixels.bytesPerLine(), 1,
+    )
+    exif, icc = _export_metadata(metadata, output_format, settings)
+    save_with_pillow(im, dst, output_format, settings, _dpi(image), exif, icc)
+
+
+def to_shared(image, output_format, settings, metadata=None):
+    """把 QImage 的像素复制进一块新的共享内存，由 encode_shared 负责释放"""
+    with stats.span("share"):
+        buffer = _copy_to_shared(image, output_format)
+    exif, icc = _export_metadata(metadata, output_format, settings)
+    return replace(buffer, exif=exif, icc=icc)
+
+
+def _copy_to_shared(image, output_format):
+    from multiprocessing import shared_memory
+    pixels, mode = _pixel_layout(image, output_format)
+    size = pixels.sizeInBytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    try:
+        shm.buf[:size] = pixels.constBits()
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return PixelBuffer(shm.name, mode, pixels.width(), pixels.height(), pixels.bytesPerLine(), _dpi(image))
+
+
+def encode_shared(buffer, dst, output_format, settings):
+    """从共享内存取出像素编码写到 dst，并释放共享内存（在编码进程中执行）"""
+    from PIL import Image
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=buffer.name)
+    try:
+        view = shm.buf[:buffer.stride * buffer.height]
+        im = Image.frombuffer(
+            buffer.mode, (buffer.width, buffer.height), view, "raw", buffer.mode, buffer.stride, 1,
+        )
+        try:
+            save_with_pillow(im, dst, output_format, settings, buffer.dpi, buffer.exif, buffer.icc)
+        finally:
+            # Pillow 持有对共享内存的引用，关闭前必须先释放
+            del im
+            view.release()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def release_shared(buffer):
+    """编码没能执行（进程池异常、取消）时释放共享内存"""
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=buffer.name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,196 @@
+"""进程内共享的解码图像缓存
+
+预览代理图和完整分辨率图像都经由这里解码：同一文件在同一尺寸下只解码一次，
+按占用字节数（而不是条目数）做 LRU 淘汰，总量不超过设定的内存预算。
+缓存键包含文件的修改时间和大小，文件被改写后会自动重新解码。
+解码时按 EXIF 方向把图像转正（见 metadata.py）。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from PySide6.QtGui import QImage, QImageReader
+from PySide6.QtCore import Qt, QSize, QRunnable, QThreadPool, QBuffer, QByteArray, QIODevice
+
+import stats
+from metadata import metadata_from_bytes, orient, read_metadata
+
+DEFAULT_BUDGET_MB = int(os.environ.get("WATERMARK_IMAGE_CACHE_MB", "512"))
+
+
+def decode_image(path, target_size=None):
+    """解码图片，返回 (图像, 原图尺寸)
+
+    给出 target_size 时按其（保持宽高比）缩小解码：使用 QImageReader.setScaledSize，
+    JPEG 等格式可在解码阶段直接缩小，不必先解出完整分辨率的位图。
+    图像按 EXIF 方向转正，返回的图像和原图尺寸都是转正后的。
+    """
+    with stats.span("decode", scaled=target_size is not None):
+        if stats.enabled:
+            try:
+                stats.count("bytes_read", os.path.getsize(path))
+            except OSError:
+                pass
+        return _decode(QImageReader(path), read_metadata(path), target_size)
+
+
+def decode_data(data, target_size=None, metadata=None):
+    """从已读入内存的文件内容解码（不再读文件），其余同 decode_image"""
+    with stats.span("decode", scaled=target_size is not None):
+        if metadata is None:
+            metadata = metadata_from_bytes(data)
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        return _decode(QImageReader(buffer), metadata, target_size)
+
+
+def _decode(reader, metadata, target_size):
+    reader.setAutoTransform(False)  # 方向统一由 metadata.orient 处理，Qt 只认 JPEG/TIFF 的方向
+    stored_target = target_size
+    if target_size is not None and metadata.swaps_axes:
+        stored_target = target_size.transposed()
+    full_size = reader.size()
+    if stored_target is not None and full_size.isValid():
+        scaled = full_size.scaled(stored_target, Qt.KeepAspectRatio)
+        if scaled.width() < full_size.width():
+            reader.setScaledSize(scaled)
+    image = reader.read()
+    if image.isNull():
+        return image, QSize()
+    if not full_size.isValid():
+        # 读取器无法预先给出尺寸时，解码后再缩小
+        full_size = image.size()
+        if stored_target is not None and (
+            image.width() > stored_target.width() or image.height() > stored_target.height()
+        ):
+            with stats.span("scale"):
+                image = image.scaled(stored_target, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    if metadata.swaps_axes:
+        full_size = full_size.transposed()
+    return orient(image, metadata.orientation), full_size
+
+
+class _PrefetchTask(QRunnable):
+    def __init__(self, cache, path, target_size):
+        super().__init__()
+        self.cache = cache
+        self.path = path
+        self.target_size = target_size
+
+    def run(self):
+        try:
+            self.cache.get(self.path, self.target_size)
+        finally:
+            self.cache._prefetch_done(self.path, self.target_size)
+
+
+class ImageCache:
+    """按字节预算淘汰的解码图像 LRU（线程安全）"""
+
+    def __init__(self, budget_mb=DEFAULT_BUDGET_MB):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (图像, 原图尺寸, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._prefetching = set()
+        self._pool = None
+
+    @staticmethod
+    def _key(path, target_size):
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        size = (target_size.width(), target_size.height()) if target_size is not None else None
+        return (os.path.abspath(path), stamp, size)
+
+    def get(self, path, target_size=None):
+        """返回 (图像, 原图尺寸)；target_size 为 None 时是完整分辨率"""
+        key = self._key(path, target_size)
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+        # 解码放在锁外，避免阻塞其它线程的命中
+        image, full_size = decode_image(path, target_size)
+        if not image.isNull():
+            self._store(key, image, full_size)
+        return image, full_size
+
+    def _store(self, key, image, full_size):
+        nbytes = image.sizeInBytes()
+        if nbytes > self.budget_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._items[key] = (image, full_size, nbytes)
+            self._bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.budget_bytes and self._items:
+            _, (_, _, nbytes) = self._items.popitem(last=False)
+            self._bytes -= nbytes
+
+    def prefetch(self, paths, target_size=None):
+        """在后台线程预先解码（例如列表中的上一张/下一张）"""
+        if self._pool is None:
+            self._pool = QThreadPool()
+            self._pool.setMaxThreadCount(1)
+        for path in paths:
+            token = (path, None if target_size is None else (target_size.width(), target_size.height()))
+            with self._lock:
+                if token in self._prefetching:
+                    continue
+                self._prefetching.add(token)
+            self._pool.start(_PrefetchTask(self, path, target_size))
+
+    def cancel_prefetch(self):
+        """丢弃排队中的预解码并等进行中的完成（窗口关闭时调用）"""
+        if self._pool is None:
+            return
+        self._pool.clear()
+        self._pool.waitForDone()
+        with self._lock:
+            self._prefetching.clear()
+
+    def _prefetch_done(self, path, target_size):
+        token = (path, None if target_size is None else (target_size.width(), target_size.height()))
+        with self._lock:
+            self._prefetching.discard(token)
+
+    def set_budget_mb(self, budget_mb):
+        with self._lock:
+            self.budget_bytes = int(budget_mb * 1024 * 1024)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+            }
+
+
+# 进程内唯一的共享实例，预览、缩放和导出都从这里取图
+image_cache = ImageCache()
+stats.register_cache("image", lambda: (image_cache.hits, image_cache.misses))
@@ -0,0 +1,250 @@
+"""JPEG 局部重编码
+
+角标水印通常只覆盖画面的一小部分，没必要把整张 JPEG 解码再重新编码。
+带重启标记（DRI/RSTn）的基线 JPEG 中，每个重启区间的熵编码数据彼此独立、按字节对齐，
+因此可以：
+
+1. 找出水印覆盖的 MCU 行，并扩展到重启区间的边界；
+2. 用原文件的表头和这些区间拼出一张只有这一条带的小 JPEG，解码、绘制水印；
+3. 用原文件的量化表、采样方式和重启间隔把条带重新编码；
+4. 把新条带的区间替换回原文件，其余区间逐字节原样保留。
+
+水印以外的 DCT 数据逐字节不变，也没有代际画质损失。条件不满足时（渐进式、
+没有重启标记、Huffman 表与标准表不同、条带过大等）返回 False，由调用方走常规路径。
+"""
+import io
+import re
+import struct
+
+from PIL import Image, JpegImagePlugin
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtCore import QPoint
+
+import stats
+from renderer import watermark_rect, paint_watermark
+
+
+# 条带超过整图的这个比例时局部重编码已无优势
+MAX_BAND_FRACTION = 0.5
+
+_RST = re.compile(rb"\xff[\xd0-\xd7]")
+_BASELINE_SOF = (0xC0, 0xC1)
+_OTHER_SOF = (0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+_QT_FORMATS = {"RGB": QImage.Format_RGB888, "L": QImage.Format_Grayscale8}
+
+# QImage 未设置分辨率时的默认值（96 DPI）
+_DEFAULT_DPM = 3780
+
+
+class _Jpeg:
+    """解析后的基线 JPEG：表头、各类表和按重启区间切分的熵编码数据"""
+
+    def __init__(self):
+        self.header = b""  # SOI 到 SOS 段结束
+        self.sof_offset = 0  # SOF 段标记的位置
+        self.width = 0
+        self.height = 0
+        self.components = []  # [(id, h, v, tq)]
+        self.scan = []  # [(id, td, ta)]
+        self.quant = {}  # tq -> 表数据
+        self.huffman = {}  # (类别, 编号) -> 表数据
+        self.restart = 0
+        self.intervals = []
+
+    def mcu_size(self):
+        if len(self.components) == 1:
+            return 8, 8
+        return 8 * max(c[1] for c in self.components), 8 * max(c[2] for c in self.components)
+
+    def layout_key(self):
+        """拼接兼容性需要一致的全部内容"""
+        tables = []
+        for (cid, td, ta), (_, h, v, tq) in zip(self.scan, self.components):
+            tables.append((
+                cid, h, v, self.quant.get(tq),
+                self.huffman.get((0, td)), self.huffman.get((1, ta)),
+            ))
+        return self.restart, tuple(tables)
+
+
+def parse_jpeg(data):
+    """解析基线、带重启标记、单次扫描的 JPEG；不符合条件返回 None"""
+    if data[:2] != b"\xff\xd8":
+        return None
+    jpeg = _Jpeg()
+    pos = 2
+    size = len(data)
+    while True:
+        if pos + 4 > size or data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # 填充字节
+            pos += 1
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        segment = data[pos + 4:pos + 2 + length]
+        if marker in _BASELINE_SOF:
+            jpeg.sof_offset = pos
+            jpeg.height, jpeg.width = struct.unpack(">HH", segment[1:5])
+            count = segment[5]
+            for i in range(count):
+                cid, hv, tq = segment[6 + 3 * i:9 + 3 * i]
+                jpeg.components.append((cid, hv >> 4, hv & 15, tq))
+        elif marker in _OTHER_SOF:
+            return None
+        elif marker == 0xDB:
+            i = 0
+            while i < len(segment):
+                pq, tq = segment[i] >> 4, segment[i] & 15
+                n = 128 if pq else 64
+                jpeg.quant[tq] = bytes(segment[i:i + 1 + n])
+                i += 1 + n
+        elif marker == 0xC4:
+            i = 0
+            while i < len(segment):
+                tc, th = segment[i] >> 4, segment[i] & 15
+                n = sum(segment[i + 1:i + 17])
+                jpeg.huffman[(tc, th)] = bytes(segment[i + 1:i + 17 + n])
+                i += 17 + n
+        elif marker == 0xDD:
+            jpeg.restart = struct.unpack(">H", segment[:2])[0]
+        elif marker == 0xDA:
+            count = segment[0]
+            for i in range(count):
+                cid, tables = segment[1 + 2 * i:3 + 2 * i]
+                jpeg.scan.append((cid, tables >> 4, tables & 15))
+            jpeg.header = data[:pos + 2 + length]
+            break
+        elif marker == 0xD9:
+            return None
+        pos += 2 + length
+
+    if not jpeg.components or not jpeg.restart:
+        return None
+    if [s[0] for s in jpeg.scan] != [c[0] for c in jpeg.components]:
+        return None  # 多次扫描或分量不全
+
+    end = data.find(b"\xff\xd9", len(jpeg.header))
+    if end < 0 or data[end + 2:].strip(b"\x00"):
+        return None  # 没有 EOI，或 EOI 后面还有数据（例如 MPF 附加图像）
+    jpeg.intervals = _RST.split(data[len(jpeg.header):end])
+
+    mcu_w, mcu_h = jpeg.mcu_size()
+    total = -(-jpeg.width // mcu_w) * -(-jpeg.height // mcu_h)
+    if len(jpeg.intervals) != -(-total // jpeg.restart):
+        return None
+    return jpeg
+
+
+def _join_intervals(intervals):
+    out = bytearray()
+    for i, chunk in enumerate(intervals):
+        if i:
+            out += bytes((0xFF, 0xD0 + (i - 1) % 8))
+        out += chunk
+    return bytes(out)
+
+
+def _dots_per_meter(im):
+    """与 Qt 的 JPEG 读取器一致地把 JFIF 密度换算为每米点数"""
+    unit = im.info.get("jfif_unit", 0)
+    density = im.info.get("jfif_density", (0, 0))
+    if unit == 1:
+        return int(100.0 * density[0] / 2.54), int(100.0 * density[1] / 2.54)
+    if unit == 2:
+        return int(100.0 * density[0]), int(100.0 * density[1])
+    return _DEFAULT_DPM, _DEFAULT_DPM
+
+
+def export_jpeg_passthrough(src, dst, spec, data=None):
+    """只重编码水印覆盖的条带，成功返回 True；不适用时返回 False（不写 dst）
+
+    data 为已读入内存的源文件内容，给出时不再读文件。原文件头（含 EXIF、ICC）原样保留。
+    """
+    if not spec.has_watermark:
+        return False
+    if data is None:
+        with open(src, "rb") as f:
+            data = f.read()
+        stats.count("bytes_read", len(data))
+    with stats.span("jpeg.parse"):
+        jpeg = parse_jpeg(data)
+    if jpeg is None:
+        return False
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.mode not in _QT_FORMATS:
+                return False
+            if im.info.get("adobe_transform") == 0 and im.mode == "RGB":
+                return False  # 直接存储 RGB 的 Adobe JPEG，编码器会按 YCbCr 写入
+            mode = im.mode
+            qtables = im.quantization
+            sampling = JpegImagePlugin.get_sampling(im) if mode == "RGB" else 0
+            dpm_x, dpm_y = _dots_per_meter(im)
+    except (OSError, ValueError, SyntaxError):
+        return False
+    if sampling == -1:
+        return False
+
+    width, height = jpeg.width, jpeg.height
+    covered = watermark_rect(spec, width, height, dpm_x, dpm_y)
+    if covered.isEmpty():
+        return False
+
+    # 水印覆盖的 MCU 行，扩展到重启区间边界
+    mcu_w, mcu_h = jpeg.mcu_size()
+    mcus_x = -(-width // mcu_w)
+    mcus_y = -(-height // mcu_h)
+    first_row = covered.top() // mcu_h
+    end_row = covered.bottom() // mcu_h + 1
+    while (first_row * mcus_x) % jpeg.restart:
+        first_row -= 1
+    while end_row < mcus_y and (end_row * mcus_x) % jpeg.restart:
+        end_row += 1
+    if end_row - first_row > mcus_y * MAX_BAND_FRACTION:
+        return False
+    first_interval = first_row * mcus_x // jpeg.restart
+    end_interval = -(-min(end_row * mcus_x, mcus_x * mcus_y) // jpeg.restart)
+
+    # 用原表头拼出只含这条带的小 JPEG 并解码
+    top = first_row * mcu_h
+    band_height = min(end_row * mcu_h, height) - top
+    header = bytearray(jpeg.header)
+    struct.pack_into(">H", header, jpeg.sof_offset + 5, band_height)
+    band_jpeg = bytes(header) + _join_intervals(jpeg.intervals[first_interval:end_interval]) + b"\xff\xd9"
+    try:
+        with stats.span("decode", band_rows=band_height), Image.open(io.BytesIO(band_jpeg)) as band_im:
+            band_im.load()
+            if band_im.mode != mode or band_im.size != (width, band_height):
+                return False
+            raw = band_im.tobytes()
+    except (OSError, ValueError, SyntaxError):
+        return False
+
+    channels = 3 if mode == "RGB" else 1
+    band = QImage(raw, width, band_height, width * channels, _QT_FORMATS[mode]).copy()
+    painter = QPainter(band)
+    paint_watermark(painter, spec, width, height, dpm_x, dpm_y, offset=QPoint(0, top))
+    painter.end()
+
+    # 按原文件的量化表、采样和重启间隔重新编码条带
+    pixels = Image.frombuffer(mode, (width, band_height), bytes(band.constBits()), "raw", mode, band.bytesPerLine(), 1)
+    buffer = io.BytesIO()
+    with stats.span("encode", format="JPEG", band_rows=band_height):
+        pixels.save(
+            buffer, "JPEG", qtables=qtables, subsampling=sampling,
+            restart_marker_blocks=jpeg.restart, optimize=False, progressive=False,
+        )
+    encoded = parse_jpeg(buffer.getvalue())
+    if encoded is None or encoded.layout_key() != jpeg.layout_key():
+        return False  # 原文件的 Huffman 表或分量布局与编码器不同，无法拼接
+    if len(encoded.intervals) != end_interval - first_interval:
+        return False
+
+    intervals = jpeg.intervals[:first_interval] + encoded.intervals + jpeg.intervals[end_interval:]
+    with open(dst, "wb") as f:
+        f.write(jpeg.header)
+        f.write(_join_intervals(intervals))
+        f.write(b"\xff\xd9")
+    return True
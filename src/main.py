@@ -1,25 +1,181 @@
+import startup  # 最先导入，记录启动计时的起点
 import sys
 import os
-import json
+from dataclasses import replace
 from PySide6.QtWidgets import (
     QApplication, QWidget, QHBoxLayout, QVBoxLayout, QListWidget, QListWidgetItem,
     QLabel, QLineEdit, QPushButton, QSizePolicy, QFrame, QFileDialog, QMessageBox,
-    QComboBox, QRadioButton, QButtonGroup, QGroupBox, QColorDialog, QSlider, QFontComboBox, QSpinBox, QCheckBox, QGridLayout, QInputDialog
+    QComboBox, QRadioButton, QButtonGroup, QGroupBox, QColorDialog, QSlider, QSpinBox, QCheckBox, QGridLayout, QInputDialog,
+    QProgressDialog, QDialog, QPlainTextEdit
 )
-from PySide6.QtGui import QPixmap, QIcon, QPainter, QColor, QFont, QMouseEvent, QTransform
-from PySide6.QtCore import Qt, QSize, QPoint
+from PySide6.QtGui import QPixmap, QIcon, QColor, QFont, QFontDatabase, QMouseEvent
+from PySide6.QtCore import (
+    Qt, QSize, QPoint, QPointF, QThread, QTimer, QObject, QRunnable, QThreadPool, QEvent, Signal
+)
+
+from renderer import WatermarkSpec, MARGIN, REFERENCE_EDGE, logo_size
+from preview import PreviewScheduler
+from image_cache import image_cache
+from thumbnails import THUMB_SIZE, ThumbnailLoader, placeholder_icon
+from scanner import ScanThread
+from batch import BatchExporter, output_jobs
+from encoder import EncoderSettings, OUTPUT_FORMATS, SUBSAMPLING_MODES
+from manifest import ExportManifest
+import stats
+from templates import template_store
+
+startup.mark("imports")
+
+
+class ExportThread(QThread):
+    """在后台线程驱动 BatchExporter，通过信号把进度送回界面"""
+    progress = Signal(int, int)
+    finished_export = Signal(list, list)
+
+    def __init__(self, exporter, parent=None):
+        super().__init__(parent)
+        self.exporter = exporter
+
+    def run(self):
+        written, failed = self.exporter.run(
+            lambda done, total, src, error: self.progress.emit(done, total)
+        )
+        self.finished_export.emit(written, failed)
+
+
+class _FontFamiliesTask(QRunnable):
+    def __init__(self, notifier):
+        super().__init__()
+        self.notifier = notifier
+
+    def run(self):
+        self.notifier.loaded.emit(QFontDatabase.families())
 
 
-SUPPORTED_FORMATS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff")
+class _FontFamiliesNotifier(QObject):
+    loaded = Signal(list)
 
 
-TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "../templates")
-LAST_TEMPLATE_PATH = os.path.join(TEMPLATE_DIR, "last_template.json")
+class FontComboBox(QComboBox):
+    """延迟加载字体列表的字体选择框，接口与 QFontComboBox 相同
 
+    QFontComboBox 在构造时枚举全部已安装字体并逐个生成预览，字体多的机器上要一秒以上。
+    这里启动时只放入当前字体，窗口显示后在后台线程读取字体列表；
+    用户在加载完成前打开下拉框时才同步读取。
+    """
+    currentFontChanged = Signal(QFont)
 
-def ensure_template_dir():
-    if not os.path.exists(TEMPLATE_DIR):
-        os.makedirs(TEMPLATE_DIR)
+    def __init__(self, family, parent=None):
+        super().__init__(parent)
+        self._loaded = False
+        self._notifier = None
+        self.addItem(family)
+        self.currentTextChanged.connect(lambda name: self.currentFontChanged.emit(QFont(name)))
+
+    def currentFont(self):
+        return QFont(self.currentText())
+
+    def setCurrentFont(self, font):
+        family = font.family()
+        index = self.findText(family)
+        if index < 0:
+            self.addItem(family)
+            index = self.count() - 1
+        self.setCurrentIndex(index)
+
+    def load_in_background(self):
+        if self._loaded or self._notifier is not None:
+            return
+        self._notifier = _FontFamiliesNotifier(self)
+        self._notifier.loaded.connect(self.set_families)
+        QThreadPool.globalInstance().start(_FontFamiliesTask(self._notifier))
+
+    def set_families(self, families):
+        if self._loaded:
+            return
+        self._loaded = True
+        current = self.currentText()
+        self.blockSignals(True)
+        self.clear()
+        self.addItems(families)
+        if current not in families:
+            self.insertItem(0, current)
+        self.setCurrentText(current)
+        self.blockSignals(False)
+
+    def showPopup(self):
+        if not self._loaded:
+            self.set_families(QFontDatabase.families())
+        super().showPopup()
+
+
+class StatsDialog(QDialog):
+    """性能统计面板：各阶段耗时、缓存命中率、队列深度和读写字节数，可导出跟踪文件"""
+    REFRESH_MS = 1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("性能统计")
+        self.resize(640, 420)
+        layout = QVBoxLayout(self)
+
+        self.enable_check = QCheckBox("启用统计")
+        self.enable_check.setChecked(stats.enabled)
+        self.enable_check.toggled.connect(self.on_enable_toggled)
+        layout.addWidget(self.enable_check)
+
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.text, stretch=1)
+
+        btn_layout = QHBoxLayout()
+        btn_reset = QPushButton("清空")
+        btn_reset.clicked.connect(self.on_reset)
+        btn_layout.addWidget(btn_reset)
+        btn_dump = QPushButton("导出跟踪…")
+        btn_dump.clicked.connect(self.dump_trace)
+        btn_layout.addWidget(btn_dump)
+        btn_layout.addStretch(1)
+        layout.addLayout(btn_layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def on_enable_toggled(self, checked):
+        stats.set_enabled(checked)
+        self.refresh()
+
+    def on_reset(self):
+        stats.reset()
+        self.refresh()
+
+    def refresh(self):
+        if not stats.enabled:
+            self.text.setPlainText("统计未启用。启用后，预览、缩略图和导出的各阶段耗时会显示在这里。")
+            return
+        self.text.setPlainText("\n".join(stats.summary_lines()))
+
+    def dump_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出跟踪", "watermark-trace.json", "JSON (*.json)")
+        if not path:
+            return
+        try:
+            stats.dump_trace(path)
+        except OSError as e:
+            QMessageBox.warning(self, "错误", f"无法写入跟踪文件：\n{e}")
+            return
+        QMessageBox.information(self, "导出跟踪", f"已导出，可在 chrome://tracing 或 Perfetto 中打开：\n{path}")
 
 
 class MainWindow(QWidget):
@@ -30,9 +186,19 @@ class MainWindow(QWidget):
         self.setAcceptDrops(True)
 
         self.image_paths = []
+        self.image_path_keys = set()  # 去重用的规范化路径
+        self.scan_threads = []
+        self.export_thread = None
         self.current_image = None
+        self.current_image_size = QSize()  # 当前图片的原图尺寸
+        self.preview_scheduler = PreviewScheduler(image_cache, self)
+        self.preview_scheduler.ready.connect(self.on_preview_rendered)
+        self.list_items = {}  # 路径 -> 列表项，用于回填缩略图
+        self.thumbnail_loader = ThumbnailLoader(self)
+        self.thumbnail_loader.loaded.connect(self.on_thumbnail_loaded)
         self.watermarked_pixmap = None
         self.output_format = "JPEG"
+        self.stats_dialog = None
 
         # 新增水印样式相关属性
         self.font_family = "Arial"
@@ -49,8 +215,17 @@ class MainWindow(QWidget):
         self.watermark_offset = QPoint(-30, -20)  # 偏移量（用于拖拽）
         self.watermark_dragging = False
         self.watermark_drag_start = QPoint(0, 0)
-        self.watermark_custom_pos = None  # 手动拖拽的像素坐标
+        self.watermark_custom_pos = None  # 手动拖拽的位置（占图片宽、高的比例，QPointF）
+        self.watermark_custom_pos_px = None  # 旧模板的像素位置（原图像素），拖拽时才换算为比例
+        # 读取了没有 font_scale 的旧模板：字号、边距、间距和位置都按原图像素解释，与命令行一致
+        self.legacy_layout = False
         self.watermark_angle = 0  # 旋转角度
+        self.tile_spacing = 100  # 平铺间距（基准图片上的像素）
+
+        # 图片水印（Logo）
+        self.watermark_type = "text"
+        self.logo_path = ""
+        self.logo_scale = 0.2  # Logo 长边占原图短边的比例
 
         self.init_ui()
 
@@ -66,9 +241,12 @@ class MainWindow(QWidget):
 
         # 左侧：文件列表
         self.list_widget = QListWidget()
-        self.list_widget.setIconSize(QSize(64, 64))
+        self.list_widget.setIconSize(QSize(THUMB_SIZE, THUMB_SIZE))
+        self.list_widget.setUniformItemSizes(True)
         self.list_widget.setMinimumWidth(250)
-        self.list_widget.itemClicked.connect(self.on_item_clicked)
+        self.list_widget.currentRowChanged.connect(self.on_current_row_changed)
+        self.list_widget.verticalScrollBar().valueChanged.connect(self.request_visible_thumbnails)
+        self.placeholder_icon = placeholder_icon()
         main_layout.addWidget(self.list_widget)
 
         # 中间：预览区
@@ -83,9 +261,17 @@ class MainWindow(QWidget):
         self.preview_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         center_layout.addWidget(self.preview_label)
 
+        import_btn_layout = QHBoxLayout()
         self.btn_import = QPushButton("导入图片 / 文件夹")
         self.btn_import.clicked.connect(self.import_images)
-        center_layout.addWidget(self.btn_import)
+        import_btn_layout.addWidget(self.btn_import, stretch=1)
+        self.btn_clear_list = QPushButton("清空列表")
+        self.btn_clear_list.clicked.connect(self.clear_file_list)
+        import_btn_layout.addWidget(self.btn_clear_list)
+        self.btn_stats = QPushButton("性能统计")
+        self.btn_stats.clicked.connect(self.show_stats)
+        import_btn_layout.addWidget(self.btn_stats)
+        center_layout.addLayout(import_btn_layout)
 
         main_layout.addWidget(center_frame, stretch=1)
 
@@ -99,10 +285,39 @@ class MainWindow(QWidget):
         style_group.setStyleSheet("QGroupBox { font-size: 18px; font-weight: bold; }")
         style_layout = QVBoxLayout(style_group)
 
+        type_layout = QHBoxLayout()
+        self.radio_text_type = QRadioButton("文字水印")
+        self.radio_image_type = QRadioButton("图片水印")
+        self.radio_text_type.setChecked(True)
+        self.radio_text_type.toggled.connect(self.on_watermark_type_changed)
+        type_layout.addWidget(self.radio_text_type)
+        type_layout.addWidget(self.radio_image_type)
+        style_layout.addLayout(type_layout)
+
         self.text_input = QLineEdit()
         self.text_input.setPlaceholderText("输入水印文本")
         style_layout.addWidget(self.text_input)
 
+        logo_layout = QHBoxLayout()
+        self.btn_logo = QPushButton("选择图片…")
+        self.btn_logo.clicked.connect(self.choose_logo)
+        logo_layout.addWidget(self.btn_logo)
+        self.logo_label = QLabel("未选择")
+        logo_layout.addWidget(self.logo_label, 1)
+        logo_layout.addWidget(QLabel("大小:"))
+        self.logo_scale_spin = QSpinBox()
+        self.logo_scale_spin.setRange(1, 100)
+        self.logo_scale_spin.setSuffix(" %")
+        self.logo_scale_spin.setToolTip("Logo 长边占图片短边的百分比")
+        self.logo_scale_spin.setValue(round(self.logo_scale * 100))
+        self.logo_scale_spin.valueChanged.connect(self.on_logo_scale_changed)
+        logo_layout.addWidget(self.logo_scale_spin)
+        self.logo_options = QWidget()
+        self.logo_options.setLayout(logo_layout)
+        logo_layout.setContentsMargins(0, 0, 0, 0)
+        self.logo_options.setVisible(False)
+        style_layout.addWidget(self.logo_options)
+
         # 模板按钮区
         template_btn_layout = QHBoxLayout()
         self.btn_save_tpl = QPushButton("保存模板")
@@ -118,13 +333,13 @@ class MainWindow(QWidget):
 
         font_layout = QHBoxLayout()
         font_layout.addWidget(QLabel("字体:"))
-        self.font_combo = QFontComboBox()
-        self.font_combo.setCurrentFont(QFont(self.font_family))
+        self.font_combo = FontComboBox(self.font_family)
         self.font_combo.currentFontChanged.connect(self.on_font_changed)
         font_layout.addWidget(self.font_combo)
         font_layout.addWidget(QLabel("字号:"))
         self.font_size_spin = QSpinBox()
         self.font_size_spin.setRange(10, 120)
+        self.font_size_spin.setToolTip(f"短边 {REFERENCE_EDGE} 像素的图片上的文字像素大小，其它尺寸的图片按比例缩放")
         self.font_size_spin.setValue(self.font_size)
         self.font_size_spin.valueChanged.connect(self.on_font_size_changed)
         font_layout.addWidget(self.font_size_spin)
@@ -191,6 +406,24 @@ class MainWindow(QWidget):
             layout_grid.addWidget(btn, idx // 3, idx % 3)
             self.pos_buttons[mode] = btn
 
+        # 平铺：水印按间距铺满全图，旋转作用于整个图案
+        btn_tile = QPushButton("平铺")
+        btn_tile.setCheckable(True)
+        btn_tile.setChecked(self.watermark_pos_mode == "tile")
+        btn_tile.clicked.connect(lambda checked: self.set_watermark_pos_mode("tile"))
+        layout_grid.addWidget(btn_tile, 3, 0)
+        self.pos_buttons["tile"] = btn_tile
+        spacing_layout = QHBoxLayout()
+        spacing_layout.addWidget(QLabel("间距:"))
+        self.tile_spacing_spin = QSpinBox()
+        self.tile_spacing_spin.setRange(0, 2000)
+        self.tile_spacing_spin.setSuffix(" px")
+        self.tile_spacing_spin.setValue(self.tile_spacing)
+        self.tile_spacing_spin.setToolTip(f"短边 {REFERENCE_EDGE} 像素的图片上的间距，其它尺寸的图片按比例缩放")
+        self.tile_spacing_spin.valueChanged.connect(self.on_tile_spacing_changed)
+        spacing_layout.addWidget(self.tile_spacing_spin)
+        layout_grid.addLayout(spacing_layout, 3, 1, 1, 2)
+
         # 旋转滑块
         rotate_layout = QHBoxLayout()
         rotate_layout.addWidget(QLabel("旋转:"))
@@ -199,7 +432,7 @@ class MainWindow(QWidget):
         self.rotate_slider.setValue(self.watermark_angle)
         self.rotate_slider.valueChanged.connect(self.on_rotate_changed)
         rotate_layout.addWidget(self.rotate_slider)
-        layout_grid.addLayout(rotate_layout, 3, 0, 1, 3)
+        layout_grid.addLayout(rotate_layout, 4, 0, 1, 3)
 
         right_layout.addWidget(layout_group)
 
@@ -226,15 +459,42 @@ class MainWindow(QWidget):
         format_layout = QHBoxLayout()
         format_layout.addWidget(QLabel("输出格式:"))
         self.format_combo = QComboBox()
-        self.format_combo.addItems(["JPEG", "PNG"])
+        self.format_combo.addItems(list(OUTPUT_FORMATS))
         self.format_combo.currentTextChanged.connect(self.on_format_changed)
         format_layout.addWidget(self.format_combo)
         export_layout.addLayout(format_layout)
 
+        # 编码参数，只显示当前输出格式相关的一组
+        self.jpeg_options = QWidget()
+        jpeg_grid = QGridLayout(self.jpeg_options)
+        jpeg_grid.setContentsMargins(0, 0, 0, 0)
+        jpeg_grid.addWidget(QLabel("质量:"), 0, 0)
+        self.jpeg_quality_spin = QSpinBox()
+        self.jpeg_quality_spin.setRange(0, 100)
+        self.jpeg_quality_spin.setSpecialValueText("自动")  # 0 表示沿用原图或编码器默认值
+        self.jpeg_quality_spin.setValue(0)
+        jpeg_grid.addWidget(self.jpeg_quality_spin, 0, 1)
+        self.jpeg_progressive_check = QCheckBox("渐进式")
+        jpeg_grid.addWidget(self.jpeg_progressive_check, 0, 2)
+        jpeg_grid.addWidget(QLabel("色度抽样:"), 1, 0)
+        self.jpeg_subsampling_combo = QComboBox()
+        self.jpeg_subsampling_combo.addItems(["自动"] + list(SUBSAMPLING_MODES[1:]))
+        jpeg_grid.addWidget(self.jpeg_subsampling_combo, 1, 1, 1, 2)
+        export_layout.addWidget(self.jpeg_options)
+        # PNG、WebP 的参数在第一次选择该格式时才创建
+        self.png_options = None
+        self.webp_options = None
+
+        self.keep_metadata_check = QCheckBox("保留 EXIF 和颜色配置文件")
+        self.keep_metadata_check.setChecked(True)
+        export_layout.addWidget(self.keep_metadata_check)
+
         # 保存按钮放到导出设置分组内
         self.btn_save = QPushButton("导出图片")
         self.btn_save.clicked.connect(self.save_images)
         export_layout.addWidget(self.btn_save)
+        self.export_layout = export_layout
+        self.on_format_changed(self.output_format)
 
         right_layout.addWidget(export_group)
         right_layout.addStretch(1)
@@ -249,66 +509,93 @@ class MainWindow(QWidget):
     # ---------- 字体与样式相关槽函数 ----------
     def on_font_changed(self, font):
         self.font_family = font.family()
-        self.apply_watermark()
+        self.schedule_preview()
 
     def on_font_size_changed(self, size):
         self.font_size = size
-        self.apply_watermark()
+        self.schedule_preview()
 
     def on_bold_changed(self, state):
         self.font_bold = (state == Qt.Checked)
-        self.apply_watermark()
+        self.schedule_preview()
 
     def on_italic_changed(self, state):
         self.font_italic = (state == Qt.Checked)
-        self.apply_watermark()
+        self.schedule_preview()
 
     def choose_color(self):
         color = QColorDialog.getColor(self.font_color, self, "选择字体颜色")
         if color.isValid():
             self.font_color = color
             self.color_btn.setStyleSheet(f"background: {color.name()};")
-            self.apply_watermark()
+            self.schedule_preview()
+
+    def on_watermark_type_changed(self):
+        self.watermark_type = "text" if self.radio_text_type.isChecked() else "image"
+        self.text_input.setVisible(self.watermark_type == "text")
+        self.logo_options.setVisible(self.watermark_type == "image")
+        self.schedule_preview()
+
+    def choose_logo(self):
+        path, _ = QFileDialog.getOpenFileName(self, "选择水印图片", "", "图片文件 (*.png *.webp *.jpg *.jpeg *.bmp *.tif *.tiff)")
+        if path:
+            self.set_logo_path(path)
+            self.schedule_preview()
+
+    def set_logo_path(self, path):
+        self.logo_path = path
+        self.logo_label.setText(os.path.basename(path) if path else "未选择")
+        self.logo_label.setToolTip(path)
+
+    def on_logo_scale_changed(self, value):
+        self.logo_scale = value / 100
+        self.schedule_preview()
 
     def on_opacity_changed(self, value):
         self.font_opacity = value
-        self.apply_watermark()
+        self.schedule_preview()
 
     def on_shadow_changed(self, state):
         self.shadow_enabled = (state == Qt.Checked)
-        self.apply_watermark()
+        self.schedule_preview()
 
     def on_outline_changed(self, state):
         self.outline_enabled = (state == Qt.Checked)
-        self.apply_watermark()
+        self.schedule_preview()
 
     # ----------- 九宫格位置选择 -----------
     def set_watermark_pos_mode(self, mode):
         self.watermark_pos_mode = mode
         self.watermark_custom_pos = None  # 切换预设时取消自定义
+        self.watermark_custom_pos_px = None
         for m, btn in self.pos_buttons.items():
             btn.setChecked(m == mode)
-        self.apply_watermark()
+        self.schedule_preview()
+
+    def on_tile_spacing_changed(self, value):
+        self.tile_spacing = value
+        self.schedule_preview()
 
     # ----------- 旋转 -----------
     def on_rotate_changed(self, value):
         self.watermark_angle = value
-        self.apply_watermark()
+        self.schedule_preview()
 
     # ----------- 预览区鼠标拖拽 -----------
     def preview_mouse_press(self, event: QMouseEvent):
-        if event.button() == Qt.LeftButton:
+        if event.button() == Qt.LeftButton and self.watermark_pos_mode != "tile":
             # 判断是否点在水印区域（简化：只要点在预览区就允许拖动）
             self.watermark_dragging = True
             self.watermark_drag_start = event.pos()
+            self.convert_legacy_custom_pos()
             if self.watermark_custom_pos is None:
                 self.watermark_custom_pos = self.calc_watermark_pos(event.pos())
             event.accept()
 
     def preview_mouse_move(self, event: QMouseEvent):
         if self.watermark_dragging:
-            # 计算偏移
-            delta = event.pos() - self.watermark_drag_start
+            # 计算偏移（换算为图片宽、高的比例）
+            delta = self.calc_watermark_pos(event.pos()) - self.calc_watermark_pos(self.watermark_drag_start)
             if self.watermark_custom_pos is not None:
                 self.watermark_custom_pos += delta
             else:
@@ -317,7 +604,7 @@ class MainWindow(QWidget):
             self.watermark_pos_mode = "custom"
             for m, btn in self.pos_buttons.items():
                 btn.setChecked(False)
-            self.apply_watermark()
+            self.schedule_preview()
             event.accept()
 
     def preview_mouse_release(self, event: QMouseEvent):
@@ -326,8 +613,17 @@ class MainWindow(QWidget):
             event.accept()
 
     def calc_watermark_pos(self, click_pos):
-        # 将点击点作为水印中心
-        return click_pos
+        # 将点击点作为水印中心，从预览区坐标换算为占图片宽、高的比例，与图片尺寸无关
+        pixmap = self.preview_label.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return QPointF(0.5, 0.5)
+        shown = pixmap.deviceIndependentSize()
+        offset_x = (self.preview_label.width() - shown.width()) / 2
+        offset_y = (self.preview_label.height() - shown.height()) / 2
+        return QPointF(
+            (click_pos.x() - offset_x) / shown.width(),
+            (click_pos.y() - offset_y) / shown.height(),
+        )
 
     # -------------------- 拖拽导入 --------------------
 
@@ -337,17 +633,8 @@ class MainWindow(QWidget):
 
     def dropEvent(self, event):
         files = [url.toLocalFile() for url in event.mimeData().urls()]
-        image_files = []
-        for f in files:
-            if os.path.isdir(f):
-                # 遍历文件夹
-                for root, _, names in os.walk(f):
-                    for n in names:
-                        if n.lower().endswith(SUPPORTED_FORMATS):
-                            image_files.append(os.path.join(root, n))
-            elif f.lower().endswith(SUPPORTED_FORMATS):
-                image_files.append(f)
-        self.load_file_list(image_files)
+        # 文件和文件夹统一交给后台扫描，边扫边加入列表
+        self.start_scan(files)
 
     # -------------------- 文件导入 --------------------
 
@@ -358,46 +645,154 @@ class MainWindow(QWidget):
             "选择导入图片文件？（选择“否”可导入整个文件夹）",
             QMessageBox.Yes | QMessageBox.No
         )
-        files = []
         if choice == QMessageBox.Yes:
             files, _ = QFileDialog.getOpenFileNames(
-                self, "选择图片", "", "图片文件 (*.jpg *.jpeg *.png *.bmp *.tiff)"
+                self, "选择图片", "", "图片文件 (*.jpg *.jpeg *.png *.bmp *.tif *.tiff *.webp)"
             )
+            self.load_file_list(files)
         else:
             folder = QFileDialog.getExistingDirectory(self, "选择图片文件夹")
             if folder:
-                for root, _, names in os.walk(folder):
-                    for n in names:
-                        if n.lower().endswith(SUPPORTED_FORMATS):
-                            files.append(os.path.join(root, n))
+                self.start_scan([folder])
 
-        self.load_file_list(files)
+    def start_scan(self, paths):
+        """在后台线程扫描文件/文件夹，找到的图片分批追加到列表"""
+        if not paths:
+            return
+        thread = ScanThread(paths, self)
+        # 取消后仍在事件队列中的批次直接丢弃
+        thread.found.connect(lambda files: None if thread.cancelled else self.load_file_list(files))
+        thread.finished.connect(lambda: self.on_scan_finished(thread))
+        self.scan_threads.append(thread)
+        thread.start()
+
+    def on_scan_finished(self, thread):
+        if thread in self.scan_threads:
+            self.scan_threads.remove(thread)
+        thread.deleteLater()
+
+    def cancel_scans(self):
+        for thread in self.scan_threads:
+            thread.cancel()
+        for thread in self.scan_threads:
+            thread.wait()
 
     def load_file_list(self, files):
-        """刷新左侧文件列表"""
-        if not files:
-            return
-        self.image_paths = files
-        self.list_widget.clear()
+        """把图片追加到左侧文件列表（已存在的路径会被跳过）"""
+        first_load = not self.image_paths
+        added = False
         for path in files:
-            pixmap = QPixmap(path)
-            icon = QIcon(pixmap.scaled(64, 64, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-            item = QListWidgetItem(icon, os.path.basename(path))
+            key = os.path.normcase(os.path.abspath(path))
+            if key in self.image_path_keys:
+                continue
+            self.image_path_keys.add(key)
+            self.image_paths.append(path)
+            # 先用占位图标立即显示，缩略图在后台按需生成
+            item = QListWidgetItem(self.placeholder_icon, os.path.basename(path))
             self.list_widget.addItem(item)
-        self.load_image(self.image_paths[0])
-        self.list_widget.setCurrentRow(0)
+            self.list_items[path] = item
+            added = True
+        if not added:
+            return
+        if first_load:
+            self.list_widget.setCurrentRow(0)
+        # 等列表完成布局后再计算可见行
+        QTimer.singleShot(0, self.request_visible_thumbnails)
+
+    def clear_file_list(self):
+        self.cancel_scans()
+        self.preview_scheduler.cancel()
+        self.thumbnail_loader.clear()
+        self.list_widget.clear()
+        self.list_items = {}
+        self.image_paths = []
+        self.image_path_keys = set()
+        self.current_image = None
+        self.current_image_size = QSize()
+        self.watermarked_pixmap = None
+        self.preview_label.clear()
+        self.preview_label.setText("拖拽图片或点击下方按钮导入")
+
+    def request_visible_thumbnails(self, *_):
+        """只为可见行（前后各多取几行）请求缩略图"""
+        count = self.list_widget.count()
+        if not count:
+            return
+        viewport = self.list_widget.viewport().rect()
+        first = self.list_widget.indexAt(viewport.topLeft()).row()
+        last = self.list_widget.indexAt(viewport.bottomLeft()).row()
+        if first < 0:
+            first = 0
+        if last < 0:
+            last = count - 1
+        for row in range(max(0, first - 8), min(count, last + 9)):
+            self.thumbnail_loader.request(self.image_paths[row])
+
+    def on_thumbnail_loaded(self, path, image):
+        item = self.list_items.get(path)
+        if item is not None and not image.isNull():
+            item.setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.request_visible_thumbnails()
+
+    def show_stats(self):
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(self)
+        self.stats_dialog.show()
+        self.stats_dialog.raise_()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # 窗口显示后再在后台读取字体列表，不占用首次绘制的时间
+        QTimer.singleShot(0, self.font_combo.load_in_background)
+
+    def closeEvent(self, event):
+        self.cancel_scans()
+        # 导出线程持有进程池：取消后等它收尾，不能让窗口销毁时线程还在运行
+        if self.export_thread is not None and self.export_thread.isRunning():
+            self.export_thread.exporter.cancel()
+            self.export_thread.wait()
+        # 线程池中的缩略图、预览和预解码任务完成时会向窗口发信号，等它们结束后再销毁窗口
+        self.thumbnail_loader.shutdown()
+        self.preview_scheduler.shutdown()
+        image_cache.cancel_prefetch()
+        QThreadPool.globalInstance().waitForDone()  # 后台读取字体列表
+        super().closeEvent(event)
 
     # -------------------- 图片加载与水印 --------------------
 
+    def preview_target_size(self):
+        dpr = self.preview_label.devicePixelRatioF()
+        size = self.preview_label.size()
+        return QSize(round(size.width() * dpr), round(size.height() * dpr))
+
+    def show_preview(self, image):
+        with stats.span("pixmap"):
+            pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self.preview_label.devicePixelRatioF())
+        self.preview_label.setPixmap(pixmap)
+        return pixmap
+
     def load_image(self, path):
+        self.preview_scheduler.cancel()
         self.current_image = path
-        pixmap = QPixmap(path)
-        self.preview_label.setPixmap(pixmap.scaled(
-            self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
-        ))
-
-    def on_item_clicked(self, item):
-        index = self.list_widget.row(item)
+        # 预览只使用缓存的显示尺寸代理图，不解码完整分辨率
+        target_size = self.preview_target_size()
+        proxy, self.current_image_size = image_cache.get(path, target_size)
+        self.show_preview(proxy)
+        # 预先解码列表中相邻的图片，方向键切换时直接命中缓存
+        index = self.list_widget.currentRow()
+        if 0 <= index < len(self.image_paths) and self.image_paths[index] == path:
+            neighbours = [
+                self.image_paths[i] for i in (index + 1, index - 1)
+                if 0 <= i < len(self.image_paths)
+            ]
+            image_cache.prefetch(neighbours, target_size)
+
+    def on_current_row_changed(self, index):
+        # 点击和方向键切换都会触发
         if 0 <= index < len(self.image_paths):
             self.load_image(self.image_paths[index])
 
@@ -407,96 +802,101 @@ class MainWindow(QWidget):
             QMessageBox.warning(self, "提示", "请先导入图片！")
             return
 
-        text = self.text_input.text().strip()
-        if not text:
+        if not self.check_watermark():
+            return
+
+        self.schedule_preview()
+
+    def check_watermark(self):
+        """水印内容是否可用，不可用时提示并返回 False"""
+        spec = self.watermark_spec()
+        if spec.watermark_type == "image":
+            if not spec.logo_path:
+                QMessageBox.warning(self, "提示", "请选择水印图片！")
+                return False
+            if logo_size(spec, 1, 1) is None:
+                QMessageBox.warning(self, "提示", f"无法读取水印图片：\n{spec.logo_path}")
+                return False
+        elif not spec.display_text:
             QMessageBox.warning(self, "提示", "请输入水印文本！")
+            return False
+        return True
+
+    def schedule_preview(self):
+        """参数变化时调用：交给调度器在后台渲染代理图，连续变化会被合并"""
+        if not self.current_image:
             return
+        spec = self.watermark_spec()
+        if not spec.has_watermark:
+            return
+        self.preview_scheduler.request(self.current_image, self.preview_target_size(), spec)
 
-        base_pixmap = QPixmap(self.current_image)
-        painter = QPainter(base_pixmap)
-        painter.setRenderHint(QPainter.Antialiasing)
-        font = QFont(self.font_family, self.font_size)
-        if self.font_bold:
-            font.setWeight(QFont.Weight.Bold)
-        else:
-            font.setWeight(QFont.Weight.Normal)
-        font.setItalic(self.font_italic)
-        painter.setFont(font)
-        color = QColor(self.font_color)
-        color.setAlpha(self.font_opacity)
-        painter.setPen(color)
-
-        # 计算文本尺寸
-        tw = painter.fontMetrics().boundingRect(text).width()
-        th = painter.fontMetrics().boundingRect(text).height()
-
-        # 计算水印位置
-        if self.watermark_pos_mode == "custom" and self.watermark_custom_pos is not None:
-            x = self.watermark_custom_pos.x() - tw // 2
-            y = self.watermark_custom_pos.y() + th // 2
-        else:
-            w, h = base_pixmap.width(), base_pixmap.height()
-            margin = 30
-            pos_map = {
-                "top_left": (margin, margin + th),
-                "top_center": (w // 2 - tw // 2, margin + th),
-                "top_right": (w - tw - margin, margin + th),
-                "center_left": (margin, h // 2 + th // 2),
-                "center": (w // 2 - tw // 2, h // 2 + th // 2),
-                "center_right": (w - tw - margin, h // 2 + th // 2),
-                "bottom_left": (margin, h - margin),
-                "bottom_center": (w // 2 - tw // 2, h - margin),
-                "bottom_right": (w - tw - margin, h - margin),
-            }
-            x, y = pos_map.get(self.watermark_pos_mode, (w - tw - margin, h - margin))
-
-        # 旋转变换
-        if self.watermark_angle != 0:
-            painter.save()
-            cx, cy = x + tw // 2, y - th // 2
-            transform = QTransform()
-            transform.translate(cx, cy)
-            transform.rotate(self.watermark_angle)
-            transform.translate(-cx, -cy)
-            painter.setTransform(transform)
-
-        # 阴影
-        if self.shadow_enabled:
-            shadow_color = QColor(0, 0, 0, int(self.font_opacity * 0.6))
-            painter.setPen(shadow_color)
-            painter.drawText(x+2, y+2, text)
-            painter.setPen(color)
-
-        # 描边
-        if self.outline_enabled:
-            outline_color = QColor(0, 0, 0, self.font_opacity)
-            for dx in [-1, 0, 1]:
-                for dy in [-1, 0, 1]:
-                    if dx != 0 or dy != 0:
-                        painter.setPen(outline_color)
-                        painter.drawText(x + dx, y + dy, text)
-            painter.setPen(color)
-
-        # 正文
-        painter.drawText(x, y, text)
-
-        if self.watermark_angle != 0:
-            painter.restore()
-
-        painter.end()
-        self.watermarked_pixmap = base_pixmap
-        self.preview_label.setPixmap(base_pixmap.scaled(
-            self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
-        ))
+    def on_preview_rendered(self, image, full_size):
+        self.current_image_size = full_size
+        self.watermarked_pixmap = self.show_preview(image)
 
     # -------------------- 图片导出 --------------------
 
+    def build_png_options(self):
+        self.png_options = QWidget()
+        png_layout = QHBoxLayout(self.png_options)
+        png_layout.setContentsMargins(0, 0, 0, 0)
+        png_layout.addWidget(QLabel("压缩级别:"))
+        self.png_level_spin = QSpinBox()
+        self.png_level_spin.setRange(0, 9)
+        self.png_level_spin.setValue(EncoderSettings.png_compress_level)
+        self.png_level_spin.setToolTip("越大文件越小、导出越慢")
+        png_layout.addWidget(self.png_level_spin)
+        self.export_layout.insertWidget(self.export_layout.indexOf(self.keep_metadata_check), self.png_options)
+
+    def build_webp_options(self):
+        self.webp_options = QWidget()
+        webp_layout = QHBoxLayout(self.webp_options)
+        webp_layout.setContentsMargins(0, 0, 0, 0)
+        webp_layout.addWidget(QLabel("质量:"))
+        self.webp_quality_spin = QSpinBox()
+        self.webp_quality_spin.setRange(1, 100)
+        self.webp_quality_spin.setValue(EncoderSettings.webp_quality)
+        webp_layout.addWidget(self.webp_quality_spin)
+        self.webp_lossless_check = QCheckBox("无损")
+        webp_layout.addWidget(self.webp_lossless_check)
+        self.export_layout.insertWidget(self.export_layout.indexOf(self.keep_metadata_check), self.webp_options)
+
     def on_format_changed(self, fmt):
         self.output_format = fmt
+        if fmt == "PNG" and self.png_options is None:
+            self.build_png_options()
+        if fmt == "WEBP" and self.webp_options is None:
+            self.build_webp_options()
+        self.jpeg_options.setVisible(fmt == "JPEG")
+        for options, name in ((self.png_options, "PNG"), (self.webp_options, "WEBP")):
+            if options is not None:
+                options.setVisible(fmt == name)
+
+    def encoder_settings(self):
+        quality = self.jpeg_quality_spin.value()
+        settings = EncoderSettings(
+            jpeg_quality=quality or None,
+            jpeg_progressive=self.jpeg_progressive_check.isChecked(),
+            jpeg_subsampling=SUBSAMPLING_MODES[self.jpeg_subsampling_combo.currentIndex()],
+            keep_metadata=self.keep_metadata_check.isChecked(),
+        )
+        # 没打开过的格式面板按默认值
+        if self.png_options is not None:
+            settings = replace(settings, png_compress_level=self.png_level_spin.value())
+        if self.webp_options is not None:
+            settings = replace(
+                settings,
+                webp_quality=self.webp_quality_spin.value(),
+                webp_lossless=self.webp_lossless_check.isChecked(),
+            )
+        return settings
 
     def save_images(self):
-        if not self.watermarked_pixmap or not self.current_image:
-            QMessageBox.warning(self, "提示", "请先应用水印！")
+        if not self.image_paths or not self.current_image:
+            QMessageBox.warning(self, "提示", "请先导入图片！")
+            return
+        if not self.check_watermark():
             return
 
         dir_path = QFileDialog.getExistingDirectory(self, "选择输出文件夹")
@@ -504,8 +904,8 @@ class MainWindow(QWidget):
             return
 
         # 禁止保存到原文件夹
-        src_dir = os.path.dirname(self.current_image)
-        if os.path.abspath(dir_path) == os.path.abspath(src_dir):
+        src_dirs = {os.path.abspath(os.path.dirname(p)) for p in self.image_paths}
+        if os.path.abspath(dir_path) in src_dirs:
             QMessageBox.warning(self, "错误", "不能导出到原文件夹！")
             return
 
@@ -521,24 +921,60 @@ class MainWindow(QWidget):
             if not suffix:
                 suffix = "_watermarked"
 
-        # 遍历导出所有图片
-        for path in self.image_paths:
-            base_name = os.path.basename(path)
-            name, ext = os.path.splitext(base_name)
-            output_name = f"{prefix}{name}{suffix}.{self.output_format.lower()}"
-            output_path = os.path.join(dir_path, output_name)
-            self.watermarked_pixmap.save(output_path, self.output_format)
+        # 每张图片在工作进程中独立解码、加水印、编码
+        jobs = output_jobs(self.image_paths, dir_path, self.output_format, prefix, suffix)
+        # 输出文件夹中的导出清单让重复导出只处理有变化的图片
+        exporter = BatchExporter(
+            self.watermark_spec(), jobs, self.output_format,
+            manifest=ExportManifest(dir_path), settings=self.encoder_settings(),
+        )
+
+        dialog = QProgressDialog("正在导出图片…", "取消", 0, len(jobs), self)
+        dialog.setWindowTitle("导出")
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(0)
+        dialog.canceled.connect(exporter.cancel)
 
-        QMessageBox.information(self, "完成", f"所有图片已导出到：\n{dir_path}")
+        self.export_thread = ExportThread(exporter, self)
+        self.export_thread.progress.connect(lambda done, total: dialog.setValue(done))
+        self.export_thread.finished_export.connect(
+            lambda written, failed: self.on_export_finished(dialog, dir_path, exporter, written, failed)
+        )
+        self.btn_save.setEnabled(False)
+        self.export_thread.start()
+
+    def on_export_finished(self, dialog, dir_path, exporter, written, failed):
+        # 关闭进度框也会触发 canceled，先断开
+        dialog.canceled.disconnect(exporter.cancel)
+        dialog.close()
+        self.btn_save.setEnabled(True)
+        self.export_thread = None
+        if exporter.cancelled:
+            QMessageBox.information(self, "已取消", f"已导出 {len(written)} 张图片到：\n{dir_path}")
+        elif failed:
+            details = "\n".join(f"{os.path.basename(src)}：{err}" for src, err in failed[:10])
+            QMessageBox.warning(
+                self, "部分失败",
+                f"成功 {len(written)} 张，失败 {len(failed)} 张：\n{details}"
+            )
+        elif exporter.skipped:
+            QMessageBox.information(
+                self, "完成",
+                f"已导出 {len(written)} 张图片，{len(exporter.skipped)} 张未变化已跳过：\n{dir_path}"
+            )
+        else:
+            QMessageBox.information(self, "完成", f"所有图片已导出到：\n{dir_path}")
 
     # -------------------- 模板保存与加载 --------------------
 
-    def save_template(self, name):
-        ensure_template_dir()
-        data = {
+    def watermark_settings(self):
+        """当前水印样式与布局（字段与模板文件一致）"""
+        legacy = self.legacy_layout
+        return {
             "text": self.text_input.text(),
             "font_family": self.font_family,
             "font_size": self.font_size,
+            "font_scale": None if legacy else self.font_size / REFERENCE_EDGE,
             "font_bold": self.font_bold,
             "font_italic": self.font_italic,
             "font_color": self.font_color.rgba(),
@@ -547,28 +983,57 @@ class MainWindow(QWidget):
             "outline_enabled": self.outline_enabled,
             "watermark_pos_mode": self.watermark_pos_mode,
             "watermark_angle": self.watermark_angle,
-            "watermark_custom_pos": (
+            "tile_spacing": self.tile_spacing,
+            "tile_spacing_scale": None if legacy else self.tile_spacing / REFERENCE_EDGE,
+            "margin_scale": None if legacy else MARGIN / REFERENCE_EDGE,
+            "watermark_type": self.watermark_type,
+            "logo_path": self.logo_path,
+            "logo_scale": self.logo_scale,
+            "watermark_custom_pos_rel": (
                 [self.watermark_custom_pos.x(), self.watermark_custom_pos.y()]
-                if self.watermark_custom_pos else None
+                if self.watermark_custom_pos is not None else None
+            ),
+            # 旧模板的像素位置原样保留，渲染器按原图像素解释
+            "watermark_custom_pos": (
+                list(self.watermark_custom_pos_px) if self.watermark_custom_pos_px is not None else None
             ),
         }
-        with open(os.path.join(TEMPLATE_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def watermark_spec(self):
+        return WatermarkSpec.from_template(self.watermark_settings())
+
+    def save_template(self, name):
+        try:
+            template_store.save(name, self.watermark_settings())
+        except ValueError as e:
+            QMessageBox.warning(self, "提示", str(e))
+            return False
+        except OSError as e:
+            QMessageBox.warning(self, "提示", f"保存模板失败：{e}")
+            return False
         # 记录最后一次模板
-        with open(LAST_TEMPLATE_PATH, "w", encoding="utf-8") as f:
-            json.dump({"last": name}, f)
+        template_store.set_last(name)
+        return True
 
     def load_template(self, name):
-        path = os.path.join(TEMPLATE_DIR, f"{name}.json")
-        if not os.path.exists(path):
+        try:
+            template = template_store.get(name)
+        except ValueError as e:
+            QMessageBox.warning(self, "提示", f"模板无法读取：{e}")
+            return
+        if template is None:
             QMessageBox.warning(self, "提示", "模板不存在")
             return
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = template.data
         self.text_input.setText(data.get("text", ""))
         self.font_family = data.get("font_family", "Arial")
         self.font_combo.setCurrentFont(QFont(self.font_family))
-        self.font_size = data.get("font_size", 36)
+        # 相对布局的模板按基准图片换算回界面上的数值；旧模板的像素值直接沿用，保存时也不改变含义
+        self.legacy_layout = data.get("font_scale") is None
+        if not self.legacy_layout:
+            self.font_size = round(data["font_scale"] * REFERENCE_EDGE)
+        else:
+            self.font_size = data.get("font_size", 36)
         self.font_size_spin.setValue(self.font_size)
         self.font_bold = data.get("font_bold", False)
         self.bold_check.setChecked(self.font_bold)
@@ -587,36 +1052,50 @@ class MainWindow(QWidget):
             btn.setChecked(m == self.watermark_pos_mode)
         self.watermark_angle = data.get("watermark_angle", 0)
         self.rotate_slider.setValue(self.watermark_angle)
+        if not self.legacy_layout and data.get("tile_spacing_scale") is not None:
+            self.tile_spacing = round(data["tile_spacing_scale"] * REFERENCE_EDGE)
+        else:
+            self.tile_spacing = data.get("tile_spacing", 100)
+        self.tile_spacing_spin.setValue(self.tile_spacing)
+        self.set_logo_path(data.get("logo_path", ""))
+        self.logo_scale_spin.setValue(round(data.get("logo_scale", 0.2) * 100))
+        self.logo_scale = data.get("logo_scale", 0.2)  # 微调框只有整数百分比，保留模板中的精确值
+        if data.get("watermark_type", "text") == "image":
+            self.radio_image_type.setChecked(True)
+        else:
+            self.radio_text_type.setChecked(True)
+        rel = data.get("watermark_custom_pos_rel")
         pos = data.get("watermark_custom_pos")
-        self.watermark_custom_pos = QPoint(*pos) if pos else None
+        self.watermark_custom_pos = QPointF(*rel) if rel else None
+        # 旧模板的像素坐标原样保留，开始拖拽时才按图片尺寸换算为比例
+        self.watermark_custom_pos_px = tuple(pos) if pos and not rel else None
         self.apply_watermark()
 
+    def convert_legacy_custom_pos(self):
+        if self.watermark_custom_pos_px is None or not self.current_image_size.isValid():
+            return
+        x, y = self.watermark_custom_pos_px
+        self.watermark_custom_pos = QPointF(
+            x / self.current_image_size.width(), y / self.current_image_size.height()
+        )
+        self.watermark_custom_pos_px = None
+
     def list_templates(self):
-        ensure_template_dir()
-        return [
-            f[:-5] for f in os.listdir(TEMPLATE_DIR)
-            if f.endswith(".json") and f != "last_template.json"
-        ]
+        return template_store.names()
 
     def delete_template(self, name):
-        path = os.path.join(TEMPLATE_DIR, f"{name}.json")
-        if os.path.exists(path):
-            os.remove(path)
+        template_store.delete(name)
 
     def load_last_template(self):
-        if os.path.exists(LAST_TEMPLATE_PATH):
-            with open(LAST_TEMPLATE_PATH, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            last = data.get("last")
-            if last:
-                self.load_template(last)
-
-    # -------------------- 模板按钮交互 --------------------
+        last = template_store.last()
+        if last:
+            self.load_template(last)
+
     def save_template_dialog(self):
         name, ok = QInputDialog.getText(self, "保存模板", "请输入模板名称：")
         if ok and name.strip():
-            self.save_template(name.strip())
-            QMessageBox.information(self, "提示", f"模板“{name}”已保存")
+            if self.save_template(name.strip()):
+                QMessageBox.information(self, "提示", f"模板“{name}”已保存")
 
     def load_template_dialog(self):
         templates = self.list_templates()
@@ -639,7 +1118,17 @@ class MainWindow(QWidget):
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    if len(sys.argv) > 1 and sys.argv[1] in ("batch", "watch", "serve", "loadtest", "bench"):
+        # 无界面的命令行模式
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+    argv, measure_startup, budget_ms = startup.parse_args(sys.argv)
+    app = QApplication(argv)
+    startup.mark("qapplication")
     window = MainWindow()
+    startup.mark("window")
+    if measure_startup:
+        # 首次绘制完成后输出各阶段耗时并退出
+        startup.exit_after_first_paint(app, window, budget_ms)
     window.show()
     sys.exit(app.exec())
@@ -0,0 +1,153 @@
+"""导出清单：让批量导出可以中断后续跑、重复运行时跳过未变化的文件
+
+清单是输出文件夹中的一个 JSON Lines 文件，每导出成功一张追加一行：
+源文件路径、大小、修改时间，水印设置摘要，输出路径、格式及输出文件的大小和修改时间。
+重新导出时，源文件和设置都没变、输出文件也还在且未被改动的任务直接跳过。
+
+只有主进程写清单，每行写完立即 flush；进程崩溃最多丢掉最后一行（对应的文件下次重新导出）。
+"""
+import os
+import json
+import hashlib
+
+
+MANIFEST_NAME = ".watermark-manifest.jsonl"
+MANIFEST_VERSION = 1
+# is_up_to_date 用到的字段及类型
+_ENTRY_FIELDS = {
+    "src": str, "digest": str, "dst": str,
+    "src_size": int, "src_mtime_ns": int, "dst_size": int, "dst_mtime_ns": int,
+}
+
+
+def spec_digest(spec, output_format, settings=None):
+    """水印设置 + 输出格式 + 编码参数的稳定摘要（内置 hash() 每次启动都不同，不能写进文件）"""
+    payload = {"spec": spec.to_template(), "format": output_format.upper()}
+    if settings is not None:
+        payload["encoder"] = settings.to_dict()
+    if spec.watermark_type == "image":
+        # Logo 文件被替换后也要重新导出
+        try:
+            st = os.stat(spec.logo_path)
+            payload["logo"] = [st.st_size, st.st_mtime_ns]
+        except OSError:
+            payload["logo"] = None
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _valid_entry(entry):
+    """清单行是当前版本且字段齐全、类型正确"""
+    if not isinstance(entry, dict) or entry.get("version") != MANIFEST_VERSION:
+        return False
+    return all(
+        isinstance(entry.get(key), kind) and not isinstance(entry.get(key), bool)
+        for key, kind in _ENTRY_FIELDS.items()
+    )
+
+
+def atomic_tmp_path(dst):
+    """与 dst 同目录的临时文件名，写完后用 os.replace 改名即为原子替换"""
+    folder, name = os.path.split(dst)
+    return os.path.join(folder, f".{name}.{os.getpid()}.tmp")
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class ExportManifest:
+    """输出文件夹中的导出清单，以输出路径为键，同一路径后写的记录覆盖先写的"""
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self.entries = {}
+        self._lines = 0
+        self._file = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 崩溃时写了一半的行
+                    if _valid_entry(entry):  # 其它版本或被改坏的行当作没有记录
+                        self.entries[entry["dst"]] = entry
+        except FileNotFoundError:
+            pass
+
+    def source_stamp(self, src):
+        """源文件的 (大小, 修改时间)，读不到时返回 None"""
+        try:
+            return _stamp(src)
+        except OSError:
+            return None
+
+    def is_up_to_date(self, src, dst, digest, stamp):
+        """dst 已由同一源文件、同一设置导出过且之后都未改动"""
+        entry = self.entries.get(os.path.abspath(dst))
+        if entry is None or stamp is None:
+            return False
+        if (
+            entry["src"] != os.path.abspath(src)
+            or entry["digest"] != digest
+            or (entry["src_size"], entry["src_mtime_ns"]) != stamp
+        ):
+            return False
+        try:
+            return _stamp(dst) == (entry["dst_size"], entry["dst_mtime_ns"])
+        except OSError:
+            return False
+
+    def record(self, src, dst, digest, stamp, output_format):
+        """追加一条记录；stamp 为导出前取得的源文件状态，导出期间源文件被改写则下次重新导出"""
+        if stamp is None:
+            return
+        try:
+            dst_size, dst_mtime_ns = _stamp(dst)
+        except OSError:
+            return
+        entry = {
+            "version": MANIFEST_VERSION,
+            "src": os.path.abspath(src),
+            "src_size": stamp[0],
+            "src_mtime_ns": stamp[1],
+            "digest": digest,
+            "dst": os.path.abspath(dst),
+            "format": output_format.upper(),
+            "dst_size": dst_size,
+            "dst_mtime_ns": dst_mtime_ns,
+        }
+        self.entries[entry["dst"]] = entry
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._lines += 1
+
+    def close(self):
+        """关闭清单；重复记录过多时压缩成每个输出一行"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lines > 2 * len(self.entries) + 100:
+            self.compact()
+
+    def compact(self):
+        tmp = atomic_tmp_path(self.path)
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            self._lines = len(self.entries)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
@@ -0,0 +1,249 @@
+"""图片元数据：EXIF 方向、EXIF 原始数据和 ICC 配置文件
+
+只读取文件头（JPEG 的 APP 段、PNG/WebP 在图像数据之前的块、TIFF 的首个 IFD），不解码像素，
+也不依赖 Pillow，界面启动时可以直接导入。
+
+- read_metadata(path)：按 (路径, 修改时间, 大小) 缓存，同一文件只解析一次；
+- metadata_from_bytes(data)：已读入内存的文件（批量导出、HTTP 服务），不再产生额外 I/O；
+- orient(image, orientation)：按 EXIF 方向把解码出的 QImage 转正。
+
+导出时 Metadata.exif_for_export() 给出方向已改为 1（像素已经转正）的 EXIF，
+与 ICC 配置文件一起交给编码器写入输出文件。
+"""
+import io
+import os
+import zlib
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+
+from PySide6.QtGui import QTransform
+
+import stats
+
+
+EXIF_PREFIX = b"Exif\x00\x00"
+ORIENTATION_TAG = 0x0112
+ICC_TAG = 34675
+
+# 方向 -> 把像素转正的变换（y 轴向下，rotate 为顺时针）
+_TRANSFORMS = {
+    2: QTransform(-1, 0, 0, 1, 0, 0),  # 水平翻转
+    3: QTransform().rotate(180),
+    4: QTransform(1, 0, 0, -1, 0, 0),  # 垂直翻转
+    5: QTransform(0, 1, 1, 0, 0, 0),  # 沿主对角线翻转
+    6: QTransform().rotate(90),
+    7: QTransform(0, -1, -1, 0, 0, 0),  # 沿副对角线翻转
+    8: QTransform().rotate(270),
+}
+
+
+@dataclass(frozen=True)
+class Metadata:
+    orientation: int = 1
+    exif: bytes = None  # 以 "Exif\0\0" 开头，与 Pillow 的 exif 参数格式相同
+    icc: bytes = None
+    orientation_offset: int = None  # 方向值在 exif 中的字节位置
+
+    @property
+    def swaps_axes(self):
+        """转正后宽高互换（方向 5-8）"""
+        return self.orientation in (5, 6, 7, 8)
+
+    def exif_for_export(self):
+        """写入输出文件的 EXIF：像素已按方向转正，方向改为 1"""
+        if self.exif is None or self.orientation_offset is None or self.orientation == 1:
+            return self.exif
+        exif = bytearray(self.exif)
+        order = ">" if exif[len(EXIF_PREFIX):len(EXIF_PREFIX) + 2] == b"MM" else "<"
+        struct.pack_into(order + "H", exif, self.orientation_offset, 1)
+        return bytes(exif)
+
+
+NO_METADATA = Metadata()
+
+
+def orient(image, orientation):
+    """按 EXIF 方向转正图像，方向为 1 或未知时原样返回"""
+    transform = _TRANSFORMS.get(orientation)
+    if transform is None or image.isNull():
+        return image
+    with stats.span("orient", orientation=orientation):
+        return image.transformed(transform)
+
+
+def _parse_exif(exif):
+    """从 EXIF 中找出方向，返回 (方向, 方向值的位置)"""
+    tiff = len(EXIF_PREFIX)
+    if len(exif) < tiff + 8:
+        return 1, None
+    order = {b"II": "<", b"MM": ">"}.get(exif[tiff:tiff + 2])
+    if order is None:
+        return 1, None
+    ifd = tiff + struct.unpack_from(order + "I", exif, tiff + 4)[0]
+    if ifd + 2 > len(exif):
+        return 1, None
+    count = struct.unpack_from(order + "H", exif, ifd)[0]
+    for i in range(count):
+        entry = ifd + 2 + i * 12
+        if entry + 12 > len(exif):
+            break
+        tag, kind = struct.unpack_from(order + "HH", exif, entry)
+        if tag == ORIENTATION_TAG and kind == 3:
+            value = struct.unpack_from(order + "H", exif, entry + 8)[0]
+            return (value if 1 <= value <= 8 else 1), entry + 8
+    return 1, None
+
+
+def _metadata(exif, icc, orientation=None):
+    if exif is not None and not exif.startswith(EXIF_PREFIX):
+        exif = EXIF_PREFIX + exif
+    offset = None
+    if orientation is None:
+        orientation, offset = _parse_exif(exif) if exif else (1, None)
+    return Metadata(orientation, exif, icc, offset)
+
+
+def _read_jpeg(f):
+    exif = None
+    icc_chunks = {}
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        kind = marker[1]
+        if kind == 0xFF:  # 填充字节
+            f.seek(-1, io.SEEK_CUR)
+            continue
+        if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+            continue  # 没有长度字段的标记
+        if kind in (0xDA, 0xD9):
+            break  # 扫描数据开始，文件头结束
+        raw = f.read(2)
+        if len(raw) < 2:
+            break
+        length = struct.unpack(">H", raw)[0] - 2
+        if kind == 0xE1 and exif is None:
+            payload = f.read(length)
+            if payload.startswith(EXIF_PREFIX):
+                exif = payload
+        elif kind == 0xE2:
+            payload = f.read(length)
+            if payload.startswith(b"ICC_PROFILE\x00") and len(payload) > 14:
+                icc_chunks[payload[12]] = payload[14:]
+        else:
+            f.seek(length, io.SEEK_CUR)
+    icc = b"".join(icc_chunks[i] for i in sorted(icc_chunks)) if icc_chunks else None
+    return _metadata(exif, icc)
+
+
+def _read_png(f):
+    exif = icc = None
+    f.seek(8)
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            break
+        length, kind = struct.unpack(">I4s", head)
+        if kind in (b"IDAT", b"IEND"):
+            break
+        if kind == b"eXIf":
+            exif = f.read(length)
+            f.seek(4, io.SEEK_CUR)
+        elif kind == b"iCCP":
+            payload = f.read(length)
+            f.seek(4, io.SEEK_CUR)
+            name_end = payload.find(b"\x00")
+            if name_end >= 0:
+                try:
+                    icc = zlib.decompress(payload[name_end + 2:])
+                except zlib.error:
+                    icc = None
+        else:
+            f.seek(length + 4, io.SEEK_CUR)
+    return _metadata(exif, icc)
+
+
+def _read_webp(f):
+    exif = icc = None
+    f.seek(12)
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            break
+        kind, length = struct.unpack("<4sI", head)
+        padded = length + (length & 1)
+        if kind == b"EXIF":
+            exif = f.read(length)
+            f.seek(padded - length, io.SEEK_CUR)
+        elif kind == b"ICCP":
+            icc = f.read(length)
+            f.seek(padded - length, io.SEEK_CUR)
+        else:
+            f.seek(padded, io.SEEK_CUR)
+    return _metadata(exif, icc)
+
+
+def _read_tiff(f, order):
+    """TIFF 的方向和 ICC 在首个 IFD 中；EXIF 即文件结构本身，不单独提取"""
+    f.seek(4)
+    ifd = struct.unpack(order + "I", f.read(4))[0]
+    f.seek(ifd)
+    count = struct.unpack(order + "H", f.read(2))[0]
+    entries = f.read(count * 12)
+    orientation, icc = 1, None
+    for i in range(len(entries) // 12):
+        tag, kind, n, value = struct.unpack_from(order + "HHI4s", entries, i * 12)
+        if tag == ORIENTATION_TAG and kind == 3:
+            orientation = struct.unpack(order + "H", value[:2])[0]
+            if not 1 <= orientation <= 8:
+                orientation = 1
+        elif tag == ICC_TAG and kind in (1, 7) and n:
+            if n <= 4:
+                icc = value[:n]
+            else:
+                f.seek(struct.unpack(order + "I", value)[0])
+                icc = f.read(n)
+    return _metadata(None, icc or None, orientation)
+
+
+def parse_metadata(f):
+    """从可 seek 的二进制文件对象读取元数据，只读文件头；无法识别时返回 NO_METADATA"""
+    magic = f.read(12)
+    try:
+        if magic[:2] == b"\xff\xd8":
+            return _read_jpeg(f)
+        if magic[:8] == b"\x89PNG\r\n\x1a\n":
+            return _read_png(f)
+        if magic[:4] == b"RIFF" and magic[8:12] == b"WEBP":
+            return _read_webp(f)
+        if magic[:4] in (b"II*\x00", b"MM\x00*"):
+            return _read_tiff(f, "<" if magic[:2] == b"II" else ">")
+    except (struct.error, OSError, ValueError):
+        pass  # 文件头损坏：当作没有元数据，由解码器决定能否读取
+    return NO_METADATA
+
+
+def metadata_from_bytes(data):
+    """已读入内存的文件的元数据"""
+    with stats.span("metadata"):
+        return parse_metadata(io.BytesIO(data))
+
+
+@lru_cache(maxsize=1024)
+def _read_cached(path, mtime_ns, size):
+    with stats.span("metadata"), open(path, "rb") as f:
+        return parse_metadata(f)
+
+
+def read_metadata(path):
+    """文件的元数据，按 (路径, 修改时间, 大小) 缓存；文件不可读时返回 NO_METADATA"""
+    try:
+        st = os.stat(path)
+        return _read_cached(path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return NO_METADATA
+
+
+stats.register_cache("metadata", stats.lru_info(_read_cached))
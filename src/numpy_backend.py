@@ -0,0 +1,176 @@
+"""NumPy 合成后端
+
+直接在 QImage.bits() 的零拷贝视图上做向量化运算，不经过 QPainter：
+
+- blend()：把预乘透明度的水印图块按 source-over 混合进图像，舍入方式与 Qt 的 BYTE_MUL 相同；
+- text_layers()：文字只栅格化一次得到覆盖率，阴影和 8 方向描边用覆盖率的平移合成，
+  代替逐层重复 drawText。
+
+不支持的像素格式（灰度、非预乘 ARGB 等）返回 False，由调用方改用 QPainter。
+输出与 QPainter 后端的差异用 difference() 衡量（在水印覆盖的区域内比较），平均差异和
+99 分位数应在 MAX_MEAN_DIFF / MAX_P99_DIFF 以内。两者的文字栅格化不完全相同（Qt 按字形
+分别对齐像素），个别边缘像素的差异可以较大，因此不限制最大值。
+"""
+import sys
+import math
+
+import numpy as np
+from PySide6.QtGui import QImage
+
+
+# 与 QPainter 输出的允许差异（每通道 0-255）
+MAX_MEAN_DIFF = 1.5
+MAX_P99_DIFF = 40
+
+# 32 位格式按 0xAARRGGBB 存储，内存中的字节顺序取决于字节序
+if sys.byteorder == "little":
+    _A, _R, _G, _B = 3, 2, 1, 0
+else:
+    _A, _R, _G, _B = 0, 1, 2, 3
+
+_ARGB32 = (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied)
+BLEND_ROWS = 64
+
+
+def qimage_array(image, writable=True):
+    """QImage 像素的 (高, 宽, 每像素字节数) uint8 视图，不复制数据；调用方须保持 image 存活"""
+    channels = image.depth() // 8
+    buffer = image.bits() if writable else image.constBits()
+    rows = np.frombuffer(buffer, np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width() * channels].reshape(image.height(), image.width(), channels)
+
+
+def _byte_mul(values, factor):
+    """round(values * factor / 255)，与 Qt 的 BYTE_MUL 相同"""
+    t = values.astype(np.uint16) * factor + 128
+    return (t + (t >> 8)) >> 8
+
+
+def _byte_mul_packed(pixels, factor):
+    """对打包的 32 位像素的四个通道同时做 BYTE_MUL（与 Qt 的实现逐位相同）"""
+    t = (pixels & 0xFF00FF) * factor
+    t = ((t + ((t >> 8) & 0xFF00FF) + 0x800080) >> 8) & 0xFF00FF
+    x = ((pixels >> 8) & 0xFF00FF) * factor
+    x = (x + ((x >> 8) & 0xFF00FF) + 0x800080) & 0xFF00FF00
+    return x | t
+
+
+def _pixel_words(image, writable=True):
+    """32 位格式的 (高, 宽) uint32 视图"""
+    buffer = image.bits() if writable else image.constBits()
+    rows = np.frombuffer(buffer, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+    return rows[:, :image.width()]
+
+
+def blend(image, sprite, x, y):
+    """把预乘的 sprite 以左上角 (x, y) 混合进 image（原地），不支持的格式返回 False"""
+    fmt = image.format()
+    if fmt not in _ARGB32 and fmt != QImage.Format_RGB888:
+        return False
+    x0, y0 = max(x, 0), max(y, 0)
+    x1 = min(x + sprite.width(), image.width())
+    y1 = min(y + sprite.height(), image.height())
+    if x0 >= x1 or y0 >= y1:
+        return True
+    alpha = qimage_array(sprite, writable=False)[y0 - y:y1 - y, x0 - x:x1 - x, _A]
+    if fmt in _ARGB32:
+        src = _pixel_words(sprite, writable=False)[y0 - y:y1 - y, x0 - x:x1 - x]
+        dst = _pixel_words(image)[y0:y1, x0:x1]
+    else:
+        src = qimage_array(sprite, writable=False)[y0 - y:y1 - y, x0 - x:x1 - x][..., [_R, _G, _B]]
+        dst = qimage_array(image)[y0:y1, x0:x1]
+    # 按行分块，中间数组留在缓存中；每块只处理有不透明像素的列范围
+    for row in range(0, y1 - y0, BLEND_ROWS):
+        a = alpha[row:row + BLEND_ROWS]
+        columns = np.flatnonzero(a.any(axis=0))
+        if not len(columns):
+            continue
+        c0, c1 = columns[0], columns[-1] + 1
+        a = a[:, c0:c1]
+        s = src[row:row + BLEND_ROWS, c0:c1]
+        d = dst[row:row + BLEND_ROWS, c0:c1]
+        if fmt in _ARGB32:
+            d[...] = s + _byte_mul_packed(d, (255 - a).astype(np.uint32))
+        else:
+            d[...] = s + _byte_mul(d, (255 - a.astype(np.uint16))[..., None])
+    return True
+
+
+def _sample(a, rows, cols, dx, dy):
+    """a 平移 (dx, dy) 后在 [rows, cols] 窗口内的值；dy 为整数，dx 的小数部分按线性插值"""
+    h, w = a.shape
+    out = np.zeros((rows.stop - rows.start, cols.stop - cols.start), np.float32)
+    ix = math.floor(dx)
+    for shift, weight in ((ix, 1 - (dx - ix)), (ix + 1, dx - ix)):
+        if weight < 1e-3:
+            continue
+        y0, y1 = max(rows.start, dy), min(rows.stop, h + dy)
+        x0, x1 = max(cols.start, shift), min(cols.stop, w + shift)
+        if y0 < y1 and x0 < x1:
+            out[y0 - rows.start:y1 - rows.start, x0 - cols.start:x1 - cols.start] += (
+                weight * a[y0 - dy:y1 - dy, x0 - shift:x1 - shift]
+            )
+    return out
+
+
+def text_layers(coverage, color, text_alpha, shadow_alpha=0, shadow_offset=None,
+                outline_alpha=0, outline_offsets=()):
+    """由文字覆盖率合成 阴影 + 描边 + 正文，返回新的预乘 QImage
+
+    coverage 是只画了一次不透明文字的预乘图块，透明度通道即覆盖率；color 为正文的 (r, g, b)。
+    阴影和描边都是黑色，叠加顺序与 QPainter 逐层绘制相同：多层黑色按 source-over 叠加后
+    透明度为 1 - Π(1 - 各层透明度)，正文再盖在上面。
+    偏移量为图块像素坐标（已含旋转）。纵向取整到整像素，横向按线性插值，与 Qt 绘制文字时
+    字形位置的处理方式接近。旋转后的图块大部分是空白，按行分块只处理有文字的列范围。
+    """
+    a = qimage_array(coverage, writable=False)[..., _A].astype(np.float32) / 255
+    h, w = a.shape
+    layers = [(shadow_offset, shadow_alpha)] if shadow_offset is not None else []
+    layers = [
+        ((dx, round(dy)), alpha / 255)
+        for (dx, dy), alpha in layers + [(offset, outline_alpha) for offset in outline_offsets]
+    ]
+    reach = max([math.ceil(max(abs(dx), abs(dy))) for (dx, dy), _ in layers] + [0])
+
+    # 每行有文字的列范围
+    inked = a > 0
+    has_ink = inked.any(axis=1)
+    first = np.where(has_ink, inked.argmax(axis=1), w)
+    last = np.where(has_ink, w - 1 - inked[:, ::-1].argmax(axis=1), -1)
+
+    image = QImage(w, h, QImage.Format_ARGB32_Premultiplied)
+    image.setDotsPerMeterX(coverage.dotsPerMeterX())
+    image.setDotsPerMeterY(coverage.dotsPerMeterY())
+    image.fill(0)
+    out = qimage_array(image)
+    for r0 in range(0, h, BLEND_ROWS):
+        r1 = min(r0 + BLEND_ROWS, h)
+        c0 = max(int(first[max(r0 - reach, 0):r1 + reach].min()) - reach, 0)
+        c1 = min(int(last[max(r0 - reach, 0):r1 + reach].max()) + reach + 1, w)
+        if c0 >= c1:
+            continue
+        rows, cols = slice(r0, r1), slice(c0, c1)
+        keep = np.ones((r1 - r0, c1 - c0), np.float32)  # 背景层（阴影、描边）未覆盖的比例
+        for (dx, dy), alpha in layers:
+            keep *= 1 - alpha * _sample(a, rows, cols, dx, dy)
+        text = a[rows, cols] * (text_alpha / 255)
+        block = out[rows, cols]
+        block[..., _A] = np.rint((text + (1 - keep) * (1 - text)) * 255)
+        for index, value in zip((_R, _G, _B), color):
+            block[..., index] = np.rint(text * value)
+    return image
+
+
+def difference(a, b):
+    """两张同尺寸图像逐通道差异的 (平均值, 99 分位数, 最大值)"""
+    a = a.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    b = b.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    diff = np.abs(
+        qimage_array(a, writable=False).astype(np.int16) - qimage_array(b, writable=False)
+    )
+    return float(diff.mean()), float(np.percentile(diff, 99)), int(diff.max())
+
+
+def within_tolerance(a, b):
+    mean, p99, _ = difference(a, b)
+    return mean <= MAX_MEAN_DIFF and p99 <= MAX_P99_DIFF
@@ -0,0 +1,92 @@
+"""预览渲染调度
+
+交互调整时不在原图上绘制：每张图片只解码一次显示尺寸的代理图（存放在共享的
+image_cache 中），水印按 代理图/原图 的比例绘制在代理图上，原图分辨率只在导出时使用。
+连续的参数变化由 PreviewScheduler 合并，每帧最多渲染一次，并在后台线程执行。
+"""
+from PySide6.QtGui import QImage
+from PySide6.QtCore import QSize, QObject, QRunnable, QThreadPool, QTimer, Signal
+
+import stats
+from renderer import render
+
+
+class _RenderTask(QRunnable):
+    def __init__(self, scheduler, generation, path, target_size, spec):
+        super().__init__()
+        self.scheduler = scheduler
+        self.generation = generation
+        self.path = path
+        self.target_size = target_size
+        self.spec = spec
+
+    def run(self):
+        # 开始前已有更新的请求，直接放弃
+        if self.generation != self.scheduler.generation:
+            return
+        with stats.span("preview"):
+            proxy, full_size = self.scheduler.image_cache.get(self.path, self.target_size)
+            if proxy.isNull():
+                return
+            image = render(proxy, self.spec, proxy.width() / full_size.width())
+        self.scheduler._rendered.emit(self.generation, image, full_size)
+
+
+class PreviewScheduler(QObject):
+    """合并短时间内的多次预览请求，在后台线程只渲染最新的一次
+
+    第一次请求立即派发，之后一帧（FRAME_MS）内的请求只保留最后一个，
+    帧结束时再派发。过期的渲染结果会被丢弃，ready 只发出最新一次的结果。
+    """
+    FRAME_MS = 16
+
+    ready = Signal(QImage, QSize)  # 加好水印的代理图, 原图尺寸
+    _rendered = Signal(int, QImage, QSize)
+
+    def __init__(self, image_cache, parent=None):
+        super().__init__(parent)
+        self.image_cache = image_cache
+        self.generation = 0
+        self._pending = None
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.FRAME_MS)
+        self._timer.timeout.connect(self._on_frame)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._rendered.connect(self._on_rendered)
+
+    def request(self, path, target_size, spec):
+        self._pending = (path, QSize(target_size), spec)
+        if not self._timer.isActive():
+            self._dispatch()
+            self._timer.start()
+
+    def cancel(self):
+        """丢弃所有排队和进行中的请求（例如切换图片时）"""
+        self._pending = None
+        self._timer.stop()
+        self.generation += 1
+        self._pool.clear()
+
+    def shutdown(self):
+        """取消所有请求并等进行中的渲染完成（窗口关闭时调用）"""
+        self.cancel()
+        self._pool.waitForDone()
+
+    def _on_frame(self):
+        if self._pending is not None:
+            self._dispatch()
+            self._timer.start()
+
+    def _dispatch(self):
+        path, target_size, spec = self._pending
+        self._pending = None
+        self.generation += 1
+        # 尚未开始的旧任务不再需要
+        self._pool.clear()
+        self._pool.start(_RenderTask(self, self.generation, path, target_size, spec))
+
+    def _on_rendered(self, generation, image, full_size):
+        if generation == self.generation:
+            self.ready.emit(image, full_size)
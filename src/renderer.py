@@ -0,0 +1,550 @@
+"""水印渲染器
+
+与界面无关的纯函数式渲染：输入一个不可变、可哈希的 WatermarkSpec 和一张 QImage，
+输出加好水印的 QImage，不读取任何控件状态。只使用 QImage/QPainter（不用 QPixmap），
+因此可以在工作线程、工作进程、测试和命令行中调用。
+
+水印可以是文字，也可以是带透明通道的图片（Logo）。两者都先栅格化成图块并缓存，
+每张图片只需一次混合。
+
+合成后端可在运行时切换（set_backend 或环境变量 WATERMARK_BACKEND）：qpainter 为默认；
+numpy 用 numpy_backend 在像素数组上混合图块、用数组平移合成阴影和描边，需要安装 NumPy。
+平铺模式和 NumPy 不支持的像素格式始终使用 QPainter。
+"""
+import os
+import math
+from dataclasses import dataclass, fields, asdict, replace
+from functools import lru_cache
+
+from PySide6.QtGui import QPainter, QColor, QFont, QFontMetrics, QImage, QTransform, QBrush
+from PySide6.QtCore import Qt, QPoint, QPointF, QRect, QRectF
+
+import stats
+from metadata import orient, read_metadata
+
+
+MARGIN = 30
+SPRITE_CACHE_SIZE = 64
+
+# 相对布局以短边为 REFERENCE_EDGE 像素的图片为基准：界面中的字号、边距和间距都是在这个尺寸下的值
+REFERENCE_EDGE = 1000
+_POINT_DPM = 2835  # 72 DPI，1 磅 = 1 像素，相对布局的字号与图片的 DPI 无关
+_SCALE_STEPS = 256  # 相对布局的缩放比例按 1/256 量化，尺寸相近的图片共用同一个图块
+
+# 决定水印图块外观的字段（不含位置），作为图块缓存的键
+STYLE_FIELDS = (
+    "text", "font_family", "font_size", "font_bold", "font_italic", "font_color",
+    "font_opacity", "shadow_enabled", "outline_enabled", "watermark_angle",
+)
+
+POSITION_MODES = (
+    "top_left", "top_center", "top_right",
+    "center_left", "center", "center_right",
+    "bottom_left", "bottom_center", "bottom_right",
+)
+
+# 平铺模式：水印按 tile_spacing 间距铺满全图，整个图案按 watermark_angle 旋转
+TILE_MODE = "tile"
+
+WATERMARK_TYPES = ("text", "image")
+LOGO_CACHE_SIZE = 8
+
+BACKENDS = ("qpainter", "numpy")
+_backend = "qpainter"
+
+
+def set_backend(name):
+    """切换合成后端；numpy 后端需要安装 NumPy，否则抛出 ValueError"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"未知的合成后端：{name}，可选 {', '.join(BACKENDS)}")
+    if name == "numpy":
+        try:
+            import numpy_backend  # noqa: F401
+        except ImportError as e:
+            raise ValueError(f"numpy 后端需要安装 NumPy：{e}") from e
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+if os.environ.get("WATERMARK_BACKEND"):
+    set_backend(os.environ["WATERMARK_BACKEND"])
+
+
+@dataclass(frozen=True)
+class WatermarkSpec:
+    """水印样式与布局，字段与模板文件一致"""
+    text: str = ""
+    font_family: str = "Arial"
+    font_size: int = 36
+    font_bold: bool = False
+    font_italic: bool = False
+    font_color: int = 0xB4FFFFFF  # QColor(255, 255, 255, 180).rgba()
+    font_opacity: int = 180  # 0-255，图片水印同样使用
+    shadow_enabled: bool = False
+    outline_enabled: bool = False
+    watermark_pos_mode: str = "bottom_right"
+    watermark_angle: int = 0
+    watermark_custom_pos: tuple = None  # (x, y)，仅 custom 模式使用
+    tile_spacing: int = 100  # 平铺模式下相邻水印的间距（原图像素）
+    watermark_type: str = "text"  # text / image
+    logo_path: str = ""
+    logo_scale: float = 0.2  # 图片水印长边占原图短边的比例
+    # 相对布局：font_scale 不为 None 时启用，各尺寸都按图片短边/宽高的比例给出；
+    # 旧模板没有这些字段，仍按原图像素解释 font_size、MARGIN、watermark_custom_pos 和 tile_spacing
+    font_scale: float = None  # 字号（像素）占短边的比例
+    margin_scale: float = None  # 九宫格边距占短边的比例，None 为 MARGIN / REFERENCE_EDGE
+    watermark_custom_pos_rel: tuple = None  # 自定义位置占宽、高的比例 (fx, fy)
+    tile_spacing_scale: float = None  # 平铺间距占短边的比例，None 为 tile_spacing / REFERENCE_EDGE
+
+    @classmethod
+    def from_template(cls, data):
+        """由模板字典构造，忽略未知字段，缺省字段取默认值"""
+        known = {f.name for f in fields(cls)}
+        values = {k: v for k, v in data.items() if k in known}
+        for name in ("watermark_custom_pos", "watermark_custom_pos_rel"):
+            if values.get(name) is not None:
+                values[name] = tuple(values[name])
+        return cls(**values)
+
+    def to_template(self):
+        data = asdict(self)
+        for name in ("watermark_custom_pos", "watermark_custom_pos_rel"):
+            if data[name] is not None:
+                data[name] = list(data[name])
+        return data
+
+    @property
+    def display_text(self):
+        return self.text.strip()
+
+    @property
+    def has_watermark(self):
+        if self.watermark_type == "image":
+            return bool(self.logo_path)
+        return bool(self.display_text)
+
+    def style_key(self):
+        """与位置无关的外观字段元组（按 STYLE_FIELDS 顺序）"""
+        return tuple(getattr(self, name) for name in STYLE_FIELDS)
+
+
+@lru_cache(maxsize=32)
+def make_font(family, size, bold, italic):
+    font = QFont(family)
+    font.setPointSizeF(size)
+    if bold:
+        font.setWeight(QFont.Weight.Bold)
+    else:
+        font.setWeight(QFont.Weight.Normal)
+    font.setItalic(italic)
+    return font
+
+
+def spec_font(spec, scale=1.0):
+    return make_font(spec.font_family, spec.font_size * scale, spec.font_bold, spec.font_italic)
+
+
+@dataclass(frozen=True)
+class Geometry:
+    """换算到某一画布上的水印几何参数（画布像素）"""
+    sprite_scale: float  # 字号、阴影和描边偏移的缩放比例
+    dpm_x: int  # 栅格化文字时使用的分辨率
+    dpm_y: int
+    margin: int
+    custom_pos: tuple  # 自定义位置，未设置时为 None
+    spacing: int  # 平铺间距
+
+
+def resolve_geometry(spec, width, height, dpm_x, dpm_y, scale=1.0):
+    """把模板中的布局换算到 width x height 的画布上，只做常数次运算、不测量文字
+
+    相对布局按画布自身的短边和宽高换算，预览代理图与原图的几何关系天然一致，scale 不起作用；
+    旧模板的尺寸按原图像素给出，scale 为画布相对原图的缩放比例（预览代理图小于 1）。
+    两种布局都优先使用比例位置（界面中拖拽得到），没有时才用模板中的像素位置。
+    """
+    if spec.font_scale is None:
+        custom = None
+        if spec.watermark_custom_pos_rel is not None:
+            fx, fy = spec.watermark_custom_pos_rel
+            custom = (round(fx * width), round(fy * height))
+        elif spec.watermark_custom_pos is not None:
+            cx, cy = spec.watermark_custom_pos
+            custom = (round(cx * scale), round(cy * scale))
+        return Geometry(
+            scale, dpm_x, dpm_y, round(MARGIN * scale), custom, max(1, round(spec.tile_spacing * scale)),
+        )
+
+    short = min(width, height)
+    steps = max(1, round(spec.font_scale * short / spec.font_size * _SCALE_STEPS))
+    margin_scale = spec.margin_scale if spec.margin_scale is not None else MARGIN / REFERENCE_EDGE
+    spacing_scale = (
+        spec.tile_spacing_scale if spec.tile_spacing_scale is not None else spec.tile_spacing / REFERENCE_EDGE
+    )
+    custom = None
+    if spec.watermark_custom_pos_rel is not None:
+        fx, fy = spec.watermark_custom_pos_rel
+        custom = (round(fx * width), round(fy * height))
+    elif spec.watermark_custom_pos is not None:
+        cx, cy = spec.watermark_custom_pos
+        custom = (round(cx * scale), round(cy * scale))
+    return Geometry(
+        steps / _SCALE_STEPS, _POINT_DPM, _POINT_DPM, round(margin_scale * short), custom,
+        max(1, round(spacing_scale * short)),
+    )
+
+
+def text_position(spec, geometry, w, h, tw, th):
+    """返回文字基线起点 (x, y)，geometry 由 resolve_geometry 得到"""
+    if spec.watermark_pos_mode == "custom" and geometry.custom_pos is not None:
+        cx, cy = geometry.custom_pos
+        return cx - tw // 2, cy + th // 2
+    margin = geometry.margin
+    pos_map = {
+        "top_left": (margin, margin + th),
+        "top_center": (w // 2 - tw // 2, margin + th),
+        "top_right": (w - tw - margin, margin + th),
+        "center_left": (margin, h // 2 + th // 2),
+        "center": (w // 2 - tw // 2, h // 2 + th // 2),
+        "center_right": (w - tw - margin, h // 2 + th // 2),
+        "bottom_left": (margin, h - margin),
+        "bottom_center": (w // 2 - tw // 2, h - margin),
+        "bottom_right": (w - tw - margin, h - margin),
+    }
+    return pos_map.get(spec.watermark_pos_mode, (w - tw - margin, h - margin))
+
+
+def _draw_text_layers(painter, spec, text, scale=1.0):
+    """在基线起点 (0, 0) 依次绘制阴影、描边和正文"""
+    opacity = spec.font_opacity
+    color = QColor.fromRgba(spec.font_color)
+    color.setAlpha(opacity)
+
+    # 阴影
+    if spec.shadow_enabled:
+        painter.setPen(QColor(0, 0, 0, int(opacity * 0.6)))
+        painter.drawText(QPointF(2 * scale, 2 * scale), text)
+
+    # 描边
+    if spec.outline_enabled:
+        painter.setPen(QColor(0, 0, 0, opacity))
+        for dx in [-1, 0, 1]:
+            for dy in [-1, 0, 1]:
+                if dx != 0 or dy != 0:
+                    painter.drawText(QPointF(dx * scale, dy * scale), text)
+
+    # 正文
+    painter.setPen(color)
+    painter.drawText(QPointF(0, 0), text)
+
+
+@dataclass(frozen=True)
+class Sprite:
+    """预先栅格化（含阴影、描边、透明度、旋转）的水印图块"""
+    image: QImage  # Format_ARGB32_Premultiplied
+    tw: int  # 未旋转文字的宽高，用于布局计算
+    th: int
+    left: int  # 图块左上角相对文字基线起点的偏移
+    top: int
+
+
+def _rasterize(local, tw, th, angle, dpm_x, dpm_y, draw):
+    """把以基线起点为原点、范围为 local 的内容旋转后画进一张透明图块"""
+    with stats.span("sprite"):
+        return _rasterize_into(local, tw, th, angle, dpm_x, dpm_y, draw)
+
+
+def _rasterize_into(local, tw, th, angle, dpm_x, dpm_y, draw):
+    # 旋转中心与 text_position 的约定一致：(x + tw // 2, y - th // 2)
+    transform = QTransform()
+    if angle != 0:
+        cx, cy = tw // 2, -(th // 2)
+        transform.translate(cx, cy)
+        transform.rotate(angle)
+        transform.translate(-cx, -cy)
+    bounds = transform.mapRect(local)
+    left, top = math.floor(bounds.left()), math.floor(bounds.top())
+    width = math.ceil(bounds.right()) - left
+    height = math.ceil(bounds.bottom()) - top
+
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    image.setDotsPerMeterX(dpm_x)
+    image.setDotsPerMeterY(dpm_y)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setTransform(transform * QTransform.fromTranslate(-left, -top))
+    draw(painter)
+    painter.end()
+    return Sprite(image, tw, th, left, top)
+
+
+@lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def _build_sprite(style_key, dpm_x, dpm_y, scale, backend="qpainter"):
+    spec = WatermarkSpec(**dict(zip(STYLE_FIELDS, style_key)))
+    text = spec.display_text
+    font = spec_font(spec, scale)
+
+    # 在与目标图像相同 DPI 的设备上测量，保证字号与直接绘制一致
+    probe = QImage(1, 1, QImage.Format_ARGB32_Premultiplied)
+    probe.setDotsPerMeterX(dpm_x)
+    probe.setDotsPerMeterY(dpm_y)
+    metrics = QFontMetrics(font, probe)
+    rect = metrics.boundingRect(text)
+    tw, th = rect.width(), rect.height()
+
+    # 留出阴影/描边偏移和斜体等字形外溢的余量
+    pad = 3 + metrics.height() // 4
+    local = QRectF(rect.adjusted(-pad, -pad, pad, pad))
+
+    if backend == "numpy":
+        return _numpy_text_sprite(spec, text, font, scale, local, tw, th, dpm_x, dpm_y)
+
+    def draw(painter):
+        painter.setFont(font)
+        _draw_text_layers(painter, spec, text, scale)
+
+    return _rasterize(local, tw, th, spec.watermark_angle, dpm_x, dpm_y, draw)
+
+
+def _numpy_text_sprite(spec, text, font, scale, local, tw, th, dpm_x, dpm_y):
+    """只栅格化一次文字覆盖率，阴影和描边由 numpy_backend 用数组平移合成"""
+    import numpy_backend
+
+    def draw(painter):
+        painter.setFont(font)
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(QPointF(0, 0), text)
+
+    coverage = _rasterize(local, tw, th, spec.watermark_angle, dpm_x, dpm_y, draw)
+    # 各层在文字坐标系中的偏移，随水印一起旋转；
+    # 未旋转时 Qt 把字形的纵向位置取整到整像素，这里同样取整
+    rotation = QTransform().rotate(spec.watermark_angle)
+
+    def offset(dx, dy):
+        p = rotation.map(QPointF(dx * scale, dy * scale))
+        return p.x(), (p.y() if spec.watermark_angle % 360 else round(p.y()))
+
+    color = QColor.fromRgba(spec.font_color)
+    opacity = spec.font_opacity
+    with stats.span("layers"):
+        image = numpy_backend.text_layers(
+            coverage.image, (color.red(), color.green(), color.blue()), opacity,
+            shadow_alpha=int(opacity * 0.6),
+            shadow_offset=offset(2, 2) if spec.shadow_enabled else None,
+            outline_alpha=opacity,
+            outline_offsets=[
+                offset(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy
+            ] if spec.outline_enabled else (),
+        )
+    return replace(coverage, image=image)
+
+
+@lru_cache(maxsize=LOGO_CACHE_SIZE)
+def _load_logo(path, stamp):
+    """解码并预乘 Logo；stamp 为 (修改时间, 大小)，文件被替换后重新读取"""
+    logo = orient(QImage(path), read_metadata(path).orientation)
+    if logo.isNull():
+        return logo
+    return logo.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+
+def _logo_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def logo_size(spec, width, height):
+    """Logo 在 width x height 画布上的尺寸：长边为短边的 logo_scale 倍，读不到 Logo 时为 None"""
+    stamp = _logo_stamp(spec.logo_path)
+    if stamp is None:
+        return None
+    logo = _load_logo(spec.logo_path, stamp)
+    if logo.isNull():
+        return None
+    longest = max(1, round(spec.logo_scale * min(width, height)))
+    factor = longest / max(logo.width(), logo.height())
+    return max(1, round(logo.width() * factor)), max(1, round(logo.height() * factor))
+
+
+@lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def _build_logo_sprite(path, stamp, lw, lh, opacity, angle, dpm_x, dpm_y):
+    # 每个输出尺寸只重采样一次，之后每张图片都直接混合缓存的图块
+    logo = _load_logo(path, stamp).scaled(lw, lh, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    def draw(painter):
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.setOpacity(opacity / 255)
+        painter.drawImage(QPointF(0, -lh), logo)
+
+    return _rasterize(QRectF(-1, -lh - 1, lw + 2, lh + 2), lw, lh, angle, dpm_x, dpm_y, draw)
+
+
+def _sprite_args(spec, width, height, geometry):
+    """图块缓存的键；图片水印读不到文件时返回 None"""
+    g = geometry
+    if spec.watermark_type == "image":
+        size = logo_size(spec, width, height)
+        if size is None:
+            return None
+        stamp = _logo_stamp(spec.logo_path)
+        return ("image", spec.logo_path, stamp, *size, spec.font_opacity, spec.watermark_angle, g.dpm_x, g.dpm_y)
+    # 没有阴影和描边时两个后端栅格化的结果相同，共用同一个图块
+    layers = _backend if spec.shadow_enabled or spec.outline_enabled else "qpainter"
+    return ("text", spec.style_key(), g.dpm_x, g.dpm_y, g.sprite_scale, layers)
+
+
+def _sprite_from_args(args):
+    if args[0] == "image":
+        return _build_logo_sprite(*args[1:])
+    return _build_sprite(*args[1:])
+
+
+def watermark_sprite(spec, image, scale=1.0):
+    """取得适用于 image 的水印图块，同一样式只栅格化一次；没有可用水印时返回 None"""
+    width, height = image.width(), image.height()
+    geometry = resolve_geometry(spec, width, height, image.dotsPerMeterX(), image.dotsPerMeterY(), scale)
+    args = _sprite_args(spec, width, height, geometry)
+    return _sprite_from_args(args) if args else None
+
+
+def sprite_cache_info():
+    return _build_sprite.cache_info()
+
+
+@lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def _build_tile(sprite_args, gap):
+    """平铺图案的一个单元：两行未旋转的水印，第二行错开半格"""
+    with stats.span("tile"):
+        return _tile_cell(_sprite_from_args(sprite_args), gap)
+
+
+def _tile_cell(sprite, gap):
+    cell_w = sprite.image.width() + gap
+    row_h = sprite.image.height() + gap
+    tile = QImage(cell_w, 2 * row_h, QImage.Format_ARGB32_Premultiplied)
+    tile.setDotsPerMeterX(sprite.image.dotsPerMeterX())
+    tile.setDotsPerMeterY(sprite.image.dotsPerMeterY())
+    tile.fill(Qt.transparent)
+    painter = QPainter(tile)
+    painter.drawImage(0, 0, sprite.image)
+    painter.drawImage(cell_w // 2, row_h, sprite.image)
+    painter.drawImage(cell_w // 2 - cell_w, row_h, sprite.image)  # 超出右边的部分绕回左边
+    painter.end()
+    return tile, sprite.image.width(), sprite.image.height()
+
+
+stats.register_cache("sprite", stats.lru_info(_build_sprite))
+stats.register_cache("logo_sprite", stats.lru_info(_build_logo_sprite))
+stats.register_cache("tile", stats.lru_info(_build_tile))
+
+
+def sprite_placement(spec, width, height, dpm_x, dpm_y, scale=1.0):
+    """返回 (水印图块, 图块左上角 QPoint)，没有可用水印时返回 (None, None)
+
+    只依赖图像尺寸和 DPI，不需要像素数据，分块处理时可以先算出水印覆盖的区域。
+    """
+    geometry = resolve_geometry(spec, width, height, dpm_x, dpm_y, scale)
+    args = _sprite_args(spec, width, height, geometry)
+    if args is None:
+        return None, None
+    sprite = _sprite_from_args(args)
+    x, y = text_position(spec, geometry, width, height, sprite.tw, sprite.th)
+    return sprite, QPoint(x + sprite.left, y + sprite.top)
+
+
+def watermark_rect(spec, width, height, dpm_x, dpm_y, scale=1.0):
+    """水印在图像中覆盖的矩形（已裁剪到图像范围内），没有水印时为空矩形"""
+    bounds = QRect(0, 0, width, height)
+    if not spec.has_watermark:
+        return QRect()
+    if spec.watermark_pos_mode == TILE_MODE:
+        geometry = resolve_geometry(spec, width, height, dpm_x, dpm_y, scale)
+        if _sprite_args(spec, width, height, geometry) is None:
+            return QRect()
+        return bounds
+    sprite, origin = sprite_placement(spec, width, height, dpm_x, dpm_y, scale)
+    if sprite is None:
+        return QRect()
+    return QRect(origin, sprite.image.size()).intersected(bounds)
+
+
+def paint_watermark(painter, spec, width, height, dpm_x, dpm_y, scale=1.0, offset=QPoint(0, 0)):
+    """在 painter 上绘制 width x height 原图的水印
+
+    painter 的画布可以只是原图的一部分（分块处理），offset 为它在原图中的左上角。
+    单个水印是一次 drawImage；平铺模式用预先栅格化的图案作纹理画刷，一次 fillRect 铺满。
+    """
+    if not spec.has_watermark:
+        return
+    with stats.span("render"):
+        _paint(painter, spec, width, height, dpm_x, dpm_y, scale, offset)
+
+
+def _paint(painter, spec, width, height, dpm_x, dpm_y, scale, offset):
+    if spec.watermark_pos_mode != TILE_MODE:
+        sprite, origin = sprite_placement(spec, width, height, dpm_x, dpm_y, scale)
+        if sprite is not None:
+            painter.drawImage(origin - offset, sprite.image)
+        return
+
+    geometry = resolve_geometry(spec, width, height, dpm_x, dpm_y, scale)
+    upright = _sprite_args(replace(spec, watermark_angle=0), width, height, geometry)
+    if upright is None:
+        return
+    tile, sprite_w, sprite_h = _build_tile(upright, geometry.spacing)
+    # 图案的第一个水印居中于原图中心，整个图案绕中心旋转
+    transform = QTransform()
+    transform.translate(width / 2 - offset.x(), height / 2 - offset.y())
+    transform.rotate(spec.watermark_angle)
+    transform.translate(-sprite_w / 2, -sprite_h / 2)
+    brush = QBrush(tile)
+    brush.setTransform(transform)
+    device = painter.device()
+    painter.save()
+    if spec.watermark_angle % 90:
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    painter.fillRect(QRect(0, 0, device.width(), device.height()), brush)
+    painter.restore()
+
+
+def composite(image, spec, scale=1.0):
+    """在 image 上原地绘制水印并返回 image
+
+    水印样式从图块缓存中取得，每张图片只需一次 drawImage（平铺模式为一次 fillRect）。
+    image 是缩小的预览代理图时，scale 为它相对原图的比例，水印按同样比例缩小。
+    """
+    if not spec.has_watermark:
+        return image
+    if _backend == "numpy" and spec.watermark_pos_mode != TILE_MODE and _numpy_composite(image, spec, scale):
+        return image
+    painter = QPainter(image)
+    paint_watermark(
+        painter, spec, image.width(), image.height(), image.dotsPerMeterX(), image.dotsPerMeterY(), scale
+    )
+    painter.end()
+    return image
+
+
+def _numpy_composite(image, spec, scale):
+    """用 numpy_backend 混合图块，像素格式不支持时返回 False"""
+    import numpy_backend
+
+    with stats.span("render", backend="numpy"):
+        sprite, origin = sprite_placement(
+            spec, image.width(), image.height(), image.dotsPerMeterX(), image.dotsPerMeterY(), scale
+        )
+        if sprite is None:
+            return True
+        return numpy_backend.blend(image, sprite.image, origin.x(), origin.y())
+
+
+def render(image, spec, scale=1.0):
+    """返回加好水印的新图像，不修改输入"""
+    return composite(image.copy(), spec, scale)
@@ -0,0 +1,89 @@
+"""增量式图片扫描
+
+用 os.scandir 逐个目录遍历，找到一个产出一个，不必等整棵目录树扫描完。
+ScanThread 在后台线程运行扫描，按批次把路径送回界面。
+"""
+import os
+import time
+import threading
+
+from PySide6.QtCore import QThread, Signal
+
+from batch import SUPPORTED_FORMATS
+
+
+def is_image_file(name):
+    return name.lower().endswith(SUPPORTED_FORMATS)
+
+
+def iter_images(paths, cancel_event=None):
+    """递归扫描 paths（文件或文件夹），逐个产出支持格式的图片路径"""
+    for path in _walk(paths, cancel_event):
+        if path is not None:
+            yield path
+
+
+def _walk(paths, cancel_event):
+    """同 iter_images，但每看过一个不是图片的目录项就产出一次 None，调用方借此按时间刷新"""
+    for path in paths:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        if os.path.isdir(path):
+            stack = [path]
+            while stack:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                current = stack.pop()
+                try:
+                    with os.scandir(current) as it:
+                        for entry in it:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    stack.append(entry.path)
+                                elif entry.is_file() and is_image_file(entry.name):
+                                    yield entry.path
+                                    continue
+                            except OSError:
+                                pass
+                            yield None
+                except OSError:
+                    continue
+        elif is_image_file(path):
+            yield path
+
+
+class ScanThread(QThread):
+    """后台扫描，found 信号按批次发出路径列表；扫描结束（包括取消）时发出 QThread 自带的 finished"""
+    found = Signal(list)
+
+    BATCH_SIZE = 256
+    BATCH_INTERVAL = 0.1  # 秒；慢速网络盘上也能尽快看到第一批
+
+    def __init__(self, paths, parent=None):
+        super().__init__(parent)
+        self.paths = list(paths)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        batch = []
+        # 第一张图片立即发出，之后按数量或时间成批发出
+        last_emit = None
+        for path in _walk(self.paths, self._cancel):
+            if path is not None:
+                batch.append(path)
+            if not batch:
+                continue
+            now = time.monotonic()
+            if last_emit is None or len(batch) >= self.BATCH_SIZE or now - last_emit >= self.BATCH_INTERVAL:
+                self.found.emit(batch)
+                batch = []
+                last_emit = now
+        if batch and not self._cancel.is_set():
+            self.found.emit(batch)
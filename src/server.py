@@ -0,0 +1,435 @@
+"""本地 HTTP 水印服务
+
+    python src/main.py serve --port 8765 --jobs 4
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/watermark?template=1" -o out.jpg
+
+接口：
+
+- POST /watermark?template=名称[&format=PNG][&quality=90]：请求体为图片字节，返回加好水印的图片字节。
+  模板为 templates 目录中的模板名，修改模板文件后下一次请求即生效；输出格式默认与输入相同
+  （不支持的格式输出 JPEG）。
+- GET /metrics：JSON 格式的请求数、状态码分布、在途请求、延迟 p50/p95/p99 和吞吐量；
+  打开统计（--stats）时附带各阶段耗时。
+- GET /health：服务可用时返回 200。
+
+解码、绘制、编码在常驻的进程池中进行，与批量导出使用相同的绘制代码。工作进程启动时预先导入
+Qt 和 Pillow、加载字体并为每个模板画一次水印，请求不必承担冷启动的开销。
+在途请求数超过 进程数 + 排队上限 时直接返回 503 和 Retry-After，不会无限排队拖慢所有请求。
+load_test() 是配套的本地压测工具（python src/main.py loadtest），用来观察负载下的 p99 延迟。
+"""
+import os
+import json
+import time
+import threading
+import http.client
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import stats
+from batch import _collect, _init_warm_worker
+from encoder import EncoderSettings, OUTPUT_FORMATS
+from templates import template_store
+
+DEFAULT_PORT = 8765
+MAX_BODY_MB = 200
+REQUEST_TIMEOUT = 60  # 秒
+LATENCY_WINDOW = 10000  # 计算分位数用的最近请求数
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "TIFF": "image/tiff", "WEBP": "image/webp"}
+
+
+class RequestError(Exception):
+    """返回给客户端的错误，status 为 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _input_format(data):
+    """按文件头判断输入格式，不是可输出的格式时返回 JPEG"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "PNG"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    return "JPEG"
+
+
+def watermark_bytes(data, spec, output_format=None, settings=None):
+    """在工作进程中给内存中的图片加水印，返回 (编码后的字节, 输出格式)
+
+    按 EXIF 方向转正后再加水印，原图的 EXIF（方向改为 1）和 ICC 配置文件写入输出。
+    """
+    from io import BytesIO
+    from encoder import encode_image
+    from image_cache import decode_data
+    from metadata import metadata_from_bytes
+    from renderer import composite
+
+    metadata = metadata_from_bytes(data)
+    image, _ = decode_data(data, metadata=metadata)
+    if image.isNull():
+        raise ValueError("无法解码图片")
+    if output_format is None:
+        output_format = _input_format(data)
+    image = composite(image, spec)
+    out = BytesIO()
+    encode_image(image, out, output_format, settings or EncoderSettings(), metadata)
+    return out.getvalue(), output_format
+
+
+class Metrics:
+    """请求计数和最近 LATENCY_WINDOW 个请求的延迟（线程安全）"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._finished = deque()  # 最近一分钟内完成请求的时刻
+        self.requests = 0
+        self.statuses = Counter()
+
+    def record(self, status, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.statuses[status] += 1
+            if status == 200:
+                self._latencies.append(seconds)
+                self._finished.append(now)
+            while self._finished and now - self._finished[0] > 60:
+                self._finished.popleft()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            latencies = sorted(self._latencies)
+            while self._finished and now - self._finished[0] > 60:
+                self._finished.popleft()
+            recent = len(self._finished)
+            result = {
+                "uptime_s": round(now - self.started, 1),
+                "requests": self.requests,
+                "status": {str(code): n for code, n in sorted(self.statuses.items())},
+            }
+        window = min(60.0, now - self.started) or 1.0
+        result["throughput_per_s"] = round(recent / window, 2)  # 最近一分钟
+        result["latency_ms"] = latency_summary(latencies)
+        return result
+
+
+def percentile(ordered, q):
+    """已排序序列的最近秩分位数"""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.999999) - 1))
+    return ordered[index]
+
+
+def latency_summary(ordered):
+    return {
+        "count": len(ordered),
+        "p50": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99": round(percentile(ordered, 0.99) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+class WatermarkService:
+    """常驻进程池 + 模板缓存 + 并发上限，不依赖 HTTP，可以直接嵌入其它程序使用"""
+
+    def __init__(self, max_workers=None, max_queue=None, settings=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # 在途请求上限：每个进程一个在处理，其余排队
+        self.capacity = self.max_workers + (self.max_workers if max_queue is None else max_queue)
+        self.settings = settings or EncoderSettings()
+        self.metrics = Metrics()
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def start(self):
+        """启动进程池并等所有进程完成预热"""
+        self._pool = self._start_pool(self._specs())
+        for future in [self._pool.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+
+    def _specs(self):
+        """用于预热的所有有效模板"""
+        specs = []
+        for name in template_store.names():
+            try:
+                specs.append(self.spec(name))
+            except RequestError:
+                continue
+        return specs
+
+    def _start_pool(self, specs):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from renderer import get_backend
+
+        return ProcessPoolExecutor(
+            self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_warm_worker, initargs=(stats.enabled, get_backend(), tuple(specs)),
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def spec(self, name):
+        """按模板名取 WatermarkSpec（由 template_store 缓存，模板文件修改后重新读取）"""
+        try:
+            template_store.check_name(name)
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        try:
+            template = template_store.get(name)
+        except ValueError as e:
+            raise RequestError(422, str(e))
+        if template is None:
+            raise RequestError(404, f"模板不存在：{name}")
+        if not template.spec.has_watermark:
+            raise RequestError(422, f"模板 {name} 中没有水印")
+        return template.spec
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def watermark(self, data, template, output_format=None, settings=None, timeout=REQUEST_TIMEOUT):
+        """给图片字节加水印，返回 (字节, 输出格式)；超出并发上限时立即抛出 RequestError(503)"""
+        from concurrent.futures import TimeoutError as FutureTimeout
+        from concurrent.futures.process import BrokenProcessPool
+
+        spec = self.spec(template)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise RequestError(503, "服务繁忙，请稍后重试")
+        with self._lock:
+            self._in_flight += 1
+        pool = self._pool
+        try:
+            future = pool.submit(
+                _collect, watermark_bytes, data, spec, output_format, settings or self.settings
+            )
+        except BaseException:
+            self._release()
+            raise
+        # 名额在任务真正结束时才归还：超时返回的请求仍占着一个进程
+        future.add_done_callback(self._release)
+        if stats.enabled:
+            stats.gauge("queue.serve", self._in_flight)
+        try:
+            result, worker_stats = future.result(timeout)
+        except FutureTimeout:
+            raise RequestError(504, "处理超时")
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+            raise RequestError(503, "工作进程异常退出，已重启")
+        stats.merge(worker_stats)
+        return result
+
+    def _restart_pool(self, pool):
+        with self._lock:
+            if self._pool is not pool:
+                return  # 已被其它请求重启
+            self._pool = self._start_pool(self._specs())
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def metrics_snapshot(self):
+        snap = self.metrics.snapshot()
+        snap.update(
+            workers=self.max_workers, capacity=self.capacity,
+            in_flight=self._in_flight, rejected=self.rejected,
+        )
+        if stats.enabled:
+            snap["stats"] = stats.snapshot()
+        return snap
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持连接，压测时不必每个请求都重新建连
+    server_version = "WatermarkStudio"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._send(status, body, "application/json; charset=utf-8", headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        service = self.server.service
+        if path == "/metrics":
+            self._send_json(200, service.metrics_snapshot())
+        elif path == "/health":
+            self._send_json(200, {"ok": True, "templates": template_store.names()})
+        else:
+            self._send_json(404, {"error": "未知路径"})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        service = self.server.service
+        status = 500
+        try:
+            if url.path != "/watermark":
+                raise RequestError(404, "未知路径")
+            body = self._read_body()
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            output_format, settings = self._options(query)
+            data, output_format = service.watermark(body, query.get("template", ""), output_format, settings)
+            status = 200
+            self._send(200, data, MIME_TYPES[output_format])
+        except RequestError as e:
+            status = e.status
+            headers = [("Retry-After", "1")] if e.status == 503 else []
+            self._send_json(e.status, {"error": str(e)}, headers)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+        finally:
+            service.metrics.record(status, time.perf_counter() - started)
+
+    def _read_body(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise RequestError(411, "缺少 Content-Length")
+        try:
+            length = int(length)
+        except ValueError:
+            raise RequestError(400, "Content-Length 无效")
+        if length > self.server.max_body:
+            # 不读请求体，直接关闭连接
+            self.close_connection = True
+            raise RequestError(413, f"图片超过 {self.server.max_body // (1024 * 1024)} MB")
+        return self.rfile.read(length)
+
+    def _options(self, query):
+        settings = None
+        output_format = query.get("format", "").upper() or None
+        if output_format == "JPG":
+            output_format = "JPEG"
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise RequestError(400, f"不支持的输出格式：{output_format}")
+        if "quality" in query:
+            try:
+                quality = int(query["quality"])
+            except ValueError:
+                raise RequestError(400, "quality 必须是整数")
+            if not 1 <= quality <= 100:
+                raise RequestError(400, "quality 应在 1-100 之间")
+            settings = EncoderSettings(jpeg_quality=quality, webp_quality=quality)
+        return output_format, settings
+
+
+class WatermarkServer(ThreadingHTTPServer):
+    """HTTP 服务；start() 在后台线程运行，serve_forever() 在当前线程运行"""
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, service=None, verbose=False,
+                 max_body_mb=MAX_BODY_MB):
+        self.service = service or WatermarkService()
+        self.verbose = verbose
+        self.max_body = max_body_mb * 1024 * 1024
+        super().__init__((host, port), _Handler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.service.start()
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.service.close()
+
+
+def load_test(url, payload, concurrency=8, requests=200, content_type="application/octet-stream",
+              timeout=REQUEST_TIMEOUT):
+    """本地压测：concurrency 个线程各自保持一个连接，共发送 requests 个请求
+
+    返回状态码分布、成功请求的延迟分位数（毫秒）和吞吐量（请求/秒）。
+    """
+    target = urlsplit(url)
+    path = target.path + (f"?{target.query}" if target.query else "")
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    latencies = []
+    statuses = Counter()
+
+    def worker():
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=timeout)
+        try:
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                started = time.perf_counter()
+                try:
+                    conn.request("POST", path, payload, {"Content-Type": content_type})
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                    if response.getheader("Connection", "").lower() == "close":
+                        conn.close()
+                except (OSError, http.client.HTTPException):
+                    status = "error"
+                    conn.close()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    statuses[status] += 1
+                    if status == 200:
+                        latencies.append(elapsed)
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(statuses[200] / elapsed, 2) if elapsed > 0 else 0.0,
+        "status": {str(code): n for code, n in statuses.items()},
+        "latency_ms": latency_summary(latencies),
+    }
@@ -0,0 +1,112 @@
+"""启动耗时测量
+
+    python src/main.py --startup-time [--startup-budget 800]
+
+测量从进程启动到主窗口第一次绘制完成的耗时，并记录导入模块、创建 QApplication、
+构造主窗口各阶段的时间点。结果以一行 JSON 输出到标准错误后退出；
+超过预算（毫秒）时返回码为 1，可在 CI 中跟踪启动速度。
+
+本模块不依赖 Qt，main.py 最先导入它，导入时刻即作为“模块导入开始”的时间点。
+"""
+import os
+import sys
+import json
+import time
+
+DEFAULT_BUDGET_MS = 1000
+USAGE = "用法：python src/main.py --startup-time [--startup-budget 毫秒]"
+
+_origin = time.perf_counter()
+_marks = []  # [(名称, perf_counter)]
+
+
+def process_age():
+    """进程启动至今的秒数（含解释器启动），仅 Linux；取不到时返回 None"""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])  # 第 22 项 starttime，单位为时钟滴答
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+# 导入本模块之前（解释器启动）已经过去的时间
+_before_origin = process_age() or 0.0
+
+
+def mark(name):
+    _marks.append((name, time.perf_counter()))
+
+
+def elapsed_ms(at=None):
+    """从进程启动起的毫秒数"""
+    at = time.perf_counter() if at is None else at
+    return round((_before_origin + at - _origin) * 1000, 1)
+
+
+def _budget(value):
+    """解析预算毫秒数；缺少或不是非负数时与 argparse 一样输出用法并以返回码 2 退出"""
+    try:
+        budget = float(value)
+    except (TypeError, ValueError):
+        budget = None
+    if budget is None or not budget >= 0:
+        got = "" if value is None else f"，收到 {value!r}"
+        print(f"{USAGE}\n错误：--startup-budget 需要一个非负的毫秒数{got}", file=sys.stderr)
+        sys.exit(2)
+    return budget
+
+
+def parse_args(argv):
+    """取出并移除启动测量参数，返回 (其余参数, 是否测量, 预算毫秒)"""
+    rest = []
+    enabled = False
+    budget = DEFAULT_BUDGET_MS
+    args = iter(argv)
+    for arg in args:
+        if arg == "--startup-time":
+            enabled = True
+        elif arg == "--startup-budget":
+            budget = _budget(next(args, None))
+        elif arg.startswith("--startup-budget="):
+            budget = _budget(arg.split("=", 1)[1])
+        else:
+            rest.append(arg)
+    return rest, enabled, budget
+
+
+def report(budget_ms=DEFAULT_BUDGET_MS, stream=None):
+    """输出各阶段时间点，返回是否在预算内"""
+    total = elapsed_ms()
+    result = {
+        "interpreter_ms": round(_before_origin * 1000, 1),
+        "marks_ms": {name: elapsed_ms(at) for name, at in _marks},
+        "first_paint_ms": total,
+        "budget_ms": budget_ms,
+        "ok": total <= budget_ms,
+    }
+    print(json.dumps(result, ensure_ascii=False), file=stream or sys.stderr)
+    return result["ok"]
+
+
+def exit_after_first_paint(app, window, budget_ms=DEFAULT_BUDGET_MS):
+    """主窗口第一次绘制完成后输出结果并退出事件循环"""
+    from PySide6.QtCore import QObject, QEvent, QTimer
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and not self.done:
+                self.done = True
+                # 绘制完成后（本次事件处理结束）再记时
+                QTimer.singleShot(0, finish)
+            return False
+
+    def finish():
+        mark("first_paint")
+        app.exit(0 if report(budget_ms) else 1)
+
+    watcher = FirstPaint(window)
+    watcher.done = False
+    window.installEventFilter(watcher)
+    return watcher
@@ -0,0 +1,332 @@
+"""性能统计：各阶段耗时直方图、计数器、队列深度，以及可导出的 Chrome 跟踪
+
+默认关闭。关闭时 span() 只做一次全局变量判断并返回共享的空上下文，count()/gauge() 直接返回，
+热路径上的开销可以忽略。enable() 或环境变量 WATERMARK_STATS=1 打开后：
+
+- span("decode") 记录一次耗时，计入该阶段的直方图，同时保留一条跟踪事件；
+- count("bytes_read", n) 累加计数器；gauge("queue.render", n) 记录队列深度等瞬时值；
+- register_cache() 登记的缓存在取快照时把命中/未命中折算为计数器。
+
+批量导出的工作进程各自收集，任务结束时用 drain() 取出增量，由主进程 merge() 汇总。
+dump_trace() 写出的文件可直接在 chrome://tracing 或 Perfetto 中打开，统计摘要放在 otherData 中。
+"""
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+# 直方图的桶：上界依次为 1µs、2µs、4µs …… 约 1 小时
+_BUCKETS = 32
+# 跟踪事件条数上限，超出后只更新直方图，内存占用有界
+MAX_TRACE_EVENTS = 200_000
+
+enabled = os.environ.get("WATERMARK_STATS", "") not in ("", "0")
+
+_NULL = nullcontext()
+_lock = threading.Lock()
+_histograms = {}  # 阶段 -> Histogram
+_counters = {}  # 名称 -> 累计值
+_gauges = {}  # 名称 -> [当前值, 最大值, 采样次数, 累计值]
+_events = []
+_dropped = 0
+_caches = {}  # 名称 -> 返回 (hits, misses) 的函数
+_cache_seen = {}  # 名称 -> 上次折算时的 (hits, misses)
+
+
+class Histogram:
+    """按 2 的幂分桶的耗时直方图（微秒），可在进程间合并"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, us):
+        self.count += 1
+        self.total += us
+        self.min = us if self.min is None else min(self.min, us)
+        self.max = max(self.max, us)
+        self.buckets[min(int(us).bit_length(), _BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        if not other["count"]:
+            return
+        self.count += other["count"]
+        self.total += other["total"]
+        self.min = other["min"] if self.min is None else min(self.min, other["min"])
+        self.max = max(self.max, other["max"])
+        for i, n in enumerate(other["buckets"]):
+            self.buckets[i] += n
+
+    def percentile(self, q):
+        """近似分位数：所在桶的上界，不超过实测最大值"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(float(1 << i), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "buckets": list(self.buckets),
+        }
+
+    def summary(self):
+        """毫秒为单位的摘要"""
+        return {
+            "count": self.count,
+            "total_ms": round(self.total / 1000, 3),
+            "mean_ms": round(self.total / self.count / 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) / 1000, 3),
+            "p95_ms": round(self.percentile(0.95) / 1000, 3),
+            "max_ms": round(self.max / 1000, 3),
+        }
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _record(self.name, self.start, end, self.args)
+        return False
+
+
+def _record(name, start_ns, end_ns, args):
+    global _dropped
+    us = (end_ns - start_ns) / 1000
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram()
+        hist.add(us)
+        if len(_events) < MAX_TRACE_EVENTS:
+            event = {
+                "name": name, "ph": "X", "ts": start_ns / 1000, "dur": us,
+                "pid": os.getpid(), "tid": threading.get_ident(),
+            }
+            if args:
+                event["args"] = args
+            _events.append(event)
+        else:
+            _dropped += 1
+
+
+def span(name, **args):
+    """计时上下文：with span("render"): ...；args 写入跟踪事件"""
+    if not enabled:
+        return _NULL
+    return _Span(name, args)
+
+
+def count(name, n=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def gauge(name, value):
+    """记录瞬时值（例如队列深度），统计当前值、最大值和平均值"""
+    if not enabled:
+        return
+    with _lock:
+        g = _gauges.get(name)
+        if g is None:
+            g = _gauges[name] = [0, value, 0, 0]
+        g[0] = value
+        g[1] = max(g[1], value)
+        g[2] += 1
+        g[3] += value
+        if len(_events) < MAX_TRACE_EVENTS:
+            _events.append({
+                "name": name, "ph": "C", "ts": time.perf_counter_ns() / 1000,
+                "pid": os.getpid(), "args": {"value": value},
+            })
+
+
+def register_cache(name, info):
+    """登记一个缓存，info() 返回累计的 (命中数, 未命中数)"""
+    _caches[name] = info
+
+
+def lru_info(func):
+    """functools.lru_cache 包装的函数对应的 info"""
+    return lambda: func.cache_info()[:2]
+
+
+def _poll_caches():
+    # 调用方持有 _lock
+    for name, info in _caches.items():
+        hits, misses = info()
+        old_hits, old_misses = _cache_seen.get(name, (0, 0))
+        _cache_seen[name] = (hits, misses)
+        if hits < old_hits or misses < old_misses:  # 缓存被清空过
+            old_hits = old_misses = 0
+        if hits - old_hits:
+            _counters[f"cache.{name}.hits"] = _counters.get(f"cache.{name}.hits", 0) + hits - old_hits
+        if misses - old_misses:
+            _counters[f"cache.{name}.misses"] = _counters.get(f"cache.{name}.misses", 0) + misses - old_misses
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+    if enabled:
+        with _lock:
+            # 从打开时开始计算缓存命中
+            for name, info in _caches.items():
+                _cache_seen[name] = tuple(info())
+
+
+def enable():
+    set_enabled(True)
+
+
+def disable():
+    set_enabled(False)
+
+
+def reset():
+    global _dropped
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+        _events.clear()
+        _dropped = 0
+        for name, info in _caches.items():
+            _cache_seen[name] = tuple(info())
+
+
+def drain():
+    """取出并清空本进程收集的数据（工作进程在每个任务结束时调用），未启用时返回 None"""
+    global _dropped
+    if not enabled:
+        return None
+    with _lock:
+        _poll_caches()
+        data = {
+            "histograms": {name: h.to_dict() for name, h in _histograms.items()},
+            "counters": dict(_counters),
+            "events": list(_events),
+            "dropped": _dropped,
+        }
+        _histograms.clear()
+        _counters.clear()
+        _events.clear()
+        _dropped = 0
+    return data
+
+
+def merge(data):
+    """并入 drain() 的结果"""
+    global _dropped
+    if not data:
+        return
+    with _lock:
+        for name, h in data["histograms"].items():
+            hist = _histograms.get(name)
+            if hist is None:
+                hist = _histograms[name] = Histogram()
+            hist.merge(h)
+        for name, n in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+        room = MAX_TRACE_EVENTS - len(_events)
+        _events.extend(data["events"][:room])
+        _dropped += data["dropped"] + max(0, len(data["events"]) - room)
+
+
+def snapshot():
+    """当前统计的摘要（可 JSON 序列化）"""
+    with _lock:
+        _poll_caches()
+        counters = dict(_counters)
+        caches = {}
+        for name in _caches:
+            hits = counters.get(f"cache.{name}.hits", 0)
+            misses = counters.get(f"cache.{name}.misses", 0)
+            caches[name] = {
+                "hits": hits, "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            }
+        return {
+            "enabled": enabled,
+            "stages": {name: h.summary() for name, h in sorted(_histograms.items())},
+            "counters": counters,
+            "caches": caches,
+            "gauges": {
+                name: {"current": g[0], "max": g[1], "mean": round(g[3] / g[2], 2) if g[2] else 0}
+                for name, g in sorted(_gauges.items())
+            },
+            "trace_events": len(_events),
+            "dropped_events": _dropped,
+        }
+
+
+def summary_lines(snap=None):
+    """用于命令行和统计面板的文本摘要"""
+    snap = snap or snapshot()
+    # 中文标题每个字占两列，宽度相应减小
+    lines = [f"{'阶段':12} {'次数':>5} {'合计ms':>8} {'平均ms':>7} {'p50':>8} {'p95':>8} {'最大':>6}"]
+    for name, s in snap["stages"].items():
+        lines.append(
+            f"{name:14} {s['count']:7} {s['total_ms']:10.1f} {s['mean_ms']:9.2f} "
+            f"{s['p50_ms']:8.2f} {s['p95_ms']:8.2f} {s['max_ms']:8.2f}"
+        )
+    for name, c in snap["caches"].items():
+        if c["hit_rate"] is None:
+            continue
+        lines.append(f"缓存 {name}：命中 {c['hits']}，未命中 {c['misses']}，命中率 {c['hit_rate']:.1%}")
+    for name, g in snap["gauges"].items():
+        lines.append(f"{name}：当前 {g['current']}，最大 {g['max']}，平均 {g['mean']}")
+    for name, n in sorted(snap["counters"].items()):
+        if name.startswith("cache."):
+            continue
+        value = f"{n / (1024 * 1024):.1f} MB" if name.startswith("bytes_") else str(n)
+        lines.append(f"{name}：{value}")
+    if snap["dropped_events"]:
+        lines.append(f"跟踪事件超过上限，丢弃 {snap['dropped_events']} 条")
+    return lines
+
+
+def dump_trace(path):
+    """写出 Chrome 跟踪格式的 JSON（先写临时文件再改名）"""
+    snap = snapshot()
+    with _lock:
+        events = list(_events)
+    pids = sorted({e["pid"] for e in events} | {os.getpid()})
+    meta = [
+        {
+            "name": "process_name", "ph": "M", "pid": pid,
+            "args": {"name": "main" if pid == os.getpid() else f"worker {pid}"},
+        }
+        for pid in pids
+    ]
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {"traceEvents": meta + events, "displayTimeUnit": "ms", "otherData": snap},
+            f, ensure_ascii=False,
+        )
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,246 @@
+"""水印模板的存取（界面、命令行、监视文件夹和 HTTP 服务共用）
+
+TemplateStore 在内存中维护模板目录的索引和已解析的模板：
+
+- 模板名列表只在目录的修改时间变化时才重新 listdir；
+- 每个模板按文件的 (修改时间, 大小) 缓存，文件被改写后下次读取自动重新解析；
+- 解析结果是只读的 Template，带有不可变的 WatermarkSpec 和预先算好的摘要，可直接用作渲染缓存的键；
+- 保存先写同目录的临时文件再改名，并发读取的进程不会读到写了一半的模板。
+
+修改时间的精度有限（部分文件系统只到秒），刚写入不久的文件或目录不信任缓存，下次读取时重新检查。
+模板文件带有 schema_version；没有该字段的旧模板视为版本 1，读取时按 migrate() 升级。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import stats
+from manifest import atomic_tmp_path
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "../templates")
+LAST_TEMPLATE_PATH = os.path.join(TEMPLATE_DIR, "last_template.json")
+LAST_TEMPLATE_NAME = "last_template"
+
+# 版本 1：没有 schema_version 字段的模板（字号、位置等可能是像素值，由渲染器按旧含义处理）
+# 版本 2：写入 schema_version，其余字段与版本 1 相同
+SCHEMA_VERSION = 2
+
+# 修改时间与当前时间相差不到这么多秒时不信任缓存（同一时间片内的再次修改可能看不出来）
+_RACY_SECONDS = 2.0
+
+
+def ensure_template_dir():
+    if not os.path.exists(TEMPLATE_DIR):
+        os.makedirs(TEMPLATE_DIR)
+
+
+def template_path(name):
+    return os.path.join(TEMPLATE_DIR, f"{name}.json")
+
+
+def migrate(data):
+    """把模板字典升级到 SCHEMA_VERSION，返回新字典；不是字典或比当前程序新的版本抛出 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("模板格式无效：内容不是 JSON 对象")
+    version = data.get("schema_version", 1)
+    if not isinstance(version, int) or version > SCHEMA_VERSION:
+        raise ValueError(f"不支持的模板版本：{version}（本程序支持到 {SCHEMA_VERSION}）")
+    data = dict(data)
+    # 版本 1 → 2 只增加版本号，字段含义不变
+    data["schema_version"] = SCHEMA_VERSION
+    return data
+
+
+def template_digest(data):
+    """模板内容的稳定摘要（与字段顺序无关）"""
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class Template:
+    """一个已解析的模板；data 为只读映射，spec 为对应的 WatermarkSpec"""
+    name: str
+    data: MappingProxyType
+    spec: object
+    digest: str
+    schema_version: int  # 文件中原本的版本
+
+
+def _stamp(st):
+    return st.st_mtime_ns, st.st_size
+
+
+def _racy(st):
+    return time.time() - st.st_mtime < _RACY_SECONDS
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path, data, indent=None):
+    """原子写入：临时文件写完并落盘后再改名"""
+    tmp = atomic_tmp_path(path)
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class TemplateStore:
+    """模板目录的索引与缓存，线程安全"""
+
+    def __init__(self, folder=TEMPLATE_DIR):
+        self.folder = folder
+        self._lock = threading.RLock()
+        self._names = None  # 已排序的模板名
+        self._dir_stamp = None
+        self._entries = {}  # 模板名 -> ((修改时间, 大小), Template)
+        self.hits = 0
+        self.loads = 0  # 实际解析文件的次数
+
+    def path(self, name):
+        return os.path.join(self.folder, f"{name}.json")
+
+    @staticmethod
+    def check_name(name):
+        """模板名不能为空、不能含路径分隔符或以点开头，不能与记录上次模板的文件同名"""
+        if (
+            not name or "/" in name or "\\" in name or name.startswith(".")
+            or name == LAST_TEMPLATE_NAME
+        ):
+            raise ValueError(f"无效的模板名：{name}")
+        return name
+
+    def names(self):
+        """所有模板名（已排序）；目录未变化时不重新列目录"""
+        try:
+            st = os.stat(self.folder)
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if self._names is None or self._dir_stamp != _stamp(st):
+                names = sorted(
+                    f[:-5] for f in os.listdir(self.folder)
+                    if f.endswith(".json") and not f.startswith(".") and f[:-5] != LAST_TEMPLATE_NAME
+                )
+                self._names = names
+                # 刚变化的目录下次仍重新列出
+                self._dir_stamp = None if _racy(st) else _stamp(st)
+                # 已被删除的模板不再占用缓存
+                for name in set(self._entries) - set(names):
+                    del self._entries[name]
+            return list(self._names)
+
+    def get(self, name):
+        """读取模板，返回 Template；不存在时返回 None，内容无效时抛出 ValueError"""
+        from renderer import WatermarkSpec
+
+        self.check_name(name)
+        path = self.path(name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(name, None)
+            return None
+        stamp = _stamp(st)
+        with self._lock:
+            cached = self._entries.get(name)
+            if cached is not None and cached[0] == stamp:
+                self.hits += 1
+                return cached[1]
+        try:
+            raw = _read_json(path)
+        except FileNotFoundError:
+            return None
+        if not isinstance(raw, dict):
+            raise ValueError(f"模板格式无效：{name}")
+        data = migrate(raw)
+        try:
+            spec = WatermarkSpec.from_template(data)
+        except TypeError as e:
+            raise ValueError(f"模板格式无效：{name}：{e}")
+        template = Template(
+            name=name,
+            data=MappingProxyType(data),
+            spec=spec,
+            digest=template_digest(spec.to_template()),
+            schema_version=raw.get("schema_version", 1),
+        )
+        with self._lock:
+            self.loads += 1
+            if not _racy(st):
+                self._entries[name] = (stamp, template)
+        return template
+
+    def spec(self, name):
+        template = self.get(name)
+        return None if template is None else template.spec
+
+    def save(self, name, data):
+        """原子地写入模板（补上 schema_version），返回新的 Template"""
+        self.check_name(name)
+        data = dict(data)
+        data["schema_version"] = SCHEMA_VERSION
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            _write_json(self.path(name), data, indent=2)
+            self._entries.pop(name, None)
+            self._names = None
+        return self.get(name)
+
+    def delete(self, name):
+        self.check_name(name)
+        with self._lock:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            self._entries.pop(name, None)
+            self._names = None
+
+    def last(self):
+        """上次使用的模板名，没有时返回 None"""
+        try:
+            data = _read_json(os.path.join(self.folder, f"{LAST_TEMPLATE_NAME}.json"))
+        except (OSError, ValueError):
+            return None
+        return data.get("last") if isinstance(data, dict) else None
+
+    def set_last(self, name):
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            _write_json(os.path.join(self.folder, f"{LAST_TEMPLATE_NAME}.json"), {"last": name})
+
+
+template_store = TemplateStore()
+stats.register_cache("template", lambda: (template_store.hits, template_store.loads))
+
+
+def read_template(name_or_path):
+    """按文件路径或 TEMPLATE_DIR 中的模板名读取模板，返回升级到当前版本的模板字典"""
+    if os.path.isfile(name_or_path):
+        data = _read_json(name_or_path)
+        if not isinstance(data, dict):
+            raise ValueError(f"模板格式无效：{name_or_path}：内容不是 JSON 对象")
+        return migrate(data)
+    template = template_store.get(name_or_path)
+    if template is None:
+        raise FileNotFoundError(f"模板不存在：{name_or_path}")
+    return dict(template.data)
@@ -0,0 +1,117 @@
+"""文件列表缩略图
+
+缩略图在后台线程池中按需生成：只为当前可见的行解码，解码时用
+QImageReader.setScaledSize 直接得到小图（JPEG 在 DCT 阶段缩小，不解出完整位图）。
+生成结果写入磁盘缓存，键为 路径 + 修改时间 + 文件大小，重复导入同一文件夹时直接读缓存。
+缩略图按 EXIF 方向转正。
+"""
+import os
+import hashlib
+import threading
+
+from PySide6.QtGui import QImage, QImageReader, QPixmap, QIcon, QColor
+from PySide6.QtCore import Qt, QSize, QObject, QRunnable, QThreadPool, QStandardPaths, Signal
+
+import stats
+from metadata import orient, read_metadata
+
+
+THUMB_SIZE = 64
+# 缩略图的生成方式变化时递增，旧的磁盘缓存随之失效
+THUMB_VERSION = 2
+
+
+def thumbnail_cache_dir():
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "watermark-studio", "thumbnails")
+
+
+def thumbnail_cache_key(path, st):
+    raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{THUMB_SIZE}|{THUMB_VERSION}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def placeholder_icon():
+    pixmap = QPixmap(THUMB_SIZE, THUMB_SIZE)
+    pixmap.fill(QColor("#e0e0e0"))
+    return QIcon(pixmap)
+
+
+def decode_thumbnail(path, size=THUMB_SIZE):
+    reader = QImageReader(path)
+    reader.setAutoTransform(False)  # 方向由 metadata.orient 处理
+    full = reader.size()
+    if full.isValid():
+        reader.setScaledSize(full.scaled(QSize(size, size), Qt.KeepAspectRatio))
+    image = reader.read()
+    if not image.isNull() and (image.width() > size or image.height() > size):
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return orient(image, read_metadata(path).orientation)
+
+
+def load_thumbnail(path, cache_dir):
+    """先查磁盘缓存，未命中时解码并写入缓存"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return QImage()
+    cached = os.path.join(cache_dir, thumbnail_cache_key(path, st) + ".png")
+    if os.path.exists(cached):
+        image = QImage(cached)
+        if not image.isNull():
+            stats.count("thumbnail.disk_hits")
+            return image
+    stats.count("thumbnail.disk_misses")
+    with stats.span("thumbnail"):
+        image = decode_thumbnail(path)
+    if not image.isNull():
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再改名，避免并发读到写了一半的缓存
+            tmp = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if image.save(tmp, "PNG"):
+                os.replace(tmp, cached)
+        except OSError:
+            pass
+    return image
+
+
+class _ThumbnailTask(QRunnable):
+    def __init__(self, loader, path):
+        super().__init__()
+        self.loader = loader
+        self.path = path
+
+    def run(self):
+        image = load_thumbnail(self.path, self.loader.cache_dir)
+        self.loader.loaded.emit(self.path, image)
+
+
+class ThumbnailLoader(QObject):
+    """按需在后台生成缩略图，同一路径只请求一次"""
+    loaded = Signal(str, QImage)
+
+    def __init__(self, parent=None, cache_dir=None, max_threads=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir or thumbnail_cache_dir()
+        self._requested = set()
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max_threads or min(4, os.cpu_count() or 1))
+
+    def request(self, path):
+        if path in self._requested:
+            return
+        self._requested.add(path)
+        self._pool.start(_ThumbnailTask(self, path))
+
+    def clear(self):
+        """丢弃排队中的请求（列表被替换时调用）"""
+        self._pool.clear()
+        self._requested.clear()
+
+    def shutdown(self):
+        """丢弃排队中的请求并等进行中的完成（窗口关闭时调用），之后不会再发出 loaded"""
+        self.clear()
+        self._pool.waitForDone()
@@ -0,0 +1,131 @@
+"""超大 TIFF 的分块导出
+
+未压缩、像素交错存储的 TIFF 可以按行/分块随机读写：先把源文件按块流式复制到输出，
+再只读出与水印相交的那些行，绘制水印后原位写回。其余分块原样保留，不解码也不重新编码，
+峰值内存只取决于分块大小和水印大小，与整图尺寸无关。
+
+Pillow 的 Image.open 只解析文件头，用它取得分块布局；其它 TIFF（压缩、分平面存储、
+16 位等）返回 False，由调用方走常规的整图解码路径。
+"""
+import shutil
+import warnings
+
+from PIL import Image
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtCore import QPoint, QRect
+
+import stats
+from renderer import watermark_rect, paint_watermark
+
+
+COPY_CHUNK = 8 * 1024 * 1024
+BAND_BYTES = 32 * 1024 * 1024  # 每次读入内存的行带上限
+
+# Pillow 原始模式 -> (Qt 像素格式, 每像素字节数)
+_RAW_FORMATS = {
+    "RGB": (QImage.Format_RGB888, 3),
+    "RGBA": (QImage.Format_RGBA8888, 4),
+    "L": (QImage.Format_Grayscale8, 1),
+}
+
+# QImage 未设置分辨率时的默认值（96 DPI）
+_DEFAULT_DPM = 3780
+
+
+def _dots_per_meter(im):
+    """与 Qt 的 TIFF 读取器一致地把分辨率标签换算为每米点数"""
+    x_res = im.tag_v2.get(282)
+    y_res = im.tag_v2.get(283)
+    unit = im.tag_v2.get(296, 2)
+    if not x_res or not y_res:
+        return _DEFAULT_DPM, _DEFAULT_DPM
+    if unit == 3:  # 厘米
+        factor = 100
+    elif unit == 2:  # 英寸
+        factor = 100 / 2.54
+    else:
+        return _DEFAULT_DPM, _DEFAULT_DPM
+    return round(float(x_res) * factor), round(float(y_res) * factor)
+
+
+def raw_tiff_layout(path):
+    """返回 ((宽, 高), (dpm_x, dpm_y), 分块列表)，不适用分块处理时返回 None
+
+    分块列表的元素为 (x0, y0, x1, y1, 文件偏移, 行跨度, Qt 像素格式)。
+    """
+    # 这里只读文件头、从不让 Pillow 解码像素，超大图不必触发其解压炸弹保护
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        with warnings.catch_warnings(), Image.open(path) as im:
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            if im.format != "TIFF" or im.mode not in _RAW_FORMATS:
+                return None
+            fmt, bpp = _RAW_FORMATS[im.mode]
+            tiles = []
+            for codec, box, offset, args in im.tile:
+                if not isinstance(args, tuple):
+                    args = (args,)
+                rawmode = args[0] if args else None
+                if codec != "raw" or rawmode != im.mode:
+                    return None
+                if len(args) > 2 and args[2] != 1:
+                    return None  # 自下而上存储
+                x0, y0, x1, y1 = box
+                stride = args[1] if len(args) > 1 and args[1] else (x1 - x0) * bpp
+                tiles.append((x0, y0, x1, y1, offset, stride, fmt))
+            return im.size, _dots_per_meter(im), tiles
+    except (OSError, ValueError, SyntaxError):
+        return None
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def export_tiled(src, dst, spec):
+    """按分块把 src 加水印后写到 dst，成功返回 True；源文件不适用时返回 False"""
+    layout = raw_tiff_layout(src)
+    if layout is None:
+        return False
+    (width, height), (dpm_x, dpm_y), tiles = layout
+
+    # 所有分块先原样流式复制
+    with stats.span("copy"), open(src, "rb") as fin, open(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, COPY_CHUNK)
+        stats.count("bytes_read", fin.tell())
+    if not spec.has_watermark:
+        return True
+
+    covered = watermark_rect(spec, width, height, dpm_x, dpm_y)
+    if covered.isEmpty():
+        return True
+
+    with open(dst, "r+b") as f:
+        for x0, y0, x1, y1, offset, stride, fmt in tiles:
+            hit = QRect(x0, y0, x1 - x0, y1 - y0).intersected(covered)
+            if hit.isEmpty():
+                continue  # 与水印不相交的分块不读不写
+            rows_per_band = max(1, BAND_BYTES // stride)
+            row = hit.top()
+            while row <= hit.bottom():
+                rows = min(rows_per_band, hit.bottom() + 1 - row)
+                position = offset + (row - y0) * stride
+                f.seek(position)
+                data = f.read(rows * stride)
+                band = QImage(data, x1 - x0, rows, stride, fmt).copy()
+                painter = QPainter(band)
+                paint_watermark(painter, spec, width, height, dpm_x, dpm_y, offset=QPoint(x0, row))
+                painter.end()
+                f.seek(position)
+                f.write(_band_bytes(band, stride))
+                row += rows
+    return True
+
+
+def _band_bytes(band, stride):
+    """按文件中的行跨度取出 QImage 的像素（QImage 的行按 4 字节对齐）"""
+    bits = band.constBits()
+    if band.bytesPerLine() == stride:
+        return bytes(bits)[:stride * band.height()]
+    line = band.bytesPerLine()
+    raw = bytes(bits)
+    return b"".join(raw[y * line:y * line + stride] for y in range(band.height()))
@@ -0,0 +1,401 @@
+"""监视文件夹：把陆续放进输入文件夹的图片按模板加水印，写到输出文件夹
+
+    python src/main.py watch --template 1 --in 热文件夹 --out 输出文件夹
+
+Linux 上用 inotify（通过 ctypes 调用 libc，不需要额外依赖）接收文件事件，其它平台或 inotify
+不可用时退回定时扫描。文件写完并关闭（IN_CLOSE_WRITE）或被移入（IN_MOVED_TO）时立即处理；
+只收到创建、修改事件或由扫描发现的文件，要等大小和修改时间在 settle 秒内不再变化才处理，
+不会读到拷贝了一半的图片。
+
+处理与批量导出相同（export_one：分块 TIFF、JPEG 条带直通或 解码 → 绘制 → 编码，原子写入），
+在常驻的进程池中执行。工作进程启动时预先导入 Qt 和编码模块并绘制一次水印，之后单张 JPEG 从
+到达到写出通常在一秒以内。在途任务数不超过进程数的两倍，其余的排队等待。
+给出导出清单时照常记录，重启后已处理且未变化的文件不会重复处理。
+已删除或移走的源文件的处理记录和输出路径会定期清理，长时间运行时内存占用不会一直增长。
+"""
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import struct
+import threading
+from collections import deque
+
+import stats
+from batch import OutputNames, _collect, _init_warm_worker, export_one
+from encoder import EncoderSettings
+from manifest import spec_digest
+from scanner import is_image_file, iter_images
+
+DEFAULT_SETTLE = 0.2  # 秒
+DEFAULT_POLL_INTERVAL = 0.5  # 秒
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def _inside(path, folder):
+    return os.path.commonpath([path, folder]) == folder
+
+
+class InotifySource:
+    """inotify 事件源（仅 Linux），递归监视 root 下的所有子文件夹"""
+
+    def __init__(self, root, exclude=None):
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify 仅在 Linux 上可用")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.root = root
+        self.exclude = exclude
+        self._dirs = {}  # wd -> 文件夹
+        self._add_tree(root)
+
+    def fileno(self):
+        return self._fd
+
+    def due(self, now):
+        return None  # 只在有事件时才需要读
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_watch(self, folder):
+        import ctypes
+
+        if self.exclude and _inside(folder, self.exclude):
+            return False
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), _WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if folder == self.root:
+                raise OSError(code, os.strerror(code), folder)
+            return False  # 子文件夹已被删除、或超过 max_user_watches
+        self._dirs[wd] = folder
+        return True
+
+    def _add_tree(self, folder):
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            if not self._add_watch(current):
+                continue
+            try:
+                with os.scandir(current) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def read(self, now):
+        """返回 [(路径, 是否已写完)]"""
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，丢失的事件只能靠重新扫描补上
+                events.extend((path, False) for path in iter_images([self.root]))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            folder = self._dirs.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新文件夹：加上监视后，补扫在加监视之前已经放进去的文件
+                    self._add_tree(path)
+                    events.extend((p, False) for p in iter_images([path]))
+                continue
+            events.append((path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return events
+
+
+class PollSource:
+    """定时扫描的事件源，inotify 不可用时使用"""
+
+    def __init__(self, root, interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._next = 0.0
+
+    def fileno(self):
+        return None
+
+    def due(self, now):
+        return max(self._next - now, 0.0)
+
+    def close(self):
+        pass
+
+    def read(self, now):
+        if now < self._next:
+            return []
+        self._next = now + self.interval
+        return [(path, False) for path in iter_images([self.root])]
+
+
+def open_source(root, exclude=None, poll=False, interval=DEFAULT_POLL_INTERVAL):
+    """优先使用 inotify，不可用时退回定时扫描"""
+    if not poll:
+        try:
+            return InotifySource(root, exclude)
+        except (OSError, AttributeError):
+            pass  # 非 Linux、libc 没有 inotify，或 inotify 实例数已达上限
+    return PollSource(root, interval)
+
+
+class FolderWatcher:
+    """监视 in_dir，把稳定下来的新图片按 spec 导出到 out_dir，直到 stop()
+
+    callback 签名为 callback(src, dst, error, latency)，latency 为从发现文件到写出的秒数，
+    error 为 None 表示成功。stop() 可在任意线程调用。
+    """
+    # 已处理的记录超过上次清理后的两倍（且不少于该数）时，清理已删除或移走的源文件
+    PRUNE_MIN = 1000
+
+    def __init__(self, spec, in_dir, out_dir, output_format="JPEG", settings=None, max_workers=None,
+                 manifest=None, prefix="", suffix="_watermarked", settle=DEFAULT_SETTLE,
+                 poll=False, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.spec = spec
+        self.in_dir = os.path.abspath(in_dir)
+        self.out_dir = os.path.abspath(out_dir)
+        self.output_format = output_format
+        self.settings = settings or EncoderSettings()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.manifest = manifest
+        self.prefix = prefix
+        self.suffix = suffix
+        self.outputs = OutputNames(self.out_dir, output_format, prefix, suffix)
+        self.settle = settle
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.source = None
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._pending = {}  # 路径 -> [(大小, 修改时间), 最近变化时刻, 是否已写完, 发现时刻]
+        self._ready = deque()  # [(路径, 状态, 发现时刻)]
+        self._running = {}  # future -> (路径, 输出, 状态, 发现时刻)
+        self._again = set()  # 处理期间又有变化的路径
+        self._done = {}  # 路径 -> 已处理的 (大小, 修改时间)
+        self._prune_at = self.PRUNE_MIN
+
+    def stop(self):
+        self._stop.set()
+        self._wake()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def _wake(self, *_):
+        try:
+            self._wake_w.send(b"x")
+        except OSError:
+            pass  # 缓冲区已满，说明已有未处理的唤醒
+
+    def _candidate(self, path, closed, now):
+        """记录一次文件事件"""
+        path = os.path.abspath(path)
+        if (
+            not is_image_file(path) or os.path.basename(path).startswith(".")  # 临时文件、隐藏文件
+            or _inside(path, self.out_dir)
+        ):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)  # 已被删除或移走
+            return
+        stamp = (st.st_size, st.st_mtime_ns)
+        if self._done.get(path) == stamp:
+            return
+        entry = self._pending.get(path)
+        if entry is None:
+            self._pending[path] = [stamp, now, closed, now]
+        elif entry[0] != stamp:
+            entry[0], entry[1], entry[2] = stamp, now, closed
+        else:
+            entry[2] = entry[2] or closed
+
+    def _collect_ready(self, now):
+        """把已稳定的文件移入待处理队列，返回距下一次需要检查的秒数"""
+        wait = None
+        for path, entry in list(self._pending.items()):
+            stamp, changed, closed, found = entry
+            if not closed and now - changed < self.settle:
+                left = self.settle - (now - changed)
+                wait = left if wait is None else min(wait, left)
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != stamp or not st.st_size:
+                # 仍在写入（或还是空文件），重新计时
+                entry[0], entry[1], entry[2] = current, now, False
+                wait = self.settle if wait is None else min(wait, self.settle)
+                continue
+            del self._pending[path]
+            if self._done.get(path) == stamp:
+                continue  # 处理期间又被扫描到的同一版本，已经处理过
+            if path in self._running_paths():
+                self._again.add(path)
+            else:
+                self._ready.append((path, stamp, found))
+        return wait
+
+    def _running_paths(self):
+        return {job[0] for job in self._running.values()}
+
+    def _prune(self):
+        """忘掉已不存在的源文件：_done 中的记录和分配给它的输出路径，长时间运行时两者不会无限增长"""
+        # 排队和处理中的任务已分配了输出路径，留到处理完的下一次清理
+        busy = self._running_paths() | {job[0] for job in self._ready}
+        for path in [p for p in self._done if p not in busy and not os.path.exists(p)]:
+            del self._done[path]
+            self.outputs.forget(path)
+        self._prune_at = max(self.PRUNE_MIN, 2 * len(self._done))
+
+    def _start_pool(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from renderer import get_backend
+
+        return ProcessPoolExecutor(
+            self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_warm_worker, initargs=(stats.enabled, get_backend(), (self.spec,)),
+        )
+
+    def _submit(self, pool, digest):
+        window = self.max_workers * 2
+        while self._ready and len(self._running) < window:
+            path, stamp, found = self._ready.popleft()
+            dst = self.outputs.get(path)
+            if self.manifest and self.manifest.is_up_to_date(path, dst, digest, stamp):
+                self._done[path] = stamp
+                self.skipped += 1
+                continue
+            future = pool.submit(_collect, export_one, path, dst, self.output_format, self.spec, self.settings)
+            self._running[future] = (path, dst, stamp, found)
+            future.add_done_callback(self._wake)
+        if stats.enabled:
+            stats.gauge("queue.watch", len(self._ready) + len(self._running))
+
+    def _finish(self, digest, callback, block=False):
+        """处理已完成的任务，返回进程池是否已损坏"""
+        from concurrent.futures import wait
+        from concurrent.futures.process import BrokenProcessPool
+
+        if block and self._running:
+            wait(list(self._running))
+        broken = False
+        for future in [f for f in self._running if f.done()]:
+            path, dst, stamp, found = self._running.pop(future)
+            error = future.exception()
+            if error is None:
+                _, worker_stats = future.result()
+                stats.merge(worker_stats)
+                self.processed += 1
+                if self.manifest:
+                    self.manifest.record(path, dst, digest, stamp, self.output_format)
+            else:
+                self.failed += 1
+                broken = broken or isinstance(error, BrokenProcessPool)
+            # 失败的文件同样记下，内容变化后才重试
+            self._done[path] = stamp
+            if callback:
+                callback(path, dst, error, time.monotonic() - found)
+            if path in self._again:
+                self._again.discard(path)
+                self._candidate(path, False, time.monotonic())
+        return broken
+
+    def run(self, callback=None):
+        """阻塞运行直到 stop() 或 Ctrl+C；输入文件夹中已有的文件也会处理（有清单时跳过已导出的）"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        digest = spec_digest(self.spec, self.output_format, self.settings)
+        exclude = self.out_dir if _inside(self.out_dir, self.in_dir) else None
+        self.source = open_source(self.in_dir, exclude, self.poll, self.poll_interval)
+        pool = self._start_pool()
+        try:
+            # 启动时先把进程都拉起来，第一张图片不必等进程启动
+            for future in [pool.submit(os.getpid) for _ in range(self.max_workers)]:
+                future.result()
+            now = time.monotonic()
+            for path in iter_images([self.in_dir]):
+                self._candidate(path, False, now)
+            while not self.stopped:
+                now = time.monotonic()
+                for path, closed in self.source.read(now):
+                    self._candidate(path, closed, now)
+                wait = self._collect_ready(now)
+                self._submit(pool, digest)
+                if self._finish(digest, callback):
+                    # 工作进程崩溃（例如解码器出错），换一个新的进程池继续
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._start_pool()
+                    continue
+                if len(self._done) > self._prune_at:
+                    self._prune()
+                if self._ready and len(self._running) < self.max_workers * 2:
+                    continue
+                due = self.source.due(now)
+                timeout = min(t for t in (wait, due, 1.0) if t is not None)
+                readers = [self._wake_r] + ([self.source.fileno()] if self.source.fileno() is not None else [])
+                try:
+                    readable, _, _ = select.select(readers, [], [], timeout)
+                except KeyboardInterrupt:
+                    self.stop()
+                    break
+                if self._wake_r in readable:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+            self._finish(digest, callback, block=True)
+        except KeyboardInterrupt:
+            self._finish(digest, callback, block=True)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.source.close()
+            if self.manifest:
+                self.manifest.close()
+        return self.processed, self.failed
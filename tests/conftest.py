@@ -0,0 +1,191 @@
+"""测试的公共设置与夹具
+
+- 在没有显示器的环境中运行（QT_QPA_PLATFORM=offscreen），src 目录加入 sys.path；
+- golden：渲染结果与 tests/golden 中的参考图按感知容差比较，加 --update-golden 重新生成参考图；
+- budget / memory_budget：分阶段的耗时和内存预算，可用环境变量 WATERMARK_BUDGET_SCALE 整体放宽。
+
+    python -m pytest tests
+    python -m pytest tests -m "not budget"     # 跳过性能预算
+    python -m pytest tests --update-golden     # 渲染有意改变后重新生成参考图
+"""
+import os
+import sys
+import json
+import statistics
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import pytest
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+# 生成参考图时各字体名实际匹配到的字体；本机匹配结果不同时字形必然不同，跳过比较
+FONTS_PATH = os.path.join(GOLDEN_DIR, "fonts.json")
+
+# 感知比较：先做 3x3 均值模糊（容忍抗锯齿造成的单像素偏移），再逐像素取各通道差异的最大值
+MAX_MEAN_DIFF = 1.0
+MAX_PIXEL_DIFF = 48
+MAX_OVER_RATIO = 0.002  # 差异超过 MAX_PIXEL_DIFF 的像素所占比例
+
+BUDGET_SCALE = float(os.environ.get("WATERMARK_BUDGET_SCALE", "1"))
+
+
+def pytest_addoption(parser):
+    parser.addoption("--update-golden", action="store_true", help="重新生成 tests/golden 中的参考图")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "budget: 耗时和内存预算，-m 'not budget' 可跳过")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def qapp():
+    # 字体和 QPainter 需要一个 QGuiApplication，界面测试需要 QApplication
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+def resolved_font(family):
+    from PySide6.QtGui import QFont, QFontInfo
+    return QFontInfo(QFont(family)).family()
+
+
+def image_array(image):
+    """QImage -> (高, 宽, 4) float32 数组（ARGB32，逐像素复制）"""
+    import numpy as np
+    from PySide6.QtGui import QImage
+    from numpy_backend import qimage_array
+
+    image = image.convertToFormat(QImage.Format_ARGB32)
+    return qimage_array(image, writable=False).astype(np.float32)
+
+
+def _blur(a):
+    import numpy as np
+    h, w = a.shape[:2]
+    padded = np.pad(a, ((1, 1), (1, 1), (0, 0)), mode="edge")
+    return sum(padded[y:y + h, x:x + w] for y in range(3) for x in range(3)) / 9
+
+
+def perceptual_diff(a, b):
+    """两张同尺寸图像的 (平均差异, 差异超过 MAX_PIXEL_DIFF 的像素比例)"""
+    diff = abs(_blur(image_array(a)) - _blur(image_array(b))).max(axis=2)
+    return float(diff.mean()), float((diff > MAX_PIXEL_DIFF).mean())
+
+
+def _load_fonts():
+    try:
+        with open(FONTS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+@pytest.fixture
+def golden(request, tmp_path):
+    """golden(name, image, families)：与参考图 golden/<name>.png 比较；--update-golden 时改为写入参考图"""
+    from PySide6.QtGui import QImage
+
+    update = request.config.getoption("--update-golden")
+
+    def check(name, image, families=("Arial",)):
+        path = os.path.join(GOLDEN_DIR, f"{name}.png")
+        fonts = _load_fonts()
+        if update:
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            assert image.save(path), f"无法写入参考图：{path}"
+            fonts.update({family: resolved_font(family) for family in families})
+            with open(FONTS_PATH, "w", encoding="utf-8") as f:
+                json.dump(fonts, f, ensure_ascii=False, indent=2, sort_keys=True)
+                f.write("\n")
+            return
+        for family in families:
+            if family in fonts and fonts[family] != resolved_font(family):
+                pytest.skip(f"参考图中的 {family} 是 {fonts[family]}，本机匹配到 {resolved_font(family)}")
+        expected = QImage(path)
+        assert not expected.isNull(), f"缺少参考图 {path}，用 --update-golden 生成"
+        assert image.size() == expected.size(), f"尺寸不同：{image.size()} != {expected.size()}"
+        mean, over = perceptual_diff(image, expected)
+        if mean > MAX_MEAN_DIFF or over > MAX_OVER_RATIO:
+            actual = str(tmp_path / f"{name}.png")
+            image.save(actual)
+            pytest.fail(
+                f"{name} 与参考图不符：平均差异 {mean:.2f}（上限 {MAX_MEAN_DIFF}），"
+                f"差异过大的像素 {over:.2%}（上限 {MAX_OVER_RATIO:.2%}），实际输出见 {actual}"
+            )
+
+    return check
+
+
+@pytest.fixture
+def budget():
+    """budget(func, ms, rounds=5, setup=None)：预热一次后计时 rounds 轮，中位数超过预算时失败，返回中位数（毫秒）
+
+    setup 在计时外调用，返回值作为 func 的参数（同 bench.measure）。
+    """
+    from bench import measure
+
+    def check(func, ms, rounds=5, setup=None):
+        measure(func, 1, setup)
+        samples = [s * 1000 for s in measure(func, rounds, setup)]
+        median = statistics.median(samples)
+        limit = ms * BUDGET_SCALE
+        assert median <= limit, (
+            f"中位耗时 {median:.1f} ms 超出预算 {limit:.0f} ms（各轮 {', '.join(f'{s:.1f}' for s in samples)}）"
+        )
+        return median
+
+    return check
+
+
+def _proc_status_mb(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name == key:
+                return int(value.split()[0]) / 1024
+    raise KeyError(key)
+
+
+def _child_peak_mb(prepare, args):
+    """在新进程中执行：prepare(*args) 完成导入和预热并返回待测函数，返回该函数执行期间常驻内存峰值的增量（MB）"""
+    from PySide6.QtGui import QGuiApplication
+    app = QGuiApplication.instance() or QGuiApplication([])  # noqa: F841
+    run = prepare(*args)
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # 把峰值常驻内存（VmHWM）重置为当前值
+    base = _proc_status_mb("VmRSS")
+    run()
+    return _proc_status_mb("VmHWM") - base
+
+
+@pytest.fixture
+def memory_budget():
+    """memory_budget(prepare, args, mb)：在新进程中测量一个阶段的峰值内存增量，超过预算时失败，返回增量（MB）
+
+    每次都用新进程：已释放的内存可能留在分配器中被复用，同一进程内的第二次测量会偏低。
+    依赖 Linux 的 /proc/self/clear_refs，其它平台跳过。
+    """
+    if not os.path.exists("/proc/self/clear_refs"):
+        pytest.skip("需要 Linux 的 /proc/self/clear_refs 测量峰值内存")
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    def check(prepare, args, mb):
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            peak = pool.submit(_child_peak_mb, prepare, args).result()
+        limit = mb * BUDGET_SCALE
+        assert peak <= limit, f"峰值内存增量 {peak:.1f} MB 超出预算 {limit:.0f} MB"
+        return peak
+
+    return check
+
+
+@pytest.fixture(scope="session")
+def bench_inputs(tmp_path_factory):
+    """bench 的固定种子测试图片：{尺寸名: {格式: 路径}}"""
+    from bench import prepare_inputs
+    return prepare_inputs(str(tmp_path_factory.mktemp("bench")), ("1mp", "12mp"))
@@ -0,0 +1,102 @@
+"""批量导出的输出路径：同名源文件各自导出到不同的文件，重复导出时全部跳过"""
+import os
+import json
+
+from PIL import Image
+
+from batch import BatchExporter, OutputNames, output_jobs
+from manifest import ExportManifest
+from renderer import WatermarkSpec
+from scanner import iter_images
+
+
+SPEC = WatermarkSpec(text="deded", font_size=12)
+
+
+def write_sources(folder):
+    """a/x.jpg、b/x.jpg 和 x.png：文件名去掉扩展名后都是 x"""
+    paths = []
+    for i, name in enumerate(("a/x.jpg", "b/x.jpg", "x.png")):
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (64, 48), (60 * i, 90, 200)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def export(sources, out_dir):
+    exporter = BatchExporter(
+        SPEC, output_jobs(sources, out_dir, "JPEG"), "JPEG",
+        max_workers=1, encode_workers=1, manifest=ExportManifest(out_dir),
+    )
+    written, failed = exporter.run()
+    return written, failed, exporter.skipped
+
+
+def test_output_jobs_disambiguates_same_stem():
+    sources = ["in/a/IMG_1.jpg", "in/b/IMG_1.jpg", "in/IMG_1.png", "in/IMG_1_2.jpg"]
+    jobs = output_jobs(sources, "out", "JPEG", suffix="_wm")
+    dsts = [dst for _, dst in jobs]
+    assert dsts[:3] == [os.path.join("out", name) for name in ("IMG_1_wm.jpeg", "IMG_1_wm_2.jpeg", "IMG_1_wm_3.jpeg")]
+    assert len(set(dsts)) == len(dsts)
+    assert output_jobs(sources, "out", "JPEG", suffix="_wm") == jobs
+
+
+def test_same_stem_sources_export_and_skip(tmp_path):
+    write_sources(tmp_path / "in")
+    sources = sorted(iter_images([str(tmp_path / "in")]))
+    out_dir = str(tmp_path / "out")
+    os.makedirs(out_dir)
+    written, failed, skipped = export(sources, out_dir)
+    assert not failed
+    assert len(set(written)) == 3 and all(os.path.exists(dst) for dst in written)
+    # 三张输出来自不同的源图
+    colors = {Image.open(dst).getpixel((0, 47)) for dst in written}
+    assert len(colors) == 3
+
+    written, failed, skipped = export(sources, out_dir)
+    assert not written and not failed
+    assert len(skipped) == 3
+
+
+def test_duplicate_destination_fails(tmp_path):
+    first, second, _ = write_sources(tmp_path / "in")
+    dst = str(tmp_path / "out.jpeg")
+    errors = []
+    exporter = BatchExporter(SPEC, [(first, dst), (second, dst)], "JPEG", max_workers=1, encode_workers=1)
+    written, failed = exporter.run(lambda done, total, src, error: errors.append((done, src, error)))
+    assert written == [dst]
+    assert [src for src, _ in failed] == [second]
+    assert errors[0][:2] == (1, second) and first in str(errors[0][2])
+    assert errors[-1][0] == 2
+
+
+def test_malformed_manifest_lines_are_ignored(tmp_path):
+    write_sources(tmp_path / "in")
+    sources = sorted(iter_images([str(tmp_path / "in")]))
+    out_dir = str(tmp_path / "out")
+    os.makedirs(out_dir)
+    written, _, _ = export(sources, out_dir)
+
+    manifest = ExportManifest(out_dir)
+    with open(manifest.path, "a", encoding="utf-8") as f:
+        # 同一输出的坏记录排在好记录之后，不应覆盖它
+        f.write(json.dumps({"version": 1, "dst": written[0]}) + "\n")
+        f.write(json.dumps({"version": 1, "dst": written[1], "src": sources[1], "digest": "x",
+                            "src_size": "1", "src_mtime_ns": 0, "dst_size": 0, "dst_mtime_ns": 0}) + "\n")
+        f.write("[1, 2]\n")
+        f.write('{"version": 1, "dst": \n')
+    assert set(ExportManifest(out_dir).entries) == set(manifest.entries)
+
+    written, failed, skipped = export(sources, out_dir)
+    assert not written and not failed
+    assert len(skipped) == 3
+
+
+def test_output_names_forget():
+    names = OutputNames("out", "JPEG")
+    assert names.get("a/x.jpg") == os.path.join("out", "x.jpeg")
+    assert names.get("b/x.jpg") == os.path.join("out", "x_2.jpeg")
+    names.forget("a/x.jpg")
+    assert names.get("c/x.jpg") == os.path.join("out", "x.jpeg")
+    assert names.get("b/x.jpg") == os.path.join("out", "x_2.jpeg")
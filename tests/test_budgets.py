@@ -0,0 +1,152 @@
+"""分阶段的耗时和内存预算
+
+耗时按多轮的中位数判断；内存在新进程中测量峰值常驻内存的增量。预算约为开发机实测值的 3-4 倍，
+只用来拦住数量级上的性能回退（缓存失效、多解码一次、多复制一份整图等）；
+较慢的机器上可用 WATERMARK_BUDGET_SCALE=2 等整体放宽。输入是 bench 的固定种子测试图片。
+"""
+import os
+
+import pytest
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QImage
+
+import renderer
+from batch import export_one
+from bench import SIZES, render_cases, synthetic_image
+from encoder import EncoderSettings, encode_image
+from image_cache import decode_image
+from renderer import composite, watermark_sprite
+
+
+pytestmark = pytest.mark.budget
+
+CASES = render_cases()
+HEAVY = "shadow+outline+rot30"
+PREVIEW_SIZE = (1280, 800)
+TIFF_SIZE = (8000, 6000)
+MB = 1024 * 1024
+
+# 毫秒
+TIME_BUDGETS = {
+    ("decode", "1mp"): 100,
+    ("decode", "12mp"): 1000,
+    ("preview", "12mp"): 500,
+    ("sprite", "plain"): 20,
+    ("sprite", HEAVY): 150,
+    ("composite", "1mp"): 5,
+    ("composite", "12mp"): 10,
+    ("tile", "12mp"): 600,
+    ("encode", "JPEG"): 600,  # 12mp
+    ("encode", "PNG"): 1000,  # 1mp
+    ("export", "1mp"): 150,
+    ("export", "12mp"): 1700,
+}
+
+
+def image_mb(size, depth=4):
+    width, height = SIZES[size] if isinstance(size, str) else size
+    return width * height * depth / MB
+
+
+@pytest.fixture(scope="module")
+def decoded(bench_inputs):
+    return {size: decode_image(files["jpeg"])[0] for size, files in bench_inputs.items()}
+
+
+@pytest.mark.parametrize("size", ["1mp", "12mp"])
+def test_decode_time(budget, bench_inputs, size):
+    budget(lambda: decode_image(bench_inputs[size]["jpeg"]), TIME_BUDGETS["decode", size])
+
+
+def test_preview_decode_time(budget, bench_inputs):
+    # 预览按目标尺寸缩小解码，JPEG 在解码阶段就缩小，应明显快于完整解码
+    target = QSize(*PREVIEW_SIZE)
+    budget(lambda: decode_image(bench_inputs["12mp"]["jpeg"], target), TIME_BUDGETS["preview", "12mp"])
+
+
+@pytest.mark.parametrize("case", ["plain", HEAVY])
+def test_sprite_time(budget, decoded, case):
+    # 清空图块缓存后的首次栅格化
+    image = decoded["12mp"]
+    budget(
+        lambda _: watermark_sprite(CASES[case], image), TIME_BUDGETS["sprite", case],
+        setup=renderer._build_sprite.cache_clear,
+    )
+
+
+@pytest.mark.parametrize("size", ["1mp", "12mp"])
+def test_composite_time(budget, decoded, size):
+    # 图块已缓存时，每张图片只剩一次混合
+    budget(lambda image: composite(image, CASES[HEAVY]), TIME_BUDGETS["composite", size], setup=decoded[size].copy)
+
+
+def test_tile_time(budget, decoded):
+    budget(
+        lambda image: composite(image, CASES["tile+rot30"]), TIME_BUDGETS["tile", "12mp"],
+        rounds=3, setup=decoded["12mp"].copy,
+    )
+
+
+# PNG 编码比 JPEG 慢一个数量级，用 1mp 的图免得单项测试就要十几秒
+@pytest.mark.parametrize("fmt, size", [("JPEG", "12mp"), ("PNG", "1mp")])
+def test_encode_time(budget, decoded, tmp_path, fmt, size):
+    image = composite(decoded[size].copy(), CASES[HEAVY])
+    dst = str(tmp_path / f"out.{fmt.lower()}")
+    budget(lambda: encode_image(image, dst, fmt, EncoderSettings()), TIME_BUDGETS["encode", fmt], rounds=3)
+
+
+@pytest.mark.parametrize("size", ["1mp", "12mp"])
+def test_export_time(budget, bench_inputs, tmp_path, size):
+    dst = str(tmp_path / "out.jpeg")
+    budget(
+        lambda: export_one(bench_inputs[size]["jpeg"], dst, "JPEG", CASES[HEAVY]),
+        TIME_BUDGETS["export", size], rounds=3,
+    )
+
+
+# 以下函数在 memory_budget 的子进程中执行：完成导入和预热，返回待测的阶段
+
+
+def prepare_decode(path, target=None):
+    decode_image(path, QSize(16, 16))
+    size = QSize(*target) if target else None
+    return lambda: decode_image(path, size)
+
+
+def prepare_export(src, dst, fmt):
+    # 先导出一张小图，加载编解码插件和字体
+    ext = os.path.splitext(src)[1]
+    tiny = os.path.join(os.path.dirname(dst), f"warm{ext}")
+    QImage(64, 64, QImage.Format_RGB32).save(tiny)
+    export_one(tiny, os.path.join(os.path.dirname(dst), f"warm-out.{fmt.lower()}"), fmt, CASES[HEAVY])
+    return lambda: export_one(src, dst, fmt, CASES[HEAVY])
+
+
+@pytest.fixture(scope="module")
+def big_tiff(tmp_path_factory):
+    """未压缩的大 TIFF，走分块导出"""
+    path = str(tmp_path_factory.mktemp("tiff") / "big.tif")
+    synthetic_image(*TIFF_SIZE).save(path)
+    return path
+
+
+def test_decode_memory(memory_budget, bench_inputs):
+    # 解码结果本身就是一整图（每像素 4 字节），不应再有整图大小的中间副本
+    memory_budget(prepare_decode, (bench_inputs["12mp"]["jpeg"],), image_mb("12mp") * 1.5)
+
+
+def test_preview_decode_memory(memory_budget, bench_inputs):
+    memory_budget(prepare_decode, (bench_inputs["12mp"]["jpeg"], PREVIEW_SIZE), image_mb("12mp") * 0.5)
+
+
+def test_export_memory(memory_budget, bench_inputs, tmp_path):
+    # 源文件、解码后的整图、交给 Pillow 编码的 RGB 数据各一份
+    memory_budget(
+        prepare_export, (bench_inputs["12mp"]["jpeg"], str(tmp_path / "out.jpeg"), "JPEG"),
+        image_mb("12mp") * 4,
+    )
+
+
+def test_tiled_tiff_export_memory(memory_budget, big_tiff, tmp_path):
+    # 分块导出只读入与水印相交的行带，整图解码的路径至少要整图大小的两倍
+    memory_budget(prepare_export, (big_tiff, str(tmp_path / "out.tiff"), "TIFF"), image_mb(TIFF_SIZE) * 0.6)
@@ -0,0 +1,108 @@
+"""JPEG 局部重编码：只有水印所在的重启区间被重编码，其余字节与原文件相同；不适用时改走常规编码"""
+import numpy as np
+import pytest
+from PIL import Image
+from PySide6.QtCore import QRect
+
+import jpeg_passthrough
+from batch import export_one
+from jpeg_passthrough import export_jpeg_passthrough, parse_jpeg
+from renderer import WatermarkSpec, sprite_placement
+
+
+SIZE = (640, 480)
+SPEC = WatermarkSpec(text="deded", font_size=32, outline_enabled=True, watermark_pos_mode="bottom_right")
+DPM = 3780  # 没有 DPI 信息的 JPEG 按 96 DPI 处理
+
+
+def source_image(mode):
+    width, height = SIZE
+    gradient = np.linspace(0, 160, width, dtype=np.float32)[None, :, None]
+    noise = np.random.default_rng(2024).integers(0, 96, (height, width, 3))
+    return Image.fromarray((gradient + noise).astype(np.uint8), "RGB").convert(mode)
+
+
+def write_jpeg(path, mode="RGB", **options):
+    options.setdefault("quality", 90)
+    source_image(mode).save(path, "JPEG", **options)
+    return str(path)
+
+
+def covered_rect(spec, width, height):
+    sprite, origin = sprite_placement(spec, width, height, DPM, DPM)
+    return QRect(origin, sprite.image.size()).intersected(QRect(0, 0, width, height))
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def pixels(path):
+    with Image.open(path) as im:
+        return np.asarray(im.convert("RGB")).astype(np.int16)
+
+
+@pytest.fixture
+def passthrough_results(monkeypatch):
+    """记录 export_one 中局部重编码的返回值，False 表示改走了常规的 解码 → 绘制 → 编码"""
+    results = []
+    original = jpeg_passthrough.export_jpeg_passthrough
+
+    def export(*args, **kwargs):
+        results.append(original(*args, **kwargs))
+        return results[-1]
+
+    monkeypatch.setattr(jpeg_passthrough, "export_jpeg_passthrough", export)
+    return results
+
+
+def test_only_watermark_intervals_reencoded(tmp_path):
+    # 每个 MCU 行一个重启区间，区间序号即 MCU 行号
+    src = write_jpeg(tmp_path / "src.jpg", restart_marker_rows=1)
+    dst = str(tmp_path / "dst.jpg")
+    assert export_jpeg_passthrough(src, dst, SPEC)
+
+    before, after = parse_jpeg(read(src)), parse_jpeg(read(dst))
+    assert after.header == before.header
+    assert len(after.intervals) == len(before.intervals)
+    changed = [i for i, (a, b) in enumerate(zip(before.intervals, after.intervals)) if a != b]
+    _, mcu_h = before.mcu_size()
+    covered = covered_rect(SPEC, *SIZE)
+    rows = range(covered.top() // mcu_h, covered.bottom() // mcu_h + 1)
+    assert changed and set(changed) <= set(rows)
+
+    # 水印区域的像素变了，区域上方的行解码后与原图完全相同
+    # （解码器的色度上采样跨 MCU 边界插值，紧挨条带的一行会随之变化）
+    original, result = pixels(src), pixels(dst)
+    region = (slice(covered.top(), covered.bottom() + 1), slice(covered.left(), covered.right() + 1))
+    assert (result[region] != original[region]).any()
+    untouched = rows.start * mcu_h - 1
+    assert (result[:untouched] == original[:untouched]).all()
+
+
+def test_export_one_uses_passthrough(tmp_path, passthrough_results):
+    src = write_jpeg(tmp_path / "src.jpg", restart_marker_rows=1)
+    export_one(src, str(tmp_path / "dst.jpeg"), "JPEG", SPEC)
+    assert passthrough_results == [True]
+
+
+@pytest.mark.parametrize("case, mode, options", [
+    ("no-restart", "RGB", {}),
+    ("progressive", "RGB", {"progressive": True, "restart_marker_rows": 1}),
+    ("cmyk", "CMYK", {"restart_marker_rows": 1}),
+    # 优化过的 Huffman 表与编码器的标准表不同，重编码的条带无法拼回（layout_key 不一致）
+    ("optimized-huffman", "RGB", {"optimize": True, "restart_marker_rows": 1}),
+])
+def test_fallback_to_normal_encoder(tmp_path, passthrough_results, case, mode, options):
+    src = write_jpeg(tmp_path / "src.jpg", mode, **options)
+    if case == "optimized-huffman":
+        assert parse_jpeg(read(src)) is not None
+    passthrough = tmp_path / "passthrough.jpg"
+    assert not export_jpeg_passthrough(src, str(passthrough), SPEC)
+    assert not passthrough.exists()
+
+    dst = str(tmp_path / "dst.jpeg")
+    export_one(src, dst, "JPEG", SPEC)
+    assert passthrough_results == [False]
+    assert (pixels(dst) != pixels(src)).any()
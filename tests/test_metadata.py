@@ -0,0 +1,97 @@
+"""EXIF 方向与元数据透传：解码结果与 Pillow 的 exif_transpose 一致，导出时保留 EXIF/ICC"""
+import pytest
+from PIL import Image, ImageCms, ImageOps
+
+from batch import export_one
+from encoder import EncoderSettings
+from image_cache import decode_data, decode_image
+from metadata import metadata_from_bytes, read_metadata
+from renderer import WatermarkSpec
+
+
+FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "TIFF": ".tif"}
+SPEC = WatermarkSpec(text="deded", font_size=12, watermark_pos_mode="top_left")
+
+
+def source_image():
+    """左右、上下都不对称的图案，转错方向一定看得出来"""
+    image = Image.new("RGB", (96, 64), (200, 30, 30))
+    image.paste((30, 30, 200), (0, 0, 32, 32))
+    image.paste((30, 200, 30), (64, 32, 96, 64))
+    return image
+
+
+def icc_profile():
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+
+
+def write_source(tmp_path, fmt, orientation, icc=None):
+    path = str(tmp_path / f"src{FORMATS[fmt]}")
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x010F] = "Watermark Studio"  # Make，检查 EXIF 的其它字段是否保留
+    options = {"exif": exif, "icc_profile": icc} if icc else {"exif": exif}
+    if fmt in ("JPEG", "WEBP"):
+        options["quality"] = 95
+    source_image().save(path, fmt, **options)
+    return path
+
+
+def mean_diff(qimage, pil_image):
+    import numpy as np
+    from PySide6.QtGui import QImage
+    qimage = qimage.convertToFormat(QImage.Format_RGB888)
+    actual = np.frombuffer(qimage.constBits(), np.uint8).reshape(qimage.height(), qimage.bytesPerLine())
+    actual = actual[:, :qimage.width() * 3].reshape(qimage.height(), qimage.width(), 3).astype(np.float32)
+    expected = np.asarray(pil_image.convert("RGB"), np.float32)
+    assert actual.shape == expected.shape
+    return float(abs(actual - expected).mean())
+
+
+@pytest.mark.parametrize("fmt", list(FORMATS))
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_decode_applies_orientation(tmp_path, fmt, orientation):
+    path = write_source(tmp_path, fmt, orientation)
+    assert read_metadata(path).orientation == orientation
+    expected = ImageOps.exif_transpose(Image.open(path))
+    image, size = decode_image(path)
+    assert (size.width(), size.height()) == expected.size
+    assert mean_diff(image, expected) < 3
+
+    with open(path, "rb") as f:
+        data = f.read()
+    assert metadata_from_bytes(data) == read_metadata(path)
+    image, _ = decode_data(data)
+    assert mean_diff(image, expected) < 3
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG", "WEBP"])
+def test_export_keeps_exif_and_icc(tmp_path, fmt):
+    icc = icc_profile()
+    src = write_source(tmp_path, "JPEG", 6, icc)
+    dst = str(tmp_path / f"out.{fmt.lower()}")
+    export_one(src, dst, fmt, SPEC)
+    with Image.open(dst) as out:
+        assert out.size == (64, 96)  # 已转正
+        exif = out.getexif()
+        assert exif.get(0x0112) == 1
+        assert exif.get(0x010F) == "Watermark Studio"
+        assert out.info.get("icc_profile") == icc
+
+
+def test_export_strip_metadata(tmp_path):
+    src = write_source(tmp_path, "JPEG", 6, icc_profile())
+    dst = str(tmp_path / "out.jpeg")
+    export_one(src, dst, "JPEG", SPEC, EncoderSettings(keep_metadata=False))
+    with Image.open(dst) as out:
+        assert out.size == (64, 96)
+        assert 0x0112 not in out.getexif()
+        assert "icc_profile" not in out.info
+
+
+def test_logo_orientation(tmp_path):
+    from renderer import logo_size
+    logo = write_source(tmp_path, "PNG", 8)
+    spec = WatermarkSpec(watermark_type="image", logo_path=logo, logo_scale=0.5)
+    width, height = logo_size(spec, 400, 400)
+    assert width < height  # 96x64 的 Logo 按方向 8 转正后是竖的
@@ -0,0 +1,148 @@
+"""水印渲染的参考图测试
+
+九宫格位置 × 旋转 × 阴影/描边 × 透明度的每种组合都与 golden 中的参考图比较：
+同一组样式的 9 个位置画在同一张底图上。另有 templates 中自带的模板、平铺、相对布局和图片水印。
+NumPy 后端的输出按 numpy_backend 的容差与 QPainter 比较。
+"""
+import os
+import itertools
+from dataclasses import replace
+
+import pytest
+from PySide6.QtGui import QImage, QColor, QPainter
+from PySide6.QtCore import Qt
+
+from renderer import (
+    POSITION_MODES, TILE_MODE, WatermarkSpec, composite, get_backend, render, set_backend, watermark_rect,
+)
+from templates import read_template
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "..", "templates")
+SHEET_SIZE = (480, 360)
+
+ROTATIONS = (0, 30, -61)
+STYLES = {
+    "plain": {},
+    "shadow": {"shadow_enabled": True},
+    "outline": {"outline_enabled": True},
+    "shadow+outline": {"shadow_enabled": True, "outline_enabled": True},
+}
+OPACITIES = (255, 128)
+CASES = list(itertools.product(ROTATIONS, STYLES, OPACITIES))
+
+
+def case_id(case):
+    angle, style, opacity = case
+    return f"rot{angle}-{style}-a{opacity}"
+
+
+def canvas(width, height, block=40):
+    """确定性的底图：明暗和色相各不相同的纯色方块，水印会跨过多种底色（不依赖图片解码）"""
+    import numpy as np
+    from numpy_backend import qimage_array
+
+    image = QImage(width, height, QImage.Format_RGB32)
+    pixels = qimage_array(image)
+    col = np.arange(width, dtype=np.int32)[None, :] // block
+    row = np.arange(height, dtype=np.int32)[:, None] // block
+    pixels[..., 0] = (col * 67 + row * 29) % 256  # B
+    pixels[..., 1] = (row * 53) % 256  # G
+    pixels[..., 2] = (col * 41 + 96) % 256  # R
+    pixels[..., 3] = 255
+    return image
+
+
+def base_spec():
+    """以 templates/1.json 为基础，字号缩小到九个位置互不重叠"""
+    spec = WatermarkSpec.from_template(read_template(os.path.join(TEMPLATES_DIR, "1.json")))
+    return replace(spec, font_size=28)
+
+
+def case_spec(case):
+    angle, style, opacity = case
+    return replace(base_spec(), watermark_angle=angle, font_opacity=opacity, **STYLES[style])
+
+
+def render_sheet(spec, size=SHEET_SIZE):
+    image = canvas(*size)
+    for mode in POSITION_MODES:
+        composite(image, replace(spec, watermark_pos_mode=mode))
+    return image
+
+
+@pytest.fixture(autouse=True)
+def qpainter_backend():
+    # 参考图用默认的 QPainter 后端生成，不受环境变量 WATERMARK_BACKEND 影响
+    original = get_backend()
+    set_backend("qpainter")
+    yield
+    set_backend(original)
+
+
+@pytest.fixture(scope="module")
+def logo_path(tmp_path_factory):
+    """带透明通道、左右不对称的 Logo"""
+    logo = QImage(120, 60, QImage.Format_ARGB32)
+    logo.fill(Qt.transparent)
+    painter = QPainter(logo)
+    painter.fillRect(0, 0, 60, 60, QColor(220, 40, 40, 255))
+    painter.fillRect(60, 15, 60, 30, QColor(40, 40, 220, 160))
+    painter.end()
+    path = str(tmp_path_factory.mktemp("logo") / "logo.png")
+    logo.save(path)
+    return path
+
+
+@pytest.mark.parametrize("case", CASES, ids=case_id)
+def test_nine_grid(golden, case):
+    golden(f"grid-{case_id(case)}", render_sheet(case_spec(case)))
+
+
+@pytest.mark.parametrize("name", ["1", "2"])
+def test_bundled_template(golden, name):
+    spec = WatermarkSpec.from_template(read_template(os.path.join(TEMPLATES_DIR, f"{name}.json")))
+    golden(f"template-{name}", composite(canvas(1000, 700), spec), (spec.font_family,))
+
+
+def test_tile(golden):
+    spec = replace(base_spec(), watermark_pos_mode=TILE_MODE, watermark_angle=30, font_opacity=160, tile_spacing=60)
+    golden("tile-rot30", composite(canvas(*SHEET_SIZE), spec))
+
+
+@pytest.mark.parametrize("size", [(640, 480), (480, 640)], ids=["landscape", "portrait"])
+def test_relative_layout(golden, size):
+    spec = replace(
+        base_spec(), font_scale=0.06, watermark_pos_mode="custom", watermark_custom_pos_rel=(0.3, 0.7),
+        shadow_enabled=True,
+    )
+    golden(f"relative-{size[0]}x{size[1]}", composite(canvas(*size), spec))
+
+
+def test_logo(golden, logo_path):
+    spec = WatermarkSpec(watermark_type="image", logo_path=logo_path, logo_scale=0.2, font_opacity=200, watermark_angle=30)
+    golden("logo-rot30", render_sheet(spec), ())
+
+
+def test_render_leaves_input_untouched():
+    image = canvas(*SHEET_SIZE)
+    before = image.copy()
+    rendered = render(image, replace(base_spec(), watermark_pos_mode="center"))
+    assert image == before
+    assert rendered != before
+
+
+@pytest.mark.parametrize("case", CASES, ids=case_id)
+def test_numpy_backend_matches_qpainter(case):
+    numpy_backend = pytest.importorskip("numpy_backend")
+    # 在完整的水印区域内比较：区域被画布边缘裁掉一部分时文字边缘占比变大，99 分位数不再可比
+    spec = replace(case_spec(case), watermark_pos_mode="center")
+    outputs = {}
+    for backend in ("qpainter", "numpy"):
+        set_backend(backend)
+        outputs[backend] = composite(canvas(*SHEET_SIZE), spec)
+    rect = watermark_rect(spec, *SHEET_SIZE, outputs["qpainter"].dotsPerMeterX(), outputs["qpainter"].dotsPerMeterY())
+    mean, p99, _ = numpy_backend.difference(outputs["qpainter"].copy(rect), outputs["numpy"].copy(rect))
+    assert mean <= numpy_backend.MAX_MEAN_DIFF and p99 <= numpy_backend.MAX_P99_DIFF, (
+        f"平均差异 {mean:.2f}，99 分位 {p99:.0f}"
+    )
@@ -0,0 +1,41 @@
+"""后台扫描：第一张图片立即送出，之后的批次按时间刷新，不必等下一张图片"""
+import scanner
+from scanner import ScanThread
+
+
+def test_scan_emits_first_path_and_flushes_on_time(qapp, monkeypatch):
+    steps = []
+    clock = [0.0]
+    monkeypatch.setattr(scanner.time, "monotonic", lambda: clock[0])
+
+    def fake_walk(paths, cancel_event):
+        steps.append("a")
+        yield "a.jpg"
+        steps.append("b")
+        yield "b.jpg"
+        # 之后很久都只有不是图片的目录项
+        for _ in range(3):
+            steps.append("idle")
+            clock[0] += ScanThread.BATCH_INTERVAL
+            yield None
+        steps.append("c")
+        yield "c.jpg"
+
+    monkeypatch.setattr(scanner, "_walk", fake_walk)
+    thread = ScanThread(["in"])
+    emitted = []
+    thread.found.connect(lambda batch: emitted.append((list(batch), list(steps))))
+    thread.run()
+
+    assert [batch for batch, _ in emitted] == [["a.jpg"], ["b.jpg"], ["c.jpg"]]
+    # a 在继续扫描之前发出，b 在下一张图片出现之前就按时间发出
+    assert emitted[0][1] == ["a"]
+    assert "c" not in emitted[1][1]
+
+
+def test_iter_images_skips_other_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("x.jpg", "notes.txt", "sub/y.PNG", "sub/z.doc"):
+        (tmp_path / name).write_bytes(b"")
+    found = sorted(scanner.iter_images([str(tmp_path)]))
+    assert found == [str(tmp_path / "sub" / "y.PNG"), str(tmp_path / "x.jpg")]
@@ -0,0 +1,109 @@
+"""HTTP 水印服务：正常请求、参数错误，以及超出在途上限时返回 503 和 Retry-After"""
+import io
+import json
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+import pytest
+from PIL import Image
+
+import server
+from server import WatermarkServer, WatermarkService
+from templates import TemplateStore
+
+
+TEMPLATE = {"text": "deded", "font_size": 24}
+
+
+def image_bytes(size=(320, 240), fmt="JPEG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (40, 90, 160)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def service(tmp_path_factory):
+    """一个工作进程、不排队：同一时刻只接受一个在途请求"""
+    store = TemplateStore(str(tmp_path_factory.mktemp("templates")))
+    store.save("t", TEMPLATE)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(server, "template_store", store)
+        httpd = WatermarkServer("127.0.0.1", 0, WatermarkService(max_workers=1, max_queue=0))
+        httpd.start()
+        try:
+            yield httpd
+        finally:
+            httpd.stop()
+
+
+def request(httpd, method, path, body=None):
+    """返回 (状态码, 响应头, 响应体)"""
+    url = urlsplit(httpd.url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+    try:
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def test_watermark(service):
+    status, headers, body = request(service, "POST", "/watermark?template=t", image_bytes())
+    assert status == 200 and headers["Content-Type"] == "image/jpeg"
+    with Image.open(io.BytesIO(body)) as im:
+        assert im.format == "JPEG" and im.size == (320, 240)
+
+    status, headers, body = request(service, "POST", "/watermark?template=t&format=png&quality=80", image_bytes())
+    assert status == 200 and headers["Content-Type"] == "image/png"
+    assert body.startswith(b"\x89PNG")
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/watermark?template=missing", 404),
+    ("/watermark?template=../t", 400),
+    ("/watermark?template=t&quality=0", 400),
+    ("/watermark?template=t&quality=abc", 400),
+    ("/watermark?template=t&format=gif", 400),
+    ("/other?template=t", 404),
+])
+def test_request_errors(service, path, expected):
+    status, _, body = request(service, "POST", path, image_bytes())
+    assert status == expected
+    assert json.loads(body)["error"]
+
+
+def test_undecodable_image(service):
+    status, _, _ = request(service, "POST", "/watermark?template=t", b"not an image")
+    assert status == 400
+
+
+def test_busy_returns_503_with_retry_after(service):
+    # 先发一个慢请求（大图编码成 PNG）占住唯一的名额，再发的请求立即被拒绝
+    slow = {}
+    thread = threading.Thread(target=lambda: slow.update(result=request(
+        service, "POST", "/watermark?template=t&format=png", image_bytes((4000, 3000), "PNG"),
+    )))
+    rejected = service.service.rejected
+    thread.start()
+    deadline = time.monotonic() + 30
+    while service.service.in_flight == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    status, headers, body = request(service, "POST", "/watermark?template=t", image_bytes())
+    thread.join(60)
+    assert status == 503 and headers["Retry-After"] == "1"
+    assert json.loads(body)["error"]
+    assert service.service.rejected == rejected + 1
+    assert slow["result"][0] == 200
+
+    # 名额在任务的完成回调中归还，可能略晚于响应；归还后恢复正常
+    while service.service.in_flight:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert request(service, "POST", "/watermark?template=t", image_bytes())[0] == 200
+    status, _, body = request(service, "GET", "/metrics")
+    metrics = json.loads(body)
+    assert status == 200 and metrics["rejected"] >= 1
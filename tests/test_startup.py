@@ -0,0 +1,23 @@
+"""启动测量参数：预算缺少或不是数字时输出用法并以返回码 2 退出"""
+import pytest
+
+from startup import DEFAULT_BUDGET_MS, parse_args
+
+
+def test_parse_args():
+    assert parse_args(["main.py", "--startup-time", "-style", "fusion"]) == (
+        ["main.py", "-style", "fusion"], True, DEFAULT_BUDGET_MS,
+    )
+    assert parse_args(["main.py", "--startup-budget", "800"]) == (["main.py"], False, 800.0)
+    assert parse_args(["main.py", "--startup-budget=12.5"]) == (["main.py"], False, 12.5)
+
+
+@pytest.mark.parametrize("argv", [
+    ["--startup-budget"], ["--startup-budget", "fast"], ["--startup-budget="], ["--startup-budget=-1"],
+])
+def test_bad_budget(argv, capsys):
+    with pytest.raises(SystemExit) as e:
+        parse_args(["main.py", "--startup-time", *argv])
+    assert e.value.code == 2
+    err = capsys.readouterr().err
+    assert "用法" in err and "--startup-budget" in err
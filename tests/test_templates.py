@@ -0,0 +1,159 @@
+"""模板存取：模板名检查、原子保存，以及按修改时间失效的缓存"""
+import os
+import json
+import time
+import threading
+
+import pytest
+
+import templates
+from templates import SCHEMA_VERSION, TemplateStore
+
+
+TEMPLATE = {"text": "deded", "font_size": 24}
+OLD = time.time() - 3600  # 早于 _RACY_SECONDS 的修改时间，缓存才会生效
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TemplateStore(str(tmp_path))
+
+
+def write(store, name, data, mtime=OLD):
+    """绕过 save() 直接改写模板文件，并把修改时间设为 mtime"""
+    path = store.path(name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+@pytest.mark.parametrize("name", ["", "a/b", "a\\b", ".hidden", "..", "last_template"])
+def test_invalid_names(store, name):
+    with pytest.raises(ValueError):
+        store.check_name(name)
+    for method in (store.get, store.delete):
+        with pytest.raises(ValueError):
+            method(name)
+    with pytest.raises(ValueError):
+        store.save(name, TEMPLATE)
+    assert not os.listdir(store.folder)
+
+
+def test_save_and_list(store):
+    template = store.save("水印 1", TEMPLATE)
+    assert template.spec.text == "deded" and template.schema_version == SCHEMA_VERSION
+    with open(store.path("水印 1"), encoding="utf-8") as f:
+        assert json.load(f)["schema_version"] == SCHEMA_VERSION
+    store.set_last("水印 1")
+    # 临时文件和记录上次模板的文件都不算模板
+    open(os.path.join(store.folder, ".draft.json"), "w").close()
+    assert store.names() == ["水印 1"]
+    assert store.last() == "水印 1"
+    store.delete("水印 1")
+    assert store.get("水印 1") is None and store.names() == []
+
+
+def test_failed_save_keeps_previous_file(store):
+    store.save("t", TEMPLATE)
+    with open(store.path("t"), "rb") as f:
+        before = f.read()
+    # 写到一半出错：原文件不变，临时文件被清理
+    with pytest.raises(TypeError):
+        store.save("t", dict(TEMPLATE, text=object()))
+    with open(store.path("t"), "rb") as f:
+        assert f.read() == before
+    assert sorted(os.listdir(store.folder)) == ["t.json"]
+    assert store.get("t").spec.text == "deded"
+
+
+def test_readers_never_see_partial_file(store):
+    store.save("t", TEMPLATE)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                with open(store.path("t"), encoding="utf-8") as f:
+                    json.load(f)
+            except ValueError as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for i in range(200):
+            store.save("t", dict(TEMPLATE, text="x" * (i * 50)))
+    finally:
+        stop.set()
+        reader.join()
+    assert not errors
+
+
+def test_cache_invalidated_by_mtime(store):
+    write(store, "t", TEMPLATE)
+    first = store.get("t")
+    assert store.get("t") is first
+    assert (store.loads, store.hits) == (1, 1)
+
+    # 内容和修改时间都变了：重新解析
+    write(store, "t", dict(TEMPLATE, text="changed"), OLD + 10)
+    assert store.get("t").spec.text == "changed"
+    assert store.loads == 2
+
+    # 改写后大小不变（只改了大小写），靠修改时间发现变化
+    write(store, "t", dict(TEMPLATE, text="CHANGED"), OLD + 20)
+    assert store.get("t").spec.text == "CHANGED"
+    assert store.loads == 3
+
+
+def test_recent_file_not_cached(store):
+    # 刚写入的文件在同一时间片内可能再被改写而修改时间不变，不缓存
+    write(store, "t", TEMPLATE, time.time())
+    store.get("t")
+    store.get("t")
+    assert (store.loads, store.hits) == (2, 0)
+
+
+def test_names_follow_directory_changes(store):
+    write(store, "a", TEMPLATE)
+    os.utime(store.folder, (OLD, OLD))
+    assert store.names() == ["a"]
+    write(store, "b", TEMPLATE)  # 目录的修改时间随之变化
+    assert store.names() == ["a", "b"]
+    os.remove(store.path("a"))
+    assert store.names() == ["b"]
+
+
+def test_versions(store):
+    # 没有 schema_version 的旧模板按版本 1 读取；比程序新的版本拒绝
+    write(store, "old", TEMPLATE)
+    assert store.get("old").schema_version == 1
+    write(store, "new", dict(TEMPLATE, schema_version=SCHEMA_VERSION + 1))
+    with pytest.raises(ValueError):
+        store.get("new")
+
+
+def test_read_template_by_name_or_path(store, monkeypatch):
+    path = write(store, "t", TEMPLATE)
+    monkeypatch.setattr(templates, "template_store", store)
+    assert templates.read_template("t")["text"] == "deded"
+    assert templates.read_template(path)["schema_version"] == SCHEMA_VERSION
+    with pytest.raises(FileNotFoundError):
+        templates.read_template("missing")
+
+
+@pytest.mark.parametrize("content", ["[]", '"x"', "3", "null"])
+def test_template_not_an_object(tmp_path, capsys, content):
+    from cli import main
+
+    path = tmp_path / "bad.json"
+    path.write_text(content, encoding="utf-8")
+    with pytest.raises(ValueError, match="bad.json"):
+        templates.read_template(str(path))
+    # 命令行给出错误信息并返回 2，而不是抛出异常
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    assert main(["batch", "--template", str(path), "--in", str(in_dir), "--out", str(tmp_path / "out")]) == 2
+    assert "bad.json" in capsys.readouterr().err
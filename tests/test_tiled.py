@@ -0,0 +1,100 @@
+"""未压缩 TIFF 的分块导出：结果与整图导出逐像素相同，水印以外的行逐字节保留"""
+import numpy as np
+import pytest
+from PIL import Image
+from PySide6.QtCore import QRect
+
+from batch import export_one
+from renderer import WatermarkSpec, sprite_placement
+from tiled import export_tiled, raw_tiff_layout
+
+
+SIZE = (600, 400)
+SPEC = WatermarkSpec(
+    text="deded", font_size=40, shadow_enabled=True, outline_enabled=True, watermark_angle=30,
+    watermark_pos_mode="center",
+)
+DESCRIPTION = "tiled export test"
+
+
+def source_image(mode):
+    """渐变叠加固定种子的噪声，水印盖住的每一行都会变"""
+    width, height = SIZE
+    gradient = np.linspace(0, 160, width, dtype=np.float32)[None, :, None]
+    noise = np.random.default_rng(2024).integers(0, 96, (height, width, 3))
+    return Image.fromarray((gradient + noise).astype(np.uint8), "RGB").convert(mode)
+
+
+def write_tiff(path, mode="RGB", **options):
+    source_image(mode).save(path, "TIFF", tiffinfo={270: DESCRIPTION}, **options)
+    return str(path)
+
+
+def covered_rect(spec, width, height, dpm_x, dpm_y):
+    sprite, origin = sprite_placement(spec, width, height, dpm_x, dpm_y)
+    return QRect(origin, sprite.image.size()).intersected(QRect(0, 0, width, height))
+
+
+def pixels(path, mode):
+    with Image.open(path) as im:
+        return np.asarray(im.convert(mode)).astype(np.int16)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L"])
+def test_matches_full_export(tmp_path, mode):
+    src = write_tiff(tmp_path / "src.tif", mode)
+    assert export_tiled(src, str(tmp_path / "tiled.tif"), SPEC)
+    # 同样的像素存成 PNG，只能走整图 解码 → 绘制 → 编码
+    png = str(tmp_path / "src.png")
+    Image.open(src).save(png)
+    export_one(png, str(tmp_path / "full.tiff"), "TIFF", SPEC)
+    tiled = pixels(tmp_path / "tiled.tif", mode)
+    assert (tiled == pixels(tmp_path / "full.tiff", mode)).all()
+    assert (tiled != pixels(src, mode)).any()
+
+
+def test_rows_outside_watermark_untouched(tmp_path):
+    src = write_tiff(tmp_path / "src.tif")
+    dst = str(tmp_path / "dst.tif")
+    assert export_tiled(src, dst, SPEC)
+    (width, height), (dpm_x, dpm_y), tiles = raw_tiff_layout(src)
+    (_, y0, _, _, offset, stride, _), = tiles
+    covered = covered_rect(SPEC, width, height, dpm_x, dpm_y)
+    assert 0 < covered.top() and covered.bottom() < height - 1
+    start = offset + (covered.top() - y0) * stride
+    end = offset + (covered.bottom() + 1 - y0) * stride
+    with open(src, "rb") as f:
+        before = f.read()
+    with open(dst, "rb") as f:
+        after = f.read()
+    assert len(after) == len(before)
+    assert after[:start] == before[:start]  # 文件头、标签和水印上方的行
+    assert after[end:] == before[end:]
+    assert after[start:end] != before[start:end]
+
+
+def test_export_one_keeps_tags(tmp_path):
+    # 走分块路径时原文件的标签原样保留，整图编码则不会写 ImageDescription
+    src = write_tiff(tmp_path / "src.tif")
+    dst = str(tmp_path / "dst.tiff")
+    export_one(src, dst, "TIFF", SPEC)
+    with Image.open(dst) as im:
+        assert im.tag_v2.get(270) == DESCRIPTION
+
+
+def test_without_watermark_copies_source(tmp_path):
+    src = write_tiff(tmp_path / "src.tif")
+    dst = str(tmp_path / "dst.tif")
+    assert export_tiled(src, dst, WatermarkSpec(text=""))
+    with open(src, "rb") as a, open(dst, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_compressed_tiff_falls_back(tmp_path):
+    src = write_tiff(tmp_path / "src.tif", compression="tiff_lzw")
+    assert raw_tiff_layout(src) is None
+    assert not export_tiled(src, str(tmp_path / "tiled.tif"), SPEC)
+    # export_one 改走整图路径，水印照样画上
+    dst = str(tmp_path / "dst.tiff")
+    export_one(src, dst, "TIFF", SPEC)
+    assert (pixels(dst, "RGB") != pixels(src, "RGB")).any()
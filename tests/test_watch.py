@@ -0,0 +1,182 @@
+"""监视文件夹：写到一半的文件等稳定后才处理，重启后已处理且未变化的文件跳过，失败计入 failed"""
+import os
+import time
+import shutil
+import threading
+
+import pytest
+from PIL import Image
+
+from manifest import ExportManifest
+from renderer import WatermarkSpec
+from watch import FolderWatcher, InotifySource
+
+
+SPEC = WatermarkSpec(text="deded", font_size=12)
+TIMEOUT = 30
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.05)
+
+
+class Running:
+    """在后台线程运行 FolderWatcher，记录每次回调 (时刻, src, dst, error)"""
+
+    def __init__(self, in_dir, out_dir, manifest=False, **options):
+        self.events = []
+        self.watcher = FolderWatcher(
+            SPEC, in_dir, out_dir, max_workers=1,
+            manifest=ExportManifest(out_dir) if manifest else None, **options,
+        )
+        self.thread = threading.Thread(target=self._run)
+        self.thread.start()
+
+    def _run(self):
+        self.result = self.watcher.run(
+            lambda src, dst, error, latency: self.events.append((time.monotonic(), src, dst, error))
+        )
+
+    def wait_for(self, count):
+        wait_until(lambda: len(self.events) >= count)
+
+    def wait_started(self):
+        # 事件源打开之后的文件事件才会被收到
+        wait_until(lambda: self.watcher.source is not None)
+
+    def stop(self):
+        self.watcher.stop()
+        self.thread.join(TIMEOUT)
+        assert not self.thread.is_alive()
+        return self.result
+
+
+@pytest.fixture
+def folders(tmp_path):
+    in_dir, out_dir = tmp_path / "in", tmp_path / "out"
+    in_dir.mkdir()
+    return str(in_dir), str(out_dir)
+
+
+def jpeg_bytes(tmp_path, name="src.jpg", color=(40, 90, 160)):
+    path = tmp_path / name
+    Image.new("RGB", (320, 240), color).save(path, quality=90)
+    return path.read_bytes()
+
+
+def test_waits_for_partial_file_to_settle(tmp_path, folders):
+    in_dir, out_dir = folders
+    data = jpeg_bytes(tmp_path)
+    # 定时扫描只能看到大小和修改时间，文件停止变化 settle 秒后才处理
+    running = Running(in_dir, out_dir, poll=True, poll_interval=0.05, settle=1.0)
+    try:
+        path = os.path.join(in_dir, "photo.jpg")
+        with open(path, "wb") as f:
+            f.write(data[:len(data) // 2])
+            f.flush()
+            time.sleep(0.6)
+            f.write(data[len(data) // 2:])
+        completed = time.monotonic()
+        running.wait_for(1)
+        time.sleep(0.3)
+    finally:
+        processed, failed = running.stop()
+    (at, src, dst, error), = running.events
+    assert error is None and (processed, failed) == (1, 0)
+    assert src == path and at - completed >= 0.9
+    with Image.open(dst) as im:
+        im.load()
+        assert im.size == (320, 240)
+
+
+@pytest.mark.skipif(not hasattr(os, "uname") or os.uname().sysname != "Linux", reason="需要 inotify")
+def test_moved_in_file_needs_no_settle(tmp_path, folders):
+    in_dir, out_dir = folders
+    jpeg_bytes(tmp_path, "moved.jpg")
+    running = Running(in_dir, out_dir, settle=10)
+    try:
+        running.wait_started()
+        started = time.monotonic()
+        shutil.move(str(tmp_path / "moved.jpg"), os.path.join(in_dir, "moved.jpg"))
+        running.wait_for(1)
+    finally:
+        running.stop()
+    assert isinstance(running.watcher.source, InotifySource)
+    (at, _, _, error), = running.events
+    assert error is None and at - started < 10
+
+
+def test_restart_skips_processed_files(tmp_path, folders):
+    in_dir, out_dir = folders
+    for i in range(2):
+        (tmp_path / "in" / f"{i}.jpg").write_bytes(jpeg_bytes(tmp_path, color=(40 * i, 90, 160)))
+    running = Running(in_dir, out_dir, manifest=True, settle=0.2)
+    try:
+        running.wait_for(2)
+    finally:
+        assert running.stop() == (2, 0)
+
+    running = Running(in_dir, out_dir, manifest=True, settle=0.2)
+    try:
+        # 启动时的扫描全部命中清单；随后改写其中一张，只处理这一张
+        wait_until(lambda: running.watcher.skipped == 2)
+        assert not running.events
+        (tmp_path / "in" / "1.jpg").write_bytes(jpeg_bytes(tmp_path, color=(250, 250, 0)))
+        running.wait_for(1)
+    finally:
+        assert running.stop() == (1, 0)
+    assert running.events[0][1] == os.path.join(in_dir, "1.jpg")
+
+
+def test_failures_are_counted(folders):
+    in_dir, out_dir = folders
+    with open(os.path.join(in_dir, "broken.jpg"), "wb") as f:
+        f.write(b"not an image")
+    running = Running(in_dir, out_dir, settle=0.2)
+    try:
+        running.wait_for(1)
+    finally:
+        assert running.stop() == (0, 1)
+    assert running.events[0][3] is not None
+
+
+def test_polled_file_is_processed_once(tmp_path, folders):
+    in_dir, out_dir = folders
+    (tmp_path / "in" / "a.jpg").write_bytes(jpeg_bytes(tmp_path))
+    # 处理期间定时扫描还会看到这个文件，处理完后不应再处理一次
+    running = Running(in_dir, out_dir, poll=True, poll_interval=0.05)
+    try:
+        running.wait_for(1)
+        time.sleep(1.0)
+    finally:
+        processed, failed = running.stop()
+    assert (processed, failed) == (1, 0)
+
+
+def test_forgets_removed_sources(tmp_path, folders):
+    in_dir, out_dir = folders
+    data = jpeg_bytes(tmp_path)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (tmp_path / "in" / name).write_bytes(data)
+    running = Running(in_dir, out_dir, poll=True, poll_interval=0.05)
+    try:
+        running.wait_for(3)
+        os.remove(os.path.join(in_dir, "a.jpg"))
+        os.remove(os.path.join(in_dir, "b.jpg"))
+        # 记录数超过阈值时清理（这里直接把阈值降到 0）
+        running.watcher._prune_at = 0
+        # 已删除的源文件不再占用记录和输出路径
+        c = os.path.join(in_dir, "c.jpg")
+        wait_until(lambda: list(running.watcher._done) == [c])
+        assert list(running.watcher.outputs._assigned) == [c]
+        os.makedirs(os.path.join(in_dir, "sub"))
+        shutil.copy(c, os.path.join(in_dir, "sub", "a.jpg"))
+        running.wait_for(4)
+    finally:
+        processed, failed = running.stop()
+    assert (processed, failed) == (4, 0)
+    # 释放的输出路径可以分配给新的同名文件
+    assert running.events[-1][2] == os.path.join(out_dir, "a_watermarked.jpeg")
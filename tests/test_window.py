@@ -0,0 +1,113 @@
+"""主窗口读取模板：旧模板按原图像素解释，与命令行一致；像素位置在拖拽时才换算为比例"""
+import os
+import json
+import shutil
+
+import pytest
+from PIL import Image
+
+import main
+from renderer import WatermarkSpec, watermark_rect
+from templates import TemplateStore, read_template
+
+
+SIZE = (600, 400)
+# 没有 schema_version、只有像素位置的旧模板
+LEGACY = {
+    "text": "deded", "font_size": 36, "watermark_pos_mode": "custom", "watermark_custom_pos": [450, 100],
+}
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    folder = tmp_path / "templates"
+    folder.mkdir()
+    (folder / "legacy.json").write_text(json.dumps(LEGACY), encoding="utf-8")
+    monkeypatch.setattr(main, "template_store", TemplateStore(str(folder)))
+    # 没有打开图片时 apply_watermark 会弹出提示框
+    monkeypatch.setattr(main.QMessageBox, "warning", lambda *args: None)
+    w = main.MainWindow()
+    yield w
+    w.close()
+
+
+REPO_TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "templates", "1.json")
+
+
+def center(spec, size=SIZE):
+    rect = watermark_rect(spec, *size, 3780, 3780)
+    return rect.center().x(), rect.center().y()
+
+
+def open_image(window, tmp_path, size=SIZE):
+    path = str(tmp_path / "src.png")
+    Image.new("RGB", size, (40, 90, 160)).save(path)
+    window.load_image(path)
+
+
+def test_legacy_template_matches_cli(window, tmp_path):
+    # 界面与命令行读取同一个旧模板，水印落在同样的位置、同样的大小
+    shutil.copy(REPO_TEMPLATE, tmp_path / "templates" / "repo.json")
+    cli_spec = WatermarkSpec.from_template(read_template(REPO_TEMPLATE))
+    window.load_template("repo")
+    sizes = ((4000, 3000), (800, 600), SIZE)
+    for _ in range(2):
+        spec = window.watermark_spec()
+        assert spec.font_scale is None and spec.margin_scale is None
+        for size in sizes:
+            assert watermark_rect(spec, *size, 3780, 3780) == watermark_rect(cli_spec, *size, 3780, 3780)
+        # 打开图片之后也一样
+        open_image(window, tmp_path)
+
+    window.save_template("copy")
+    saved = main.template_store.get("copy").spec
+    for size in sizes:
+        assert watermark_rect(saved, *size, 3780, 3780) == watermark_rect(cli_spec, *size, 3780, 3780)
+
+
+def test_legacy_custom_pos(window, tmp_path):
+    window.load_template("legacy")
+    assert window.watermark_pos_mode == "custom"
+    pending = window.watermark_spec()
+    assert pending.watermark_custom_pos == (450, 100)
+    assert pending.watermark_custom_pos_rel is None
+    assert center(pending) == center(WatermarkSpec.from_template(LEGACY))
+
+    # 另存时像素位置原样写回
+    window.save_template("copy")
+    assert main.template_store.get("copy").spec.watermark_custom_pos == (450, 100)
+
+    # 打开图片不改变位置；开始拖拽时才按原图尺寸换算为比例
+    open_image(window, tmp_path)
+    assert window.watermark_spec() == pending
+    window.convert_legacy_custom_pos()
+    spec = window.watermark_spec()
+    assert spec.watermark_custom_pos_rel == pytest.approx((0.75, 0.25))
+    assert spec.watermark_custom_pos is None
+    assert center(spec) == center(pending)
+
+
+def test_preset_clears_legacy_custom_pos(window):
+    window.load_template("legacy")
+    window.set_watermark_pos_mode("center")
+    spec = window.watermark_spec()
+    assert spec.watermark_custom_pos is None and spec.watermark_custom_pos_rel is None
+
+
+def test_close_waits_for_background_tasks(window, tmp_path):
+    from image_cache import image_cache
+
+    paths = []
+    for i in range(6):
+        path = str(tmp_path / f"{i}.png")
+        Image.new("RGB", (1600, 1200), (40 * i, 90, 160)).save(path)
+        paths.append(path)
+    window.text_input.setText("deded")
+    window.load_image(paths[0])
+    window.schedule_preview()
+    image_cache.prefetch(paths[1:])
+    for path in paths:
+        window.thumbnail_loader.request(path)
+    window.close()
+    pools = (window.thumbnail_loader._pool, window.preview_scheduler._pool, image_cache._pool)
+    assert all(pool.activeThreadCount() == 0 for pool in pools)